@@ -2,22 +2,44 @@
 # Chứa các hàm xử lý audio chung cho server
 
 from .audio_processing import audio_preprocessing_improved
-from .speech_recognition import transcribe_audio_with_google
+from .feature_cache import FeatureCache, get_feature_cache
+from .noise_floor import RollingQuantile, NoiseFloorEstimator, adaptive_speech_threshold
+from .keyword_spotter import KeywordSpotter, get_keyword_spotter
+from .wake_word_matcher import WakeWordMatcher, get_wake_word_matcher, normalize_for_matching
+from .speech_recognition import transcribe_audio_with_google, transcribe_with_deadline, transcribe_offline
+from .resilience import Deadline, CircuitBreaker, StageTimeout, get_breaker, get_resilience_stats
 from .file_utils import save_audio_to_wav, save_transcription_to_txt
 from .dependencies import check_audio_dependencies, get_installation_commands
 from .transcript_logger import TranscriptLogger
 from .server_config import *
 from .udp_handler import send_led_command, udp_listener
-from .wake_word_handler import check_wake_word, process_wake_word_detection, process_question_capture, reset_question_mode
-from .asr_processor import asr_worker
+from .wake_word_handler import check_wake_word, find_wake_word, split_wake_word, process_wake_word_detection, process_question_capture, reset_question_mode, open_follow_up_window, close_follow_up_window
+from .asr_processor import asr_worker, VoiceActivityDetector, AmplitudeVAD, SpectralVAD, create_vad
 from .flask_server import create_app, create_templates
-from .gemini_api import ask_gemini, gemini_ask
-from .tts_utils import text_to_audio_file, play_audio_file, text_to_speech, text_to_speech_esp32, convert_mp3_to_wav
+from .gemini_api import ask_gemini, ask_gemini_stream, gemini_ask, get_conversation_history, get_parse_stats, record_conversation_turn, drain_memory_consolidator, get_response_cache_stats, get_scheduler_stats, get_prompt_stats, warm_up_gemini, speculate_answer, commit_speculative_answer
+from .speculation import Speculation, get_speculation_stats
+from .local_intents import answer_locally, match_local_intent, fold_text
+from .memory_store import CachedJsonFile, ConversationJournal, JsonMemoryBackend, flush_memory_stores
+from .sqlite_store import SQLiteMemoryBackend
+from .prompt_builder import PromptBuilder
+from .response_stream import MainResponseStreamParser
+from .memory_consolidator import MemoryConsolidator, has_personal_fact
+from .response_cache import ResponseCache, normalize_question
+from .token_budget import TokenEstimator
+from .llm_scheduler import LLMScheduler, SchedulerTimeout
+from .tts_utils import text_to_audio_file, play_audio_file, text_to_speech, text_to_speech_esp32, convert_mp3_to_wav, SentenceSpeaker, fallback_audio_file, ack_earcon_file, synthesize_wav, preload_tts_cache, split_for_tts, text_to_mp3_bytes, decode_mp3_to_pcm, pcm_to_wav_bytes
+from .tts_cache import TTSCache, get_tts_cache_stats
+from .warmup import warm_up
 from .esp32_audio_sender import ESP32AudioSender, send_audio_to_esp32, send_audio_to_esp32_async
 
 __all__ = [
     'audio_preprocessing_improved',
-    'transcribe_audio_with_google', 
+    'FeatureCache', 'get_feature_cache',
+    'RollingQuantile', 'NoiseFloorEstimator', 'adaptive_speech_threshold',
+    'KeywordSpotter', 'get_keyword_spotter',
+    'WakeWordMatcher', 'get_wake_word_matcher', 'normalize_for_matching',
+    'transcribe_audio_with_google', 'transcribe_with_deadline', 'transcribe_offline',
+    'Deadline', 'CircuitBreaker', 'StageTimeout', 'get_breaker', 'get_resilience_stats',
     'save_audio_to_wav',
     'save_transcription_to_txt',
     'check_audio_dependencies',
@@ -25,20 +47,30 @@ __all__ = [
     'TranscriptLogger',
     # Server configuration
     'HOST', 'UDP_PORT', 'FLASK_PORT', 'COMMAND_PORT', 'WAKE_WORD',
-    'q_audio', 'esp32_address', 'is_listening_for_question', 'shutdown_event',
+    'q_audio', 'esp32_address', 'is_listening_for_question', 'follow_up_active', 'shutdown_event',
     'transcript_logger', 'question_logger',
     # UDP handler
     'send_led_command', 'udp_listener',
     # Wake word handler
-    'check_wake_word', 'process_wake_word_detection', 'process_question_capture', 'reset_question_mode',
+    'check_wake_word', 'find_wake_word', 'split_wake_word', 'process_wake_word_detection', 'process_question_capture', 'reset_question_mode',
+    'open_follow_up_window', 'close_follow_up_window',
     # ASR processor
-    'asr_worker',
+    'asr_worker', 'VoiceActivityDetector', 'AmplitudeVAD', 'SpectralVAD', 'create_vad',
     # Flask server
     'create_app', 'create_templates',
     # Gemini AI integration
-    'ask_gemini', 'gemini_ask',
+    'ask_gemini', 'ask_gemini_stream', 'gemini_ask', 'get_conversation_history', 'get_parse_stats', 'record_conversation_turn', 'drain_memory_consolidator', 'get_response_cache_stats', 'get_scheduler_stats', 'get_prompt_stats', 'warm_up_gemini',
+    'speculate_answer', 'commit_speculative_answer', 'Speculation', 'get_speculation_stats',
+    # Local intents
+    'answer_locally', 'match_local_intent', 'fold_text',
+    # Memory store
+    'CachedJsonFile', 'ConversationJournal', 'JsonMemoryBackend', 'SQLiteMemoryBackend', 'flush_memory_stores',
+    'PromptBuilder', 'MainResponseStreamParser', 'MemoryConsolidator', 'has_personal_fact',
+    'ResponseCache', 'normalize_question', 'TokenEstimator', 'LLMScheduler', 'SchedulerTimeout',
     # TTS utils
-    'text_to_audio_file', 'play_audio_file', 'text_to_speech', 'text_to_speech_esp32', 'convert_mp3_to_wav',
+    'text_to_audio_file', 'play_audio_file', 'text_to_speech', 'text_to_speech_esp32', 'convert_mp3_to_wav', 'SentenceSpeaker', 'fallback_audio_file', 'ack_earcon_file', 'warm_up',
+    'synthesize_wav', 'preload_tts_cache', 'split_for_tts', 'text_to_mp3_bytes', 'decode_mp3_to_pcm', 'pcm_to_wav_bytes',
+    'TTSCache', 'get_tts_cache_stats',
     # ESP32 Audio Sender
     'ESP32AudioSender', 'send_audio_to_esp32', 'send_audio_to_esp32_async'
 ] 
\ No newline at end of file
@@ -4,16 +4,22 @@
 ASR Processor - Xử lý ASR với Google Speech Recognition + Circular Buffer
 """
 
-import struct
 import time
 import tempfile
 import wave
 import os
+from abc import ABC, abstractmethod
+
 import numpy as np
 
 import audio_utils.server_config as config
 from .audio_processing import audio_preprocessing_improved
-from .speech_recognition import transcribe_audio_with_google
+from .feature_cache import get_feature_cache
+from .noise_floor import NoiseFloorEstimator, adaptive_speech_threshold
+from .keyword_spotter import get_keyword_spotter
+from .speech_recognition import transcribe_with_deadline
+from .resilience import Deadline
+from .speculation import Speculation
 from .wake_word_handler import (
     check_wake_word, process_wake_word_detection, 
     process_question_capture, reset_question_mode
@@ -58,9 +64,16 @@ def asr_worker(socketio):
     is_recording = False  # Trạng thái đang record
     consecutive_silence_count = 0
     
+    # Feature cache (STFT/log-mel) thẳng hàng với circular buffer
+    feature_cache = get_feature_cache()
+    feature_cache.reset()
+    vad = create_vad()
+    print(f"🗣️ VAD engine: {vad.name}")
+    keyword_spotter = get_keyword_spotter()
+    
     # Adaptive threshold để cải thiện speech detection
     adaptive_rms_threshold = config.MIN_SPEECH_RMS
-    recent_rms_values = []
+    noise_floor = NoiseFloorEstimator()
     max_recent_rms = 1000  # Giá trị tối đa để tránh quá nhạy
     
     # Thêm tracking để tránh spam API calls
@@ -68,6 +81,7 @@ def asr_worker(socketio):
     
     processed_chunks = 0
     empty_queue_count = 0  # Counter để tránh spam log
+    speculation = None  # Câu hỏi đang được đoán trước (SPECULATION_ENABLED)
     
     while not config.shutdown_event.is_set():
         try:
@@ -90,75 +104,223 @@ def asr_worker(socketio):
             
             # Kiểm tra tiếng ồn (silence detection) với circular buffer
             if len(chunk) >= 2:
-                samples = struct.unpack(f"<{len(chunk)//2}h", chunk)
-                rms = (sum(s*s for s in samples) / len(samples)) ** 0.5
-                max_amp = max(abs(s) for s in samples)
-                
-                # Cập nhật adaptive threshold
-                recent_rms_values.append(rms)
-                if len(recent_rms_values) > 100:  # Giữ 100 giá trị gần nhất
-                    recent_rms_values.pop(0)
+                # Tính đặc trưng 1 lần cho frame, VAD đọc lại từ cache
+                slot = feature_cache.push(chunk)
+                if slot >= 0:
+                    rms = float(feature_cache.rms[slot])
+                    max_amp = float(feature_cache.max_amp[slot])
+                else:
+                    rms = max_amp = 0.0  # Chưa đủ 1 frame 20ms
                 
-                # Tính threshold động dựa trên background noise
-                if len(recent_rms_values) > 20:
-                    background_rms = np.mean(sorted(recent_rms_values)[:20])  # 20 giá trị thấp nhất
-                    adaptive_rms_threshold = max(config.MIN_SPEECH_RMS * 0.5, background_rms * 2)
-                    adaptive_rms_threshold = min(adaptive_rms_threshold, max_recent_rms)
+                # Cập nhật noise nền (rolling quantile O(log n)) và threshold động
+                noise_floor.push(rms)
+                adaptive_rms_threshold = adaptive_speech_threshold(noise_floor, max_recent_rms)
                 
-                # Logic phát hiện speech/silence
-                is_speech = _detect_speech(rms, max_amp, samples, adaptive_rms_threshold)
-                is_silence = _detect_silence(rms, max_amp, samples)
+                # Logic phát hiện speech/silence (VAD engine đọc đặc trưng từ cache)
+                if slot >= 0:
+                    is_speech, is_silence = vad.process(feature_cache, slot, adaptive_rms_threshold)
+                else:
+                    is_speech, is_silence = False, False
                 
                 # Xử lý circular buffer
                 buffer_head, buffer_tail, is_recording, consecutive_silence_count = _process_audio_chunk(
                     chunk, is_speech, is_silence, circular_buffer, buffer_head, buffer_tail,
                     is_recording, consecutive_silence_count, processed_chunks, rms, max_amp
                 )
+                config.utterance_in_progress = is_recording
+                
+                # Đoán trước câu hỏi khi vừa bắt đầu im lặng, hủy nếu người dùng nói tiếp
+                if speculation and is_speech:
+                    speculation = _drop_speculation(speculation, "người dùng nói tiếp")
+                if (config.SPECULATION_ENABLED and speculation is None and is_recording and config.is_listening_for_question
+                        and consecutive_silence_count == config.SPECULATION_SILENCE_FRAMES):
+                    speculation = Speculation(
+                        _extract_audio(circular_buffer, buffer_head, buffer_tail),
+                        config.esp32_address[0] if config.esp32_address else None
+                    )
+                
+                # Keyword spotting cục bộ trên log-mel - không cần chờ Google Speech
+                if is_speech and not config.is_listening_for_question and keyword_spotter.process(feature_cache):
+                    process_wake_word_detection(config.WAKE_WORD, timestamp, seq, socketio)
+                    # Bỏ audio chứa wake word, câu hỏi sẽ được record thành câu mới
+                    speculation = _drop_speculation(speculation)
+                    circular_buffer, buffer_head, buffer_tail, is_recording, consecutive_silence_count = \
+                        _new_recording_state(feature_cache, vad)
+                    continue
                 
             # Kiểm tra điều kiện xử lý audio
             should_process, current_time = _should_process_audio(
                 is_recording, consecutive_silence_count, buffer_head, buffer_tail, last_api_call_time
             )
             
-            if should_process:
+            if should_process and _skip_ambient_asr(keyword_spotter):
+                # Wake word đã do KWS xử lý - không gửi câu nói thường lên cloud ASR
+                print(f"🔕 Bỏ qua câu nói không có wake word (KWS), không gọi Google Speech")
+                speculation = _drop_speculation(speculation)
+                circular_buffer, buffer_head, buffer_tail, is_recording, consecutive_silence_count = \
+                    _new_recording_state(feature_cache, vad)
+            elif should_process:
                 # Xử lý audio và nhận dạng
                 result = _process_audio_recognition(
                     circular_buffer, buffer_head, buffer_tail, 
-                    timestamp, seq, socketio, current_time
+                    timestamp, seq, socketio, current_time, feature_cache, speculation
                 )
+                speculation = _drop_speculation(speculation)  # Không dùng tới thì hủy (đã dùng thì không ảnh hưởng)
                 
                 if result:
                     last_api_call_time = current_time
                 
                 # Reset buffer sau khi xử lý
-                circular_buffer = bytearray(config.CIRCULAR_BUFFER_SIZE)
-                buffer_head = 0
-                buffer_tail = 0
-                is_recording = False
-                consecutive_silence_count = 0
+                circular_buffer, buffer_head, buffer_tail, is_recording, consecutive_silence_count = \
+                    _new_recording_state(feature_cache, vad)
                             
         except Exception as e:
             print(f"❌ Lỗi ASR worker: {e}")
+            speculation = _drop_speculation(speculation)
             reset_question_mode()
+            vad.reset()
             is_recording = False
             consecutive_silence_count = 0
             continue
 
-def _detect_speech(rms, max_amp, samples, adaptive_rms_threshold):
-    """Phát hiện speech từ audio samples"""
+def _drop_speculation(speculation, reason=""):
+    """Hủy lần đoán trước (nếu có), trả về None để gán lại"""
+    if speculation:
+        speculation.cancel(reason)
+    return None
+
+def _extract_audio(circular_buffer, buffer_head, buffer_tail):
+    """Trích xuất audio từ circular buffer (từ tail đến head)"""
+    if buffer_head >= buffer_tail:
+        # Buffer không bị wrap
+        return bytes(circular_buffer[buffer_tail:buffer_head])
+    # Buffer bị wrap, cần nối 2 phần
+    return bytes(circular_buffer[buffer_tail:]) + bytes(circular_buffer[:buffer_head])
+
+def _new_recording_state(feature_cache, vad):
+    """Tạo circular buffer mới và reset feature cache + VAD đi kèm"""
+    config.utterance_in_progress = False
+    feature_cache.reset()
+    vad.reset()
+    return bytearray(config.CIRCULAR_BUFFER_SIZE), 0, 0, False, 0
+
+def _skip_ambient_asr(keyword_spotter):
+    """Câu nói ở chế độ mặc định chỉ lên cloud ASR khi KWS tắt hoặc bật ghi transcript môi trường"""
+    return (
+        keyword_spotter.enabled and
+        not config.is_listening_for_question and
+        not config.KWS_AMBIENT_TRANSCRIPTION
+    )
+
+class VoiceActivityDetector(ABC):
+    """Interface VAD: đọc đặc trưng 1 frame từ FeatureCache, trả về (is_speech, is_silence)"""
+    
+    name = "base"
+    
+    def reset(self):
+        """Xóa trạng thái nội bộ (onset/hangover)"""
+        pass
+    
+    @abstractmethod
+    def process(self, feature_cache, slot, adaptive_rms_threshold):
+        """
+        Phân loại 1 frame
+        
+        Args:
+            feature_cache (FeatureCache): Cache đặc trưng của thiết bị
+            slot (int): Slot của frame cần phân loại
+            adaptive_rms_threshold (float): Ngưỡng RMS động theo noise nền
+        
+        Returns:
+            tuple: (is_speech, is_silence) - cả hai False nghĩa là không rõ ràng
+        """
+
+class AmplitudeVAD(VoiceActivityDetector):
+    """VAD cũ: OR các luật biên độ/RMS"""
+    
+    name = "amplitude"
+    
+    def process(self, feature_cache, slot, adaptive_rms_threshold):
+        rms = float(feature_cache.rms[slot])
+        max_amp = float(feature_cache.max_amp[slot])
+        return _detect_speech(rms, max_amp, adaptive_rms_threshold), _detect_silence(rms, max_amp)
+
+class SpectralVAD(VoiceActivityDetector):
+    """
+    VAD dùng energy + zero-crossing rate + spectral flatness, có onset và hangover.
+    Tiếng click ngắn/noise phẳng phổ không đủ VAD_ONSET_FRAMES frame liên tiếp nên không mở record.
+    """
+    
+    name = "spectral"
+    
+    def __init__(self, max_flatness=None, max_zcr=None, onset_frames=None, hangover_frames=None):
+        self.max_flatness = config.VAD_MAX_FLATNESS if max_flatness is None else max_flatness
+        self.max_zcr = config.VAD_MAX_ZCR if max_zcr is None else max_zcr
+        self.onset_frames = config.VAD_ONSET_FRAMES if onset_frames is None else onset_frames
+        self.hangover_frames = config.VAD_HANGOVER_FRAMES if hangover_frames is None else hangover_frames
+        self.reset()
+    
+    def reset(self):
+        self.in_speech = False
+        self.speech_run = 0  # Số frame speech-like liên tiếp
+        self.hangover = 0    # Số frame hangover còn lại
+    
+    def classify(self, rms, zcr, flatness, rms_threshold):
+        """Phân loại thô từng frame (vector hóa, nhận scalar hoặc np.ndarray)"""
+        return (rms > rms_threshold) & (zcr < self.max_zcr) & (flatness < self.max_flatness)
+    
+    def smooth(self, speech_like):
+        """Áp dụng onset + hangover cho 1 frame, trả về trạng thái speech đã làm mượt"""
+        if speech_like:
+            self.speech_run += 1
+            if self.in_speech or self.speech_run >= self.onset_frames:
+                self.in_speech = True
+                self.hangover = self.hangover_frames
+        else:
+            self.speech_run = 0
+            if self.in_speech:
+                if self.hangover > 0:
+                    self.hangover -= 1
+                else:
+                    self.in_speech = False
+        return self.in_speech
+    
+    def process(self, feature_cache, slot, adaptive_rms_threshold):
+        rms = float(feature_cache.rms[slot])
+        speech_like = bool(self.classify(rms, feature_cache.zcr[slot], feature_cache.flatness[slot],
+                                         adaptive_rms_threshold))
+        is_speech = self.smooth(speech_like)
+        is_silence = not is_speech and rms < config.SILENCE_RMS_THRESHOLD
+        return is_speech, is_silence
+
+VAD_ENGINES = {
+    AmplitudeVAD.name: AmplitudeVAD,
+    SpectralVAD.name: SpectralVAD,
+}
+
+def create_vad(engine=None):
+    """Tạo VAD theo tên (mặc định config.VAD_ENGINE)"""
+    engine = engine or config.VAD_ENGINE
+    if engine not in VAD_ENGINES:
+        print(f"⚠️ VAD engine không hợp lệ: {engine}, dùng '{SpectralVAD.name}'")
+        engine = SpectralVAD.name
+    return VAD_ENGINES[engine]()
+
+def _detect_speech(rms, max_amp, adaptive_rms_threshold):
+    """Phát hiện speech từ đặc trưng frame (RMS, biên độ đỉnh) trong feature cache"""
     return (
         rms > adaptive_rms_threshold or 
         max_amp > config.MIN_AMPLITUDE_THRESHOLD or
-        any(abs(s) > 800 for s in samples) or  # Có ít nhất 1 sample mạnh
+        max_amp > 800 or  # Có ít nhất 1 sample mạnh
         rms > (config.MIN_SPEECH_RMS * 0.5)  # Giảm ngưỡng RMS
     )
 
-def _detect_silence(rms, max_amp, samples):
-    """Phát hiện silence từ audio samples"""
+def _detect_silence(rms, max_amp):
+    """Phát hiện silence từ đặc trưng frame trong feature cache"""
     return (
         rms < config.SILENCE_RMS_THRESHOLD and 
         max_amp < config.SILENCE_AMPLITUDE_THRESHOLD and
-        not any(abs(s) > 800 for s in samples)  # Không có sample mạnh nào
+        not max_amp > 800  # Không có sample mạnh nào
     )
 
 def _process_audio_chunk(chunk, is_speech, is_silence, circular_buffer, buffer_head, buffer_tail,
@@ -248,33 +410,33 @@ def _should_process_audio(is_recording, consecutive_silence_count, buffer_head,
     
     return should_process, current_time
 
-def _process_audio_recognition(circular_buffer, buffer_head, buffer_tail, timestamp, seq, socketio, current_time):
+def _process_audio_recognition(circular_buffer, buffer_head, buffer_tail, timestamp, seq, socketio, current_time,
+                               feature_cache=None, speculation=None):
     """Xử lý nhận dạng giọng nói"""
     
     print(f"🎯 BẮT ĐẦU XỬ LÝ AUDIO")
+    deadline = Deadline()  # Ngân sách thời gian từ lúc nói xong tới khi có câu trả lời
     
     # Trích xuất audio từ circular buffer (từ tail đến head)
-    if buffer_head >= buffer_tail:
-        # Buffer không bị wrap
-        audio_data = bytes(circular_buffer[buffer_tail:buffer_head])
-    else:
-        # Buffer bị wrap, cần nối 2 phần
-        audio_data = bytes(circular_buffer[buffer_tail:]) + bytes(circular_buffer[:buffer_head])
+    audio_data = _extract_audio(circular_buffer, buffer_head, buffer_tail)
     
     print(f"🎵 Audio: {len(audio_data)} bytes, duration: {len(audio_data)//32000:.1f}s")
     
     # Kiểm tra audio quality
     if len(audio_data) >= 2:
-        samples = struct.unpack(f"<{len(audio_data)//2}h", audio_data)
-        rms = (sum(s*s for s in samples) / len(samples)) ** 0.5
-        max_amplitude = max(abs(s) for s in samples)
-        duration_seconds = len(samples) / 16000.0
+        # RMS/biên độ lấy từ giá trị mỗi frame trong feature cache, không duyệt lại từng sample
+        levels = feature_cache.segment_levels(buffer_tail, buffer_head) if feature_cache else None
+        if levels is None:
+            samples = np.frombuffer(audio_data[:len(audio_data) - len(audio_data) % 2], dtype=np.int16).astype(np.float32)
+            levels = float(np.sqrt(np.mean(samples ** 2))), float(np.max(np.abs(samples)))
+        rms, max_amplitude = levels
+        duration_seconds = (len(audio_data) // 2) / 16000.0
         
         # Kiểm tra điều kiện xử lý audio
         should_process_audio = (
             rms > (config.MIN_SPEECH_RMS * 0.5) or  # Giảm ngưỡng RMS
             max_amplitude > (config.MIN_AMPLITUDE_THRESHOLD * 0.5) or  # Giảm ngưỡng amplitude
-            any(abs(s) > 600 for s in samples) or  # Có ít nhất 1 sample mạnh
+            max_amplitude > 600 or  # Có ít nhất 1 sample mạnh
             duration_seconds > 0.5  # Audio đủ dài (ít nhất 0.5s)
         )
         
@@ -283,7 +445,9 @@ def _process_audio_recognition(circular_buffer, buffer_head, buffer_tail, timest
             
             # Áp dụng audio preprocessing
             if config.ENABLE_PREPROCESSING:
-                processed_buffer = audio_preprocessing_improved(audio_data)
+                # Dùng lại STFT đã tính trong feature cache cho noise reduction
+                spectra = feature_cache.get_spectra(buffer_tail, buffer_head) if feature_cache else None
+                processed_buffer = audio_preprocessing_improved(audio_data, spectra=spectra)
             else:
                 processed_buffer = audio_data
             
@@ -293,23 +457,19 @@ def _process_audio_recognition(circular_buffer, buffer_head, buffer_tail, timest
                 try:
                     # Sử dụng Google Speech Recognition để nhận dạng
                     print(f"🔄 Đang gửi lên Google Speech API...")
-                    transcription = transcribe_audio_with_google(wav_file, config.GOOGLE_SPEECH_LANGUAGE)
+                    transcription = transcribe_with_deadline(wav_file, config.GOOGLE_SPEECH_LANGUAGE, deadline)
                     
                     if transcription:
                         # Xử lý transcription dựa trên trạng thái
                         if config.is_listening_for_question:
                             # CHẾ ĐỘ NGHE CÂU HỎI
-                            process_question_capture(transcription, timestamp, socketio)
+                            process_question_capture(transcription, timestamp, socketio, deadline=deadline, speculation=speculation)
                         else:
                             # CHẾ ĐỘ MẶC ĐỊNH
                             # Ghi transcript như bình thường
                             if config.transcript_logger:
                                 config.transcript_logger.log_transcript_simple(transcription)
                             
-                            # Kiểm tra wake word
-                            if check_wake_word(transcription):
-                                process_wake_word_detection(transcription, timestamp, seq, socketio)
-                            
                             # Gửi kết quả final như bình thường
                             socketio.emit("final", {
                                 "text": transcription,
@@ -317,6 +477,10 @@ def _process_audio_recognition(circular_buffer, buffer_head, buffer_tail, timest
                                 "seq": seq
                             })
                             print(f"🎯 Final (Google Speech): {transcription}")
+                            
+                            # Kiểm tra wake word (câu hỏi nói liền sau wake word được xử lý luôn)
+                            if check_wake_word(transcription):
+                                process_wake_word_detection(transcription, timestamp, seq, socketio, deadline=deadline)
                         
                         return True
                     else:
@@ -8,6 +8,9 @@ Chứa các hàm xử lý audio chung cho server
 import numpy as np
 import noisereduce as nr
 from scipy.signal import butter, lfilter
+from scipy.ndimage import uniform_filter1d
+
+from .feature_cache import overlap_add
 
 def butter_bandpass(lowcut, highcut, fs, order=5):
     """Thiết kế một bộ lọc band-pass Butterworth."""
@@ -23,7 +26,39 @@ def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
     y = lfilter(b, a, data)
     return y
 
-def audio_preprocessing_improved(audio_data, sample_rate=16000):
+def spectral_noise_reduction(spectra, sample_rate=16000, lowcut=80, highcut=7500,
+                             noise_quantile=0.2, over_subtraction=1.5, gain_floor=0.1):
+    """
+    Band-pass + giảm tạp âm trực tiếp trên STFT đã có sẵn trong FeatureCache.
+    Không chạy thêm FFT phân tích nào - chỉ nhân mask rồi overlap-add.
+    
+    Args:
+        spectra (np.ndarray): (n_frames, n_bins) STFT lấy từ FeatureCache
+        sample_rate (int): Sample rate của audio
+        lowcut, highcut (float): Dải tần giữ lại (Hz)
+        noise_quantile (float): Phân vị biên độ mỗi bin dùng làm noise profile
+        over_subtraction (float): Hệ số trừ noise
+        gain_floor (float): Gain tối thiểu để tránh "musical noise"
+    
+    Returns:
+        np.ndarray: Tín hiệu float32 đã xử lý (thang -1..1)
+    """
+    n_bins = spectra.shape[1]
+    bin_freqs = np.linspace(0, sample_rate / 2, n_bins)
+    band_mask = ((bin_freqs >= lowcut) & (bin_freqs <= highcut)).astype(np.float32)
+    
+    # Noise profile: biên độ thấp của mỗi bin trong cả đoạn (gồm lookback)
+    power = spectra.real ** 2 + spectra.imag ** 2
+    # Công suất noise mỗi bin ~ phân phối mũ: mean = quantile / -ln(1 - q)
+    noise_power = np.quantile(power, noise_quantile, axis=0) / -np.log(1.0 - noise_quantile)
+    gain = 1.0 - over_subtraction * noise_power / np.maximum(power, 1e-12)
+    gain = np.sqrt(np.clip(gain, gain_floor ** 2, 1.0))
+    # Làm mượt gain theo thời gian để giảm musical noise
+    gain = uniform_filter1d(gain, size=3, axis=0)
+    
+    return overlap_add(spectra * (gain * band_mask))
+
+def audio_preprocessing_improved(audio_data, sample_rate=16000, spectra=None):
     """
     Chuỗi xử lý âm thanh được cải thiện:
     1. Band-pass filter để tập trung vào tần số giọng nói.
@@ -33,11 +68,19 @@ def audio_preprocessing_improved(audio_data, sample_rate=16000):
     Args:
         audio_data (bytes): Audio data dạng bytes
         sample_rate (int): Sample rate của audio (mặc định: 16000)
+        spectra (np.ndarray): STFT của audio_data lấy từ FeatureCache (tùy chọn).
+            Nếu có, bước 1 và 2 dùng lại phổ đã tính thay vì chạy FFT lần nữa.
     
     Returns:
         bytes: Audio đã được xử lý
     """
     try:
+        if spectra is not None and len(spectra) > 0:
+            samples_int16 = np.frombuffer(audio_data, dtype=np.int16)
+            reduced_noise_samples = spectral_noise_reduction(spectra, sample_rate)[:len(samples_int16)]
+            print("🔧 Step 1+2: Band-pass + noise reduction trên STFT từ feature cache")
+            return _normalize_to_int16(reduced_noise_samples)
+        
         # Chuyển bytes thành numpy array float32 để xử lý
         samples_int16 = np.frombuffer(audio_data, dtype=np.int16)
         samples_float32 = samples_int16.astype(np.float32) / 32768.0
@@ -55,22 +98,25 @@ def audio_preprocessing_improved(audio_data, sample_rate=16000):
         reduced_noise_samples = nr.reduce_noise(y=filtered_samples, sr=sample_rate)
         print("🔧 Step 2: Applied professional noise reduction")
 
-        # ===== BƯỚC 3: Normalize và chuyển về int16 =====
-        # Đưa âm lượng lớn nhất về gần mức tối đa để âm thanh to và rõ hơn.
-        max_val = np.max(np.abs(reduced_noise_samples))
-        if max_val > 0:
-            normalized_samples = reduced_noise_samples / max_val * 0.95  # Normalize to 95%
-        else:
-            normalized_samples = reduced_noise_samples
-        print("🔧 Step 3: Normalized audio volume")
-
-        # Chuyển đổi lại sang định dạng int16 để lưu file WAV
-        processed_samples_int16 = (normalized_samples * 32767).astype(np.int16)
-        
-        print("✅ Audio preprocessing finished successfully!")
-        
-        return processed_samples_int16.tobytes()
+        return _normalize_to_int16(reduced_noise_samples)
 
     except Exception as e:
         print(f"❌ Lỗi audio preprocessing: {e}")
-        return audio_data 
\ No newline at end of file
+        return audio_data
+
+def _normalize_to_int16(samples):
+    """Bước 3: Normalize và chuyển về int16 bytes"""
+    # Đưa âm lượng lớn nhất về gần mức tối đa để âm thanh to và rõ hơn.
+    max_val = np.max(np.abs(samples)) if len(samples) else 0
+    if max_val > 0:
+        normalized_samples = samples / max_val * 0.95  # Normalize to 95%
+    else:
+        normalized_samples = samples
+    print("🔧 Step 3: Normalized audio volume")
+
+    # Chuyển đổi lại sang định dạng int16 để lưu file WAV
+    processed_samples_int16 = (normalized_samples * 32767).astype(np.int16)
+    
+    print("✅ Audio preprocessing finished successfully!")
+    
+    return processed_samples_int16.tobytes() 
\ No newline at end of file
@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 """
 ESP32 Audio Sender Module
-Gửi file WAV qua TCP tới ESP32 để phát âm thanh trên ESP32
+Gửi file WAV (hoặc WAV trong bộ nhớ) qua TCP tới ESP32 để phát âm thanh trên ESP32
 """
 
+import io
 import socket
 import time
 import os
@@ -43,8 +44,26 @@ class ESP32AudioSender:
             print(f"[ERROR] Không tìm thấy file: {wav_file_path}")
             return False
         
-        filename = os.path.basename(wav_file_path)
-        filesize = os.path.getsize(wav_file_path)
+        with open(wav_file_path, "rb") as f:
+            return self._send_stream(f, os.path.basename(wav_file_path), os.path.getsize(wav_file_path),
+                                     progress_callback)
+    
+    def send_bytes_sync(self, wav_data: bytes, filename: str, progress_callback: Optional[Callable] = None) -> bool:
+        """
+        Gửi WAV trong bộ nhớ đồng bộ qua TCP tới ESP32 (không cần file tạm)
+        
+        Args:
+            wav_data: Nội dung WAV (cả header)
+            filename: Tên file ESP32 lưu vào SPIFFS (tối đa 30 ký tự)
+            progress_callback: Callback function để theo dõi tiến trình
+            
+        Returns:
+            bool: True nếu gửi thành công, False nếu có lỗi
+        """
+        return self._send_stream(io.BytesIO(wav_data), filename, len(wav_data), progress_callback)
+    
+    def _send_stream(self, stream, filename: str, filesize: int, progress_callback: Optional[Callable] = None) -> bool:
+        """Gửi header tên:kích thước rồi nội dung stream theo từng chunk"""
         print(f"[INFO] Chuẩn bị gửi file '{filename}' ({filesize} bytes) qua TCP.")
 
         # 2. Tạo socket TCP
@@ -64,19 +83,18 @@ class ESP32AudioSender:
 
             # 5. Gửi dữ liệu file
             bytes_sent = 0
-            with open(wav_file_path, "rb") as f:
-                while True:
-                    chunk = f.read(self.chunk_size)
-                    if not chunk:
-                        break  # Hết file
-                    sock.sendall(chunk)
-                    bytes_sent += len(chunk)
-                    
-                    # Gọi progress callback nếu có
-                    if progress_callback:
-                        progress_callback(bytes_sent, filesize)
-                    
-                    print(f"[SENDING] Đã gửi {bytes_sent}/{filesize} bytes...", end='\r')
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break  # Hết file
+                sock.sendall(chunk)
+                bytes_sent += len(chunk)
+                
+                # Gọi progress callback nếu có
+                if progress_callback:
+                    progress_callback(bytes_sent, filesize)
+                
+                print(f"[SENDING] Đã gửi {bytes_sent}/{filesize} bytes...", end='\r')
             
             print(f"\n[SEND] Gửi file hoàn tất!")
             return True
@@ -126,6 +144,36 @@ class ESP32AudioSender:
         thread.start()
         return thread
 
+    def send_bytes_async(self, wav_data: bytes, filename: str,
+                         success_callback: Optional[Callable] = None,
+                         error_callback: Optional[Callable] = None) -> threading.Thread:
+        """
+        Gửi WAV trong bộ nhớ bất đồng bộ qua TCP tới ESP32
+        
+        Args:
+            wav_data: Nội dung WAV (cả header)
+            filename: Tên file ESP32 lưu vào SPIFFS
+            success_callback: Callback(filename) khi gửi thành công
+            error_callback: Callback khi có lỗi
+            
+        Returns:
+            threading.Thread: Thread đang chạy
+        """
+        def _async_send():
+            try:
+                if self.send_bytes_sync(wav_data, filename):
+                    if success_callback:
+                        success_callback(filename)
+                elif error_callback:
+                    error_callback(f"Không thể gửi {filename}")
+            except Exception as e:
+                if error_callback:
+                    error_callback(f"Lỗi gửi {filename}: {e}")
+        
+        thread = threading.Thread(target=_async_send, daemon=True)
+        thread.start()
+        return thread
+
     def test_connection(self) -> bool:
         """
         Test kết nối tới ESP32
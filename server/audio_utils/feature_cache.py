@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Feature Cache - Tính đặc trưng phổ một lần cho mỗi packet 20ms
+Mỗi frame chỉ chạy 1 lần FFT (STFT + log-mel), kết quả lưu trong ring
+thẳng hàng với circular buffer audio của asr_worker. VAD, noise reduction
+và wake word đọc lại từ cache thay vì tự tính FFT riêng.
+"""
+
+import threading
+import numpy as np
+
+import audio_utils.server_config as config
+
+def _hz_to_mel(hz):
+    return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+def _mel_to_hz(mel):
+    return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+def mel_filterbank(sample_rate=None, n_fft=None, n_mels=None, fmin=None, fmax=None):
+    """
+    Tạo mel filterbank tam giác (HTK)
+
+    Returns:
+        np.ndarray: Ma trận (n_mels, n_fft // 2 + 1) float32
+    """
+    sample_rate = sample_rate or config.SAMPLE_RATE
+    n_fft = n_fft or config.FEATURE_FFT_SIZE
+    n_mels = n_mels or config.FEATURE_N_MELS
+    fmin = config.FEATURE_MEL_FMIN if fmin is None else fmin
+    fmax = config.FEATURE_MEL_FMAX if fmax is None else fmax
+
+    n_bins = n_fft // 2 + 1
+    bin_freqs = np.linspace(0, sample_rate / 2, n_bins)
+    mel_points = np.linspace(_hz_to_mel(fmin), _hz_to_mel(fmax), n_mels + 2)
+    hz_points = _mel_to_hz(mel_points)
+
+    fb = np.zeros((n_mels, n_bins), dtype=np.float32)
+    for m in range(n_mels):
+        left, center, right = hz_points[m], hz_points[m + 1], hz_points[m + 2]
+        rising = (bin_freqs - left) / (center - left)
+        falling = (right - bin_freqs) / (right - center)
+        fb[m] = np.maximum(0.0, np.minimum(rising, falling))
+    return fb
+
+# Cửa sổ Hann periodic: với hop = n_fft/2 tổng các cửa sổ chồng nhau = 1,
+# nên overlap-add trực tiếp là khôi phục được tín hiệu (dùng cho noise reduction)
+_WINDOW = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(config.FEATURE_FFT_SIZE) / config.FEATURE_FFT_SIZE)).astype(np.float32)
+_MEL_FB = mel_filterbank()
+# Các bin trong dải mel dùng để tính spectral flatness
+_BAND_BINS = slice(
+    int(config.FEATURE_MEL_FMIN * config.FEATURE_FFT_SIZE / config.SAMPLE_RATE),
+    int(config.FEATURE_MEL_FMAX * config.FEATURE_FFT_SIZE / config.SAMPLE_RATE) + 1
+)
+
+class FeatureCache:
+    """Ring buffer đặc trưng phổ, mỗi slot tương ứng 1 frame của circular buffer audio"""
+
+    def __init__(self, buffer_size: int = None):
+        """
+        Khởi tạo FeatureCache
+
+        Args:
+            buffer_size (int): Kích thước circular buffer audio (bytes), mặc định CIRCULAR_BUFFER_SIZE
+        """
+        self.buffer_size = buffer_size or config.CIRCULAR_BUFFER_SIZE
+        self.capacity = self.buffer_size // config.FRAME_BYTES
+        self.n_bins = config.FEATURE_FFT_SIZE // 2 + 1
+
+        self.spectrum = np.zeros((self.capacity, self.n_bins), dtype=np.complex64)
+        self.power = np.zeros((self.capacity, self.n_bins), dtype=np.float32)
+        self.log_mel = np.zeros((self.capacity, config.FEATURE_N_MELS), dtype=np.float32)
+        self.rms = np.zeros(self.capacity, dtype=np.float32)
+        self.max_amp = np.zeros(self.capacity, dtype=np.float32)
+        self.zcr = np.zeros(self.capacity, dtype=np.float32)
+        self.flatness = np.zeros(self.capacity, dtype=np.float32)
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Xóa cache - gọi cùng lúc với việc reset circular buffer audio"""
+        with self.lock:
+            self.head = 0  # Slot sẽ ghi tiếp theo (= buffer_head // FRAME_BYTES)
+            self.frames_written = 0
+            self._prev = np.zeros(config.FRAME_SAMPLES, dtype=np.float32)
+            self._pending = np.zeros(0, dtype=np.float32)
+            self.spectrum[:] = 0
+            self.power[:] = 0
+            self.log_mel[:] = 0
+            self.rms[:] = 0
+            self.max_amp[:] = 0
+            self.zcr[:] = 0
+            self.flatness[:] = 0
+
+    def push(self, chunk):
+        """
+        Tính đặc trưng cho packet audio mới và ghi vào ring
+
+        Args:
+            chunk (bytes): PCM 16-bit mono (thường đúng 1 frame 20ms)
+
+        Returns:
+            int: Slot của frame mới nhất, hoặc -1 nếu chưa có frame nào
+        """
+        samples = np.frombuffer(chunk[:len(chunk) - len(chunk) % 2], dtype=np.int16).astype(np.float32)
+
+        with self.lock:
+            if len(self._pending):
+                samples = np.concatenate((self._pending, samples))
+
+            n_frames = len(samples) // config.FRAME_SAMPLES
+            self._pending = samples[n_frames * config.FRAME_SAMPLES:]
+            if n_frames == 0:
+                return (self.head - 1) % self.capacity if self.frames_written else -1
+
+            frames = samples[:n_frames * config.FRAME_SAMPLES].reshape(n_frames, config.FRAME_SAMPLES)
+            # Mỗi cửa sổ STFT = frame trước + frame hiện tại
+            previous = np.vstack((self._prev[None, :], frames[:-1]))
+            windows = np.hstack((previous, frames)) / 32768.0
+            self._prev = frames[-1].copy()
+
+            slots = (self.head + np.arange(n_frames)) % self.capacity
+            spectrum = np.fft.rfft(windows * _WINDOW, axis=1)
+            power = (spectrum.real ** 2 + spectrum.imag ** 2).astype(np.float32)
+
+            self.spectrum[slots] = spectrum
+            self.power[slots] = power
+            self.log_mel[slots] = np.log(power @ _MEL_FB.T + 1e-10)
+            self.rms[slots] = np.sqrt(np.mean(frames ** 2, axis=1))
+            self.max_amp[slots] = np.max(np.abs(frames), axis=1)
+            signs = np.signbit(frames)
+            self.zcr[slots] = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+            # Flatness = trung bình hình học / trung bình cộng (noise/click ~1, giọng nói << 1)
+            band = power[:, _BAND_BINS] + 1e-12
+            self.flatness[slots] = np.exp(np.mean(np.log(band), axis=1)) / np.mean(band, axis=1)
+
+            self.head = (self.head + n_frames) % self.capacity
+            self.frames_written += n_frames
+            return int(slots[-1])
+
+    def slot_for_offset(self, byte_offset):
+        """Đổi vị trí byte trong circular buffer audio sang slot của cache"""
+        return (byte_offset // config.FRAME_BYTES) % self.capacity
+
+    def segment_slots(self, start_offset, end_offset):
+        """
+        Các slot ứng với đoạn audio [start_offset, end_offset) của circular buffer
+
+        Returns:
+            np.ndarray: Mảng slot theo thứ tự thời gian (xử lý wrap)
+        """
+        n_frames = ((end_offset - start_offset) % self.buffer_size) // config.FRAME_BYTES
+        start = self.slot_for_offset(start_offset)
+        return (start + np.arange(n_frames)) % self.capacity
+
+    def get_spectra(self, start_offset, end_offset):
+        """Lấy STFT đã tính sẵn của đoạn audio [start_offset, end_offset)"""
+        with self.lock:
+            return self.spectrum[self.segment_slots(start_offset, end_offset)].copy()
+
+    def segment_levels(self, start_offset, end_offset):
+        """
+        RMS và biên độ lớn nhất của đoạn audio [start_offset, end_offset), gộp từ giá trị mỗi frame
+
+        Returns:
+            tuple: (rms, max_amp), hoặc None nếu đoạn không đủ 1 frame
+        """
+        with self.lock:
+            slots = self.segment_slots(start_offset, end_offset)
+            if not len(slots):
+                return None
+            # Các frame cùng độ dài: RMS cả đoạn = căn trung bình RMS² của từng frame
+            return float(np.sqrt(np.mean(self.rms[slots] ** 2))), float(np.max(self.max_amp[slots]))
+
+    def get_log_mel(self, start_offset=None, end_offset=None, n_frames=None):
+        """
+        Lấy log-mel đã tính sẵn
+
+        Args:
+            start_offset, end_offset (int): Đoạn audio theo byte offset, hoặc
+            n_frames (int): Lấy n frame gần nhất
+        """
+        with self.lock:
+            if n_frames is not None:
+                n_frames = min(n_frames, self.frames_written, self.capacity)
+                slots = (self.head - n_frames + np.arange(n_frames)) % self.capacity
+            else:
+                slots = self.segment_slots(start_offset, end_offset)
+            return self.log_mel[slots].copy()
+
+def extract_features(audio_data):
+    """
+    Tính đặc trưng cho cả một đoạn audio offline (enrollment, benchmark)
+    với cùng cấu hình như khi chạy real-time
+
+    Args:
+        audio_data (bytes): PCM 16-bit mono
+
+    Returns:
+        FeatureCache: Cache vừa đủ chứa đoạn audio, slot 0 là frame đầu tiên
+    """
+    n_frames = max(1, len(audio_data) // config.FRAME_BYTES)
+    cache = FeatureCache(n_frames * config.FRAME_BYTES)
+    cache.push(audio_data[:n_frames * config.FRAME_BYTES])
+    return cache
+
+def overlap_add(spectra, n_samples=None):
+    """
+    Khôi phục tín hiệu từ các frame STFT của FeatureCache (hop = FRAME_SAMPLES)
+
+    Args:
+        spectra (np.ndarray): (n_frames, n_bins) complex, frame k phủ packet k-1 và k
+        n_samples (int): Độ dài output mong muốn (mặc định n_frames * FRAME_SAMPLES)
+
+    Returns:
+        np.ndarray: Tín hiệu float32 (thang -1..1)
+    """
+    hop = config.FRAME_SAMPLES
+    n_frames = len(spectra)
+    frames = np.fft.irfft(spectra, n=config.FEATURE_FFT_SIZE, axis=1).astype(np.float32)
+
+    # Packet k = nửa sau của frame k + nửa đầu của frame k+1
+    output = frames[:, hop:].copy()
+    output[:-1] += frames[1:, :hop]
+    # Packet được 2 frame phủ: chuẩn hóa theo tổng cửa sổ (Hann 50% overlap ~ 1)
+    output[:-1] /= _WINDOW[hop:] + _WINDOW[:hop]
+    # Packet cuối chỉ có nửa sau của frame cuối: giữ nguyên (fade-out theo cửa sổ),
+    # chia cho đuôi cửa sổ ~0 sẽ khuếch đại nhiễu/méo ở cuối đoạn audio
+    output = output.reshape(-1)
+
+    if n_samples is not None:
+        output = output[:n_samples]
+    return output
+
+# Registry cache theo thiết bị
+_feature_caches = {}
+_feature_caches_lock = threading.Lock()
+
+def get_feature_cache(device_id="default"):
+    """Lấy (hoặc tạo) FeatureCache cho một thiết bị"""
+    with _feature_caches_lock:
+        cache = _feature_caches.get(device_id)
+        if cache is None:
+            cache = FeatureCache()
+            _feature_caches[device_id] = cache
+        return cache
@@ -10,9 +10,16 @@ Module nâng cao để tích hợp Google Gemini AI API với các tính năng:
 
 Cấu hình trong file .env:
     GEMINI_API_KEY=your_api_key_here
+    GEMINI_MODEL=gemini-2.5-flash
+    GEMINI_MEMORY_MODEL=gemini-2.5-flash-lite
+    GEMINI_CONTEXT_CACHE=false
+    GEMINI_STRUCTURED_OUTPUT=true
     GEMINI_SYSTEM_PROMPT=Your system prompt here
     GEMINI_MAX_RESPONSE_LENGTH=200
+    GEMINI_BASE_URL=http://127.0.0.1:8787   # Tùy chọn: trỏ tới server giả lập (mock_services.py)
     USER_MEMORY_FILE=user_memory.json
+    MEMORY_DB_FILE=memory.db
+    CONVERSATION_JOURNAL_FILE=conversation_journal.jsonl
 
 Sử dụng:
     from audio_utils.gemini_api import ask_gemini, load_system_prompt_from_file
@@ -23,10 +30,13 @@ Sử dụng:
 
 import os
 import json
+import queue
 import logging
 import re
+import threading
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, Callable
 from datetime import datetime
 
 try:
@@ -39,6 +49,18 @@ try:
 except ImportError:
     genai = None
 
+import audio_utils.server_config as config
+from .memory_store import JsonMemoryBackend
+from .sqlite_store import SQLiteMemoryBackend
+from .prompt_builder import (
+    PromptBuilder, DEFAULT_SYSTEM_PROMPT, JSON_INSTRUCTION, ANSWER_INSTRUCTION,
+    CONSOLIDATION_INSTRUCTION, SUMMARY_INSTRUCTION, build_consolidation_contents, build_summary_contents
+)
+from .memory_consolidator import MemoryConsolidator
+from .response_stream import MainResponseStreamParser
+from .response_cache import ResponseCache
+from .llm_scheduler import LLMScheduler, INTERACTIVE, BACKGROUND, is_rate_limit_error
+
 # Load environment variables from .env file
 if load_dotenv:
     env_path = Path(__file__).parent.parent / '.env'
@@ -47,153 +69,419 @@ if load_dotenv:
 # Logger
 logger = logging.getLogger(__name__)
 
-# Global client instance
-_client = None
+# Client theo API key (GEMINI_API_KEYS cho phép dùng nhiều key chia tải)
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Giới hạn request đồng thời, ưu tiên câu hỏi tương tác, back-off khi 429
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+GEMINI_MEMORY_MODEL = os.getenv('GEMINI_MEMORY_MODEL', 'gemini-2.5-flash-lite')
+
+# Schema structured output: main_response đứng trước để stream đọc được sớm
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "main_response": {"type": "STRING"},
+        "new_memory": {
+            "type": "OBJECT",
+            "properties": {
+                "user_name": {"type": "STRING"},
+                "preferences": {"type": "STRING"},
+                "personal_info": {"type": "STRING"},
+                "interests": {"type": "STRING"},
+                "additional_info": {"type": "STRING"},
+            },
+        },
+    },
+    "required": ["main_response", "new_memory"],
+    "propertyOrdering": ["main_response", "new_memory"],
+}
+ANSWER_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"main_response": {"type": "STRING"}},
+    "required": ["main_response"],
+}
+MEMORY_SCHEMA = RESPONSE_SCHEMA["properties"]["new_memory"]
+
+# Tổng hợp memory ở nền (MEMORY_CONSOLIDATION)
+_consolidator = None
+_consolidator_lock = threading.Lock()
 
-# User memory storage
-_user_memory = {}
-_memory_file_path = None
+# Số lần parse theo từng nhánh: "json" (structured output), các nhánh regex dự phòng, "raw" (thất bại)
+_parse_stats = {"json": 0, "fenced_json": 0, "regex_object": 0, "regex_field": 0, "raw": 0}
+_parse_stats_lock = threading.Lock()
 
-# Conversation history storage
-_conversation_history = []
-_conversation_file_path = None
+# Prompt builder (phần tĩnh cache theo nội dung, phần động cập nhật dần)
+_prompt_builder = None
+_prompt_builder_lock = threading.Lock()
+
+# Context cache phía Gemini cho system_instruction (bật bằng GEMINI_CONTEXT_CACHE=true),
+# riêng cho từng client vì cache thuộc về project của API key
+_context_caches = {}
+_context_cache_lock = threading.Lock()
+
+# Memory + lịch sử hội thoại (SQLite theo thiết bị hoặc file JSON dùng chung)
+_memory_backend = None
+_memory_backend_lock = threading.Lock()
+
+# Cache câu trả lời theo câu hỏi chuẩn hóa + memory (RESPONSE_CACHE_ENABLED)
+_response_cache = ResponseCache()
 
 # Custom system prompt from file
 _custom_system_prompt = None
 
 
-def _get_client():
-    """Lấy hoặc tạo Gemini client."""
-    global _client
+def _api_keys() -> list:
+    """Các API key: GEMINI_API_KEYS (phân cách bằng dấu phẩy) hoặc GEMINI_API_KEY."""
+    keys = [k.strip() for k in os.getenv('GEMINI_API_KEYS', '').split(',') if k.strip()]
+    if not keys and os.getenv('GEMINI_API_KEY'):
+        keys = [os.getenv('GEMINI_API_KEY')]
+    if not keys:
+        raise ValueError(
+            "GEMINI_API_KEY không được tìm thấy trong file .env. "
+            "Vui lòng thêm GEMINI_API_KEY=your_api_key vào file .env"
+        )
+    return keys
+
+def _get_client(api_key: Optional[str] = None):
+    """Lấy hoặc tạo Gemini client của API key (mặc định key đầu tiên)."""
+    api_key = api_key or _api_keys()[0]
     
-    if _client is None:
-        if genai is None:
-            raise ImportError("google-genai không được cài đặt. Chạy: pip install google-genai")
-            
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError(
-                "GEMINI_API_KEY không được tìm thấy trong file .env. "
-                "Vui lòng thêm GEMINI_API_KEY=your_api_key vào file .env"
-            )
-        
-        # Set API key for genai client
-        os.environ['GEMINI_API_KEY'] = api_key
-        _client = genai.Client()
-        logger.info("Gemini API client đã được khởi tạo")
+    with _clients_lock:
+        if api_key not in _clients:
+            if genai is None:
+                raise ImportError("google-genai không được cài đặt. Chạy: pip install google-genai")
+            base_url = os.getenv('GEMINI_BASE_URL')
+            if base_url:
+                _clients[api_key] = genai.Client(api_key=api_key, http_options={"base_url": base_url})
+                logger.warning(f"Gemini API đang trỏ tới {base_url} (GEMINI_BASE_URL)")
+            else:
+                _clients[api_key] = genai.Client(api_key=api_key)
+            logger.info(f"Gemini API client đã được khởi tạo (key #{len(_clients)})")
+        return _clients[api_key]
+
+def _get_scheduler() -> LLMScheduler:
+    """Lấy LLMScheduler dùng chung cho mọi request Gemini."""
+    global _scheduler
     
-    return _client
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(lambda api_key: _get_client(api_key), _api_keys())
+            logger.info(f"LLM scheduler: {_scheduler.max_concurrency} request đồng thời, {_scheduler.key_count} API key")
+    return _scheduler
 
 
-def _load_user_memory():
-    """Tải bộ nhớ người dùng từ file."""
-    global _user_memory, _memory_file_path
+def _get_memory_backend():
+    """Mở backend lưu memory/lịch sử theo MEMORY_BACKEND (lần đầu chuyển dữ liệu file cũ sang SQLite)."""
+    global _memory_backend
     
-    if _memory_file_path is None:
-        memory_file = os.getenv('USER_MEMORY_FILE', 'user_memory.json')
-        _memory_file_path = Path(__file__).parent.parent / memory_file
-    
-    try:
-        if _memory_file_path.exists():
-            with open(_memory_file_path, 'r', encoding='utf-8') as f:
-                _user_memory = json.load(f)
-            logger.info(f"Đã tải bộ nhớ người dùng từ {_memory_file_path}")
-        else:
-            _user_memory = {}
-            logger.info("Tạo bộ nhớ người dùng mới")
-    except Exception as e:
-        logger.error(f"Lỗi khi tải bộ nhớ người dùng: {e}")
-        _user_memory = {}
-
-def _load_conversation_history():
-    """Tải lịch sử 20 tin nhắn gần nhất từ file."""
-    global _conversation_history, _conversation_file_path
+    with _memory_backend_lock:
+        if _memory_backend is None:
+            base_dir = Path(__file__).parent.parent
+            memory_path = base_dir / os.getenv('USER_MEMORY_FILE', 'user_memory.json')
+            journal_path = base_dir / os.getenv('CONVERSATION_JOURNAL_FILE', 'conversation_journal.jsonl')
+            legacy_path = base_dir / os.getenv('CONVERSATION_HISTORY_FILE', 'twenty_last_messages.json')
+            
+            if config.MEMORY_BACKEND == "sqlite":
+                backend = SQLiteMemoryBackend(base_dir / os.getenv('MEMORY_DB_FILE', 'memory.db'))
+                if backend.is_empty() and (memory_path.exists() or journal_path.exists() or legacy_path.exists()):
+                    legacy = JsonMemoryBackend(memory_path, journal_path, legacy_path)
+                    backend.import_legacy(legacy.get_memory(), list(reversed(legacy.query(limit=config.MEMORY_HISTORY_RETENTION))))
+                _memory_backend = backend
+            else:
+                _memory_backend = JsonMemoryBackend(memory_path, journal_path, legacy_path)
+            logger.info(f"Memory backend: {type(_memory_backend).__name__}")
+    return _memory_backend
+
+def _get_prompt_builder() -> PromptBuilder:
+    """Lấy PromptBuilder, nạp memory/lịch sử của thiết bị từ backend lần đầu."""
+    global _prompt_builder
     
-    if _conversation_file_path is None:
-        conversation_file = os.getenv('CONVERSATION_HISTORY_FILE', 'twenty_last_messages.json')
-        _conversation_file_path = Path(__file__).parent.parent / conversation_file
+    with _prompt_builder_lock:
+        if _prompt_builder is None:
+            backend = _get_memory_backend()
+            _prompt_builder = PromptBuilder(
+                lambda device_id: (backend.get_memory(device_id), backend.recent(device_id)),
+                summarize=_summarize_history if config.HISTORY_SUMMARY_ENABLED else None
+            )
+    return _prompt_builder
+
+def _get_context_cache(client, system_instruction: str) -> Optional[str]:
+    """Tên context cache chứa system_instruction (tạo lại khi hết hạn/prompt đổi), None nếu không dùng được."""
+    now = time.time()
+    with _context_cache_lock:
+        cache_state = _context_caches.setdefault(id(client), {"key": None, "name": None, "expires": 0.0, "failed": None})
+        if cache_state["key"] == system_instruction and now < cache_state["expires"]:
+            return cache_state["name"]
+        if cache_state["failed"] == system_instruction:
+            return None
+        
+        ttl = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL', '3600'))
+        try:
+            cache = client.caches.create(
+                model=GEMINI_MODEL,
+                config={"system_instruction": system_instruction, "ttl": f"{ttl}s"}
+            )
+        except Exception as e:
+            # Thường do prompt ngắn hơn số token tối thiểu của explicit cache - implicit cache vẫn áp dụng
+            logger.warning(f"Không tạo được context cache, dùng system_instruction: {e}")
+            cache_state["failed"] = system_instruction
+            return None
+        
+        cache_state.update(key=system_instruction, name=cache.name, expires=now + ttl - 60, failed=None)
+        logger.info(f"Đã tạo context cache {cache.name} (TTL {ttl}s)")
+        return cache.name
+
+def _structured_output_config() -> Dict[str, Any]:
+    """Yêu cầu Gemini trả JSON đúng schema (tắt bằng GEMINI_STRUCTURED_OUTPUT=false)."""
+    if os.getenv('GEMINI_STRUCTURED_OUTPUT', 'true').lower() != 'true':
+        return {}
+    schema = ANSWER_SCHEMA if config.MEMORY_CONSOLIDATION else RESPONSE_SCHEMA
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+def _system_instruction() -> str:
+    """Phần tĩnh của prompt cho câu hỏi tương tác."""
+    instruction = ANSWER_INSTRUCTION if config.MEMORY_CONSOLIDATION else JSON_INSTRUCTION
+    return _get_prompt_builder().system_instruction(
+        _custom_system_prompt or os.getenv('GEMINI_SYSTEM_PROMPT', DEFAULT_SYSTEM_PROMPT), instruction
+    )
+
+def _consolidate_memory(device_id: Optional[str], turns: list):
+    """Gọi model rẻ tổng hợp memory mới từ memory hiện tại + các lượt vừa qua (chạy nền)."""
+    current = _get_memory_backend().get_memory(device_id)
+    start_time = time.time()
+    response = _get_scheduler().call(
+        lambda client: client.models.generate_content(
+            model=GEMINI_MEMORY_MODEL,
+            contents=build_consolidation_contents(current, turns),
+            config={
+                "system_instruction": CONSOLIDATION_INSTRUCTION,
+                "response_mime_type": "application/json",
+                "response_schema": MEMORY_SCHEMA,
+            }
+        ),
+        device_id=device_id, priority=BACKGROUND
+    )
+    new_memory = json.loads(response.text)
+    if not isinstance(new_memory, dict):
+        raise ValueError(f"Memory không hợp lệ: {response.text[:100]}")
+    _apply_memory_updates(new_memory, device_id)
+    logger.info(f"Đã tổng hợp memory từ {len(turns)} lượt ({(time.time() - start_time) * 1000:.0f} ms, {GEMINI_MEMORY_MODEL})")
+
+def _summarize_history(device_id: Optional[str], summary: str, lines: list) -> str:
+    """Gọi model rẻ gộp các lượt cũ vào bản tóm tắt hội thoại (chạy nền, ưu tiên thấp)."""
+    start_time = time.time()
+    response = _get_scheduler().call(
+        lambda client: client.models.generate_content(
+            model=GEMINI_MEMORY_MODEL,
+            contents=build_summary_contents(summary, lines),
+            config={"system_instruction": SUMMARY_INSTRUCTION}
+        ),
+        device_id=device_id, priority=BACKGROUND
+    )
+    logger.info(f"Đã tóm tắt {len(lines)} lượt cũ ({(time.time() - start_time) * 1000:.0f} ms, {GEMINI_MEMORY_MODEL})")
+    return response.text
+
+def _build_prompt(question: str, device_id: Optional[str]) -> Tuple[str, str, int]:
+    """system_instruction + contents trong ngân sách PROMPT_TOKEN_BUDGET, kèm số token ước lượng."""
+    builder = _get_prompt_builder()
+    system_instruction = _system_instruction()
+    system_tokens = builder.estimator.estimate(system_instruction)
+    contents = builder.build_contents(question, device_id, reserved_tokens=system_tokens)
+    return system_instruction, contents, system_tokens + builder.estimator.estimate(contents)
+
+def _observe_prompt_tokens(response, estimated: int):
+    """So số token ước lượng với prompt_token_count Gemini báo để hiệu chỉnh ước lượng."""
+    usage = getattr(response, "usage_metadata", None)
+    actual = getattr(usage, "prompt_token_count", None)
+    _get_prompt_builder().estimator.observe(estimated, actual)
+    logger.debug(f"Prompt: ước lượng {estimated} token, thực tế {actual}")
+
+def _get_consolidator() -> MemoryConsolidator:
+    """Lấy MemoryConsolidator dùng chung."""
+    global _consolidator
+    if _consolidator is None:
+        with _consolidator_lock:
+            if _consolidator is None:
+                _consolidator = MemoryConsolidator(_consolidate_memory)
+    return _consolidator
+
+def _generation_config(client, system_instruction: str) -> Dict[str, Any]:
+    """Config gửi phần tĩnh: context cache nếu bật và tạo được, không thì system_instruction."""
+    generation_config = _structured_output_config()
+    if os.getenv('GEMINI_CONTEXT_CACHE', 'false').lower() == 'true':
+        cache_name = _get_context_cache(client, system_instruction)
+        if cache_name:
+            generation_config["cached_content"] = cache_name
+            return generation_config
+    generation_config["system_instruction"] = system_instruction
+    return generation_config
+
+def _generate(client, contents: str, system_instruction: str):
+    """Gọi generate_content với phần tĩnh qua system_instruction hoặc context cache."""
+    generation_config = _generation_config(client, system_instruction)
+    if "cached_content" in generation_config:
+        try:
+            return client.models.generate_content(
+                model=GEMINI_MODEL, contents=contents, config=generation_config
+            )
+        except Exception as e:
+            if is_rate_limit_error(e):
+                raise  # Để scheduler back-off, gửi lại ngay chỉ thêm 1 lần 429
+            logger.warning(f"Context cache {generation_config['cached_content']} lỗi, gửi lại không dùng cache: {e}")
+            with _context_cache_lock:
+                _context_caches.pop(id(client), None)
     
-    try:
-        if _conversation_file_path.exists():
-            with open(_conversation_file_path, 'r', encoding='utf-8') as f:
-                _conversation_history = json.load(f)
-            logger.info(f"Đã tải lịch sử hội thoại từ {_conversation_file_path} ({len(_conversation_history)} tin nhắn)")
-        else:
-            _conversation_history = []
-            logger.info("Tạo lịch sử hội thoại mới")
-    except Exception as e:
-        logger.error(f"Lỗi khi tải lịch sử hội thoại: {e}")
-        _conversation_history = []
+    generation_config = _structured_output_config()
+    generation_config["system_instruction"] = system_instruction
+    return client.models.generate_content(
+        model=GEMINI_MODEL, contents=contents, config=generation_config
+    )
 
-def _save_user_memory():
-    """Lưu bộ nhớ người dùng vào file."""
-    global _user_memory, _memory_file_path
-    
-    try:
-        if _memory_file_path:
-            with open(_memory_file_path, 'w', encoding='utf-8') as f:
-                json.dump(_user_memory, f, ensure_ascii=False, indent=2)
-            logger.info(f"Đã lưu bộ nhớ người dùng vào {_memory_file_path}")
-    except Exception as e:
-        logger.error(f"Lỗi khi lưu bộ nhớ người dùng: {e}")
+class _StreamInterrupted(Exception):
+    """Stream lỗi sau khi đã chuyển chunk đi - scheduler không được thử lại (sẽ lặp chunk)."""
 
-def _save_conversation_history():
-    """Lưu lịch sử hội thoại vào file."""
-    global _conversation_history, _conversation_file_path
-    
+_STREAM_END = object()
+
+def _drain_stream(client, contents: str, system_instruction: str, out: queue.Queue):
+    """
+    Chạy trong slot của scheduler: đọc hết stream và chuyển từng chunk qua out,
+    nên slot được giữ tới khi Gemini sinh xong (lỗi 429 xảy ra ở chunk đầu tiên
+    và được scheduler thử lại).
+    """
+    chunks = iter(client.models.generate_content_stream(
+        model=GEMINI_MODEL, contents=contents, config=_generation_config(client, system_instruction)
+    ))
+    first = next(chunks, None)
+    if first is None:
+        return
+    out.put(first)
     try:
-        if _conversation_file_path:
-            with open(_conversation_file_path, 'w', encoding='utf-8') as f:
-                json.dump(_conversation_history, f, ensure_ascii=False, indent=2)
-            logger.info(f"Đã lưu lịch sử hội thoại vào {_conversation_file_path} ({len(_conversation_history)} tin nhắn)")
+        for chunk in chunks:
+            out.put(chunk)
     except Exception as e:
-        logger.error(f"Lỗi khi lưu lịch sử hội thoại: {e}")
+        out.put(e)
+        raise _StreamInterrupted(f"Stream bị ngắt: {type(e).__name__}") from e
 
-def _add_to_conversation_history(user_message: str, ai_response: str):
-    """Thêm tin nhắn vào lịch sử và giữ chỉ 20 tin nhắn gần nhất."""
-    global _conversation_history
+def _stream_chunks(contents: str, system_instruction: str, device_id: Optional[str]):
+    """Các chunk của stream Gemini, đọc ở thread giữ slot scheduler cho tới hết stream."""
+    out = queue.Queue()
+    
+    def _run():
+        try:
+            _get_scheduler().call(
+                lambda client: _drain_stream(client, contents, system_instruction, out),
+                device_id=device_id, priority=INTERACTIVE, timeout=config.LLM_QUEUE_TIMEOUT_SECONDS
+            )
+            out.put(_STREAM_END)
+        except _StreamInterrupted:
+            pass  # Lỗi gốc đã được chuyển qua out
+        except Exception as e:
+            out.put(e)
     
-    # Thêm tin nhắn mới
-    _conversation_history.append({
+    threading.Thread(target=_run, daemon=True).start()
+    while True:
+        item = out.get()
+        if item is _STREAM_END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def _add_to_conversation_history(user_message: str, ai_response: str, device_id: Optional[str] = None):
+    """Thêm tin nhắn vào lịch sử của thiết bị (cửa sổ RAM tự giữ N tin nhắn gần nhất)."""
+    turn = {
         "timestamp": datetime.now().isoformat(),
         "user": user_message,
         "ai": ai_response
-    })
-    
-    # Giữ chỉ 20 tin nhắn gần nhất
-    if len(_conversation_history) > 20:
-        _conversation_history = _conversation_history[-20:]
-    
-    # Lưu vào file
-    _save_conversation_history()
+    }
+    _get_memory_backend().append_turn(turn, device_id)
+    _get_prompt_builder().add_turn(turn, device_id)
+    if config.MEMORY_CONSOLIDATION:
+        _get_consolidator().add_turn(turn, device_id)
+
+def _in_conversation(device_id: Optional[str]) -> bool:
+    """Lượt gần nhất của thiết bị mới trong RESPONSE_CACHE_CONTEXT_SECONDS (câu hỏi có thể dựa vào nó)."""
+    recent = _get_memory_backend().recent(device_id)
+    if not recent:
+        return False
+    try:
+        last = datetime.fromisoformat(recent[-1].get("timestamp", ""))
+    except (TypeError, ValueError):
+        return False
+    return (datetime.now() - last).total_seconds() < config.RESPONSE_CACHE_CONTEXT_SECONDS
+
+def _record_answer(question: str, answer: str, device_id: Optional[str], cache_key=None,
+                   abandoned: Optional[threading.Event] = None):
+    """Lưu lượt hỏi-đáp vào lịch sử và cache, trừ khi người gọi đã bỏ câu trả lời (quá hạn, người dùng không nghe)."""
+    if abandoned is not None and abandoned.is_set():
+        logger.info("Câu trả lời đến sau khi đã quá hạn, không lưu vào lịch sử/cache")
+        return
+    _add_to_conversation_history(question, answer, device_id)
+    _response_cache.put(cache_key, answer)
+
+def _cache_key(question: str, device_id: Optional[str]):
+    """Khóa cache của câu hỏi, None nếu tắt cache hoặc câu hỏi không cache được."""
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+    backend = _get_memory_backend()
+    return _response_cache.make_key(question, backend.get_memory(device_id), _in_conversation(device_id))
 
-def _apply_memory_updates(new_memory: Dict[str, Any]) -> bool:
+def _split_sentences(text: str) -> list:
+    """Tách câu trả lời thành các câu theo cùng quy tắc với stream."""
+    return MainResponseStreamParser().feed(json.dumps({"main_response": text}, ensure_ascii=False))
+
+def _apply_memory_updates(new_memory: Dict[str, Any], device_id: Optional[str] = None) -> bool:
     """Thay thế toàn bộ memory bằng memory mới từ AI response."""
-    global _user_memory
-    
     try:
         if not new_memory:
             return False
         
         # Thay thế toàn bộ memory
-        _user_memory = new_memory.copy()
-        _user_memory['last_updated'] = datetime.now().isoformat()
+        user_memory = new_memory.copy()
+        user_memory['last_updated'] = datetime.now().isoformat()
         
-        # Lưu vào file
-        _save_user_memory()
+        # Lưu (ghi nền)
+        _get_memory_backend().set_memory(user_memory, device_id)
+        _get_prompt_builder().update_memory(user_memory, device_id)
         
-        logger.info(f"Đã cập nhật toàn bộ memory: {len(_user_memory)} fields")
+        logger.info(f"Đã cập nhật toàn bộ memory: {len(user_memory)} fields")
         return True
         
     except Exception as e:
         logger.error(f"Lỗi khi cập nhật memory: {e}")
         return False
 
+def _count_parse(path: str):
+    with _parse_stats_lock:
+        _parse_stats[path] += 1
+
+def get_parse_stats() -> Dict[str, int]:
+    """Thống kê nhánh parse câu trả lời (nhánh regex/raw tăng nghĩa là structured output không được tuân thủ)."""
+    with _parse_stats_lock:
+        return dict(_parse_stats)
+
 def _parse_ai_response(raw_response: str) -> Tuple[str, Dict[str, Any]]:
-    """Parse AI response JSON và trích xuất main_response và new_memory."""
+    """
+    Parse AI response JSON và trích xuất main_response và new_memory.
+    Với structured output, response là JSON hợp lệ và chỉ cần 1 lần json.loads;
+    các pattern regex chỉ còn là dự phòng (đếm trong get_parse_stats).
+    """
     try:
         logger.debug(f"Parsing raw response ({len(raw_response)} chars): {raw_response[:200]}...")
         
+        # Nhánh nhanh: structured output trả về đúng JSON
+        try:
+            response_data = json.loads(raw_response)
+            if isinstance(response_data, dict) and response_data.get('main_response'):
+                _count_parse("json")
+                return response_data['main_response'], response_data.get('new_memory') or {}
+        except json.JSONDecodeError:
+            pass
+        
         # Loại bỏ markdown code blocks nếu có
         cleaned_response = raw_response.strip()
         if cleaned_response.startswith('```json'):
@@ -209,9 +497,10 @@ def _parse_ai_response(raw_response: str) -> Tuple[str, Dict[str, Any]]:
             new_memory = response_data.get('new_memory', {})
             
             if main_response:
-                logger.info(f"Successfully parsed full JSON - main_response: {len(main_response)} chars")
+                _count_parse("fenced_json")
+                logger.info(f"Successfully parsed fenced JSON - main_response: {len(main_response)} chars")
                 return main_response, new_memory
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, AttributeError):
             pass  # Tiếp tục với pattern matching
         
         # Tìm JSON trong response với pattern chính xác hơn
@@ -232,6 +521,7 @@ def _parse_ai_response(raw_response: str) -> Tuple[str, Dict[str, Any]]:
                     new_memory = response_data.get('new_memory', {})
                     
                     if main_response:
+                        _count_parse("regex_object")
                         logger.info(f"Successfully parsed JSON - main_response: {len(main_response)} chars")
                         return main_response, new_memory
                 except json.JSONDecodeError:
@@ -249,20 +539,18 @@ def _parse_ai_response(raw_response: str) -> Tuple[str, Dict[str, Any]]:
                 main_response = fallback_match.group(1)
                 # Xử lý escape characters
                 main_response = main_response.replace('\\"', '"').replace('\\n', '\n')
+                _count_parse("regex_field")
                 logger.info(f"Fallback parse successful - main_response: {len(main_response)} chars")
                 return main_response, {}
         
         # Cuối cùng: Cắt ngắn raw response để tránh TTS quá dài
+        _count_parse("raw")
         logger.warning("No JSON found, using truncated raw response")
         truncated_raw = _truncate_response(cleaned_response, 200)
         return truncated_raw, {}
             
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error: {e}")
-        # Fallback với truncated raw response
-        truncated_raw = _truncate_response(raw_response, 200)
-        return truncated_raw, {}
     except Exception as e:
+        _count_parse("raw")
         logger.error(f"Unexpected error parsing AI response: {e}")
         truncated_raw = _truncate_response(raw_response, 200)
         return truncated_raw, {}
@@ -291,12 +579,15 @@ def _truncate_response(text: str, max_length: int = None) -> str:
     
     return truncated + '...'
 
-def ask_gemini(question: str) -> Optional[str]:
+def ask_gemini(question: str, device_id: Optional[str] = None,
+               abandoned: Optional[threading.Event] = None) -> Optional[str]:
     """
     Hỏi Gemini AI và nhận câu trả lời với các tính năng nâng cao.
     
     Args:
         question (str): Câu hỏi cần trả lời
+        device_id (str): Thiết bị hỏi (IP ESP32) - mỗi thiết bị có memory/lịch sử riêng
+        abandoned (threading.Event): Người gọi đặt khi đã bỏ câu trả lời (quá hạn) - khi đó không lưu lịch sử/cache
         
     Returns:
         Optional[str]: Câu trả lời từ Gemini hoặc None nếu lỗi
@@ -305,69 +596,25 @@ def ask_gemini(question: str) -> Optional[str]:
         logger.warning("Câu hỏi trống")
         return None
     
-    # Tải bộ nhớ người dùng và lịch sử hội thoại
-    _load_user_memory()
-    _load_conversation_history()
-    
     try:
-        # Get client
-        client = _get_client()
-        
-        # Get system prompt (ưu tiên custom prompt từ file)
-        if _custom_system_prompt:
-            system_prompt = _custom_system_prompt
-        else:
-            system_prompt = os.getenv('GEMINI_SYSTEM_PROMPT', 
-                                     'Trả lời câu hỏi một cách ngắn gọn và chính xác bằng tiếng Việt. Giới hạn câu trả lời trong 100 ký tự.')
-        
-        # Thêm hướng dẫn JSON response mới
-        json_instruction = '''
-
-QUAN TRỌNG: Trả lời theo định dạng JSON sau:
-{
-  "main_response": "câu trả lời chính cho người dùng (tối đa 200 ký tự)",
-  "new_memory": {
-    "user_name": "tên người dùng",
-    "preferences": "sở thích/thói quen",
-    "personal_info": "thông tin cá nhân",
-    "interests": "lĩnh vực quan tâm",
-    "additional_info": "thông tin bổ sung khác"
-  }
-}
-
-Hãy cập nhật và trả về TOÀN BỘ memory file mới dựa trên:
-1. Memory hiện tại được cung cấp
-2. Lịch sử 20 cuộc hội thoại gần nhất
-3. Câu hỏi/thông tin mới từ người dùng
-
-Nếu không có thông tin mới, hãy giữ nguyên memory cũ.
-'''
-        
-        system_prompt += json_instruction
-        
-        # Thêm memory hiện tại
-        if _user_memory:
-            memory_context = "\n\nMEMORY HIỆN TẠI:\n"
-            memory_context += json.dumps(_user_memory, ensure_ascii=False, indent=2)
-            system_prompt += memory_context
-        
-        # Thêm lịch sử 20 cuộc hội thoại gần nhất
-        if _conversation_history:
-            history_context = "\n\nLỊCH SỬ 20 CUỘC HỘI THOẠI GẦN NHẤT:\n"
-            for i, conv in enumerate(_conversation_history[-20:], 1):
-                history_context += f"{i}. User: {conv['user']}\n   AI: {conv['ai']}\n"
-            system_prompt += history_context
-        
-        # Create full prompt with system instruction
-        full_prompt = f"{system_prompt}\n\nCÂU HỎI MỚI: {question}"
-        
-        logger.debug(f"Đang gửi câu hỏi tới Gemini: {question[:50]}...")
-        
-        # Call Gemini API
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=full_prompt
+        cache_key = _cache_key(question, device_id)
+        cached = _response_cache.get(cache_key)
+        if cached:
+            _record_answer(question, cached, device_id, abandoned=abandoned)
+            logger.info(f"Trả lời từ cache ({len(cached)} ký tự), không gọi Gemini")
+            return cached
+        
+        # Phần tĩnh (system_instruction, cache được) + phần động (memory, tóm tắt, lịch sử, câu hỏi)
+        system_instruction, contents, estimated_tokens = _build_prompt(question, device_id)
+        
+        logger.debug(f"Đang gửi câu hỏi tới Gemini: {question[:50]}... (contents: {len(contents)} ký tự)")
+        
+        # Call Gemini API (qua scheduler: giới hạn đồng thời, thử lại khi 429)
+        response = _get_scheduler().call(
+            lambda client: _generate(client, contents, system_instruction),
+            device_id=device_id, priority=INTERACTIVE, timeout=config.LLM_QUEUE_TIMEOUT_SECONDS
         )
+        _observe_prompt_tokens(response, estimated_tokens)
         
         raw_answer = response.text
         
@@ -376,13 +623,13 @@ Nếu không có thông tin mới, hãy giữ nguyên memory cũ.
         
         # Cập nhật memory nếu có memory mới
         if new_memory:
-            _apply_memory_updates(new_memory)
+            _apply_memory_updates(new_memory, device_id)
         
         # Cắt ngắn câu trả lời để tránh quá tải ESP32
         truncated_answer = _truncate_response(main_response)
         
         # Thêm vào lịch sử hội thoại
-        _add_to_conversation_history(question, truncated_answer)
+        _record_answer(question, truncated_answer, device_id, cache_key, abandoned)
         
         logger.info(f"Nhận được câu trả lời từ Gemini ({len(raw_answer)} ký tự, main_response: {len(truncated_answer)} ký tự)")
         logger.info(f"TTS sẽ sử dụng text: '{truncated_answer[:100]}...' ({len(truncated_answer)} ký tự)")
@@ -395,6 +642,164 @@ Nếu không có thông tin mới, hãy giữ nguyên memory cũ.
         logger.error(f"Lỗi khi gọi Gemini API: {e}")
         return None
 
+def speculate_answer(question: str, device_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Sinh câu trả lời cho câu hỏi đoán trước (transcript tạm) mà KHÔNG cập nhật
+    memory/lịch sử/cache - chỉ có hiệu lực khi commit_speculative_answer được gọi.
+    
+    Returns:
+        Optional[dict]: {"answer", "new_memory", "tokens", "cache_key"} hoặc None nếu lỗi
+    """
+    if not question or not question.strip():
+        return None
+    
+    try:
+        cache_key = _cache_key(question, device_id)
+        cached = _response_cache.get(cache_key)
+        if cached:
+            return {"answer": cached, "new_memory": None, "tokens": 0, "cache_key": None}
+        
+        system_instruction, contents, estimated_tokens = _build_prompt(question, device_id)
+        response = _get_scheduler().call(
+            lambda client: _generate(client, contents, system_instruction),
+            device_id=device_id, priority=INTERACTIVE, timeout=config.LLM_QUEUE_TIMEOUT_SECONDS
+        )
+        _observe_prompt_tokens(response, estimated_tokens)
+        main_response, new_memory = _parse_ai_response(response.text)
+        usage = getattr(response, "usage_metadata", None)
+        return {
+            "answer": _truncate_response(main_response),
+            "new_memory": new_memory,
+            "tokens": getattr(usage, "total_token_count", None) or 0,
+            "cache_key": cache_key,
+        }
+    except Exception as e:
+        logger.error(f"Lỗi khi gọi Gemini API (đoán trước): {e}")
+        return None
+
+def commit_speculative_answer(result: Dict[str, Any], question: str, device_id: Optional[str] = None) -> str:
+    """Dùng câu trả lời đoán trước: cập nhật memory, lịch sử và cache như ask_gemini."""
+    if result.get("new_memory"):
+        _apply_memory_updates(result["new_memory"], device_id)
+    _add_to_conversation_history(question, result["answer"], device_id)
+    _response_cache.put(result.get("cache_key"), result["answer"])
+    return result["answer"]
+
+
+class _SentenceBudget:
+    """Chuyển từng câu cho TTS, dừng khi tổng độ dài vượt GEMINI_MAX_RESPONSE_LENGTH."""
+    
+    def __init__(self, on_sentence: Optional[Callable[[str], None]]):
+        self.on_sentence = on_sentence
+        self.max_length = int(os.getenv('GEMINI_MAX_RESPONSE_LENGTH', '200'))
+        self.sentences = []
+        self.stopped = False
+    
+    @property
+    def text(self) -> str:
+        return " ".join(self.sentences)
+    
+    def emit(self, sentence: str):
+        if self.stopped:
+            return
+        if self.sentences and len(self.text) + 1 + len(sentence) > self.max_length:
+            self.stopped = True
+            return
+        if not self.sentences and len(sentence) > self.max_length:
+            sentence = _truncate_response(sentence, self.max_length)
+            self.stopped = True
+        self.sentences.append(sentence)
+        if self.on_sentence:
+            self.on_sentence(sentence)
+
+def _finish_stream(chunks, parser: MainResponseStreamParser, device_id: Optional[str],
+                   last_chunk=None, estimated_tokens: int = 0):
+    """Đọc nốt phần còn lại của stream (new_memory) rồi cập nhật memory - chạy nền."""
+    try:
+        for chunk in chunks:
+            parser.feed(chunk.text or "")
+            last_chunk = chunk
+        if last_chunk is not None:
+            _observe_prompt_tokens(last_chunk, estimated_tokens)  # usage_metadata có ở chunk cuối
+        _, new_memory = _parse_ai_response(parser.raw)
+        if new_memory:
+            _apply_memory_updates(new_memory, device_id)
+            logger.info(f"Cập nhật memory (nền): {len(new_memory)} fields")
+    except Exception as e:
+        logger.error(f"Lỗi khi đọc phần memory của stream Gemini: {e}")
+
+def ask_gemini_stream(question: str, device_id: Optional[str] = None,
+                      on_sentence: Optional[Callable[[str], None]] = None,
+                      abandoned: Optional[threading.Event] = None) -> Optional[str]:
+    """
+    Hỏi Gemini ở chế độ stream: mỗi câu của main_response được chuyển cho
+    on_sentence ngay khi sinh xong (TTS bắt đầu sớm), phần new_memory được
+    đọc tiếp và cập nhật ở thread nền.
+    
+    Args:
+        question (str): Câu hỏi cần trả lời
+        device_id (str): Thiết bị hỏi (IP ESP32)
+        on_sentence (callable): Nhận từng câu của câu trả lời theo thứ tự
+        abandoned (threading.Event): Người gọi đặt khi đã bỏ câu trả lời (quá hạn) - khi đó không lưu lịch sử/cache
+        
+    Returns:
+        Optional[str]: Toàn bộ câu trả lời (đúng bằng các câu đã chuyển cho on_sentence) hoặc None nếu lỗi
+    """
+    if not question or not question.strip():
+        logger.warning("Câu hỏi trống")
+        return None
+    
+    parser = MainResponseStreamParser()
+    budget = _SentenceBudget(on_sentence)
+    chunk = None
+    estimated_tokens = 0
+    try:
+        cache_key = _cache_key(question, device_id)
+        cached = _response_cache.get(cache_key)
+        if cached:
+            for sentence in _split_sentences(cached):
+                budget.emit(sentence)
+            _record_answer(question, cached, device_id, abandoned=abandoned)
+            logger.info(f"Trả lời từ cache ({len(cached)} ký tự), không gọi Gemini")
+            return cached
+        
+        system_instruction, contents, estimated_tokens = _build_prompt(question, device_id)
+        
+        start_time = time.time()
+        chunks = _stream_chunks(contents, system_instruction, device_id)
+        for chunk in chunks:
+            for sentence in parser.feed(chunk.text or ""):
+                if not budget.sentences:
+                    logger.info(f"Câu đầu tiên sau {(time.time() - start_time) * 1000:.0f} ms")
+                budget.emit(sentence)
+            if parser.done:
+                break
+    except Exception as e:
+        logger.error(f"Lỗi khi stream Gemini API: {e}")
+        if not budget.sentences:
+            return None
+        chunks = iter(())
+    
+    if parser.done:
+        answer = budget.text
+        _record_answer(question, answer, device_id, cache_key, abandoned)
+        threading.Thread(target=_finish_stream, args=(chunks, parser, device_id, chunk, estimated_tokens),
+                         daemon=True).start()
+        logger.info(f"Stream Gemini: main_response {len(answer)} ký tự, memory cập nhật nền")
+        return answer
+    
+    # Không tách được main_response trong lúc stream (không phải JSON, bị cắt...): parse toàn bộ như cũ
+    if not budget.sentences:
+        main_response, new_memory = _parse_ai_response(parser.raw)
+        if new_memory:
+            _apply_memory_updates(new_memory, device_id)
+        if main_response:
+            budget.emit(_truncate_response(main_response))
+    answer = budget.text
+    if not answer:
+        return None
+    _record_answer(question, answer, device_id, abandoned=abandoned)
+    return answer
 
 def load_system_prompt_from_file(file_path: str) -> bool:
     """
@@ -421,6 +826,7 @@ def load_system_prompt_from_file(file_path: str) -> bool:
         
         with open(file_path, 'r', encoding='utf-8') as f:
             _custom_system_prompt = f.read().strip()
+        _response_cache.clear()  # Câu trả lời cũ theo system prompt cũ
         
         logger.info(f"Đã tải system prompt từ file: {file_path} ({len(_custom_system_prompt)} ký tự)")
         return True
@@ -433,18 +839,67 @@ def reset_system_prompt():
     """Reset system prompt về mặc định."""
     global _custom_system_prompt
     _custom_system_prompt = None
+    _response_cache.clear()
     logger.info("Đã reset system prompt về mặc định")
 
-def get_user_memory() -> Dict[str, Any]:
-    """Lấy thông tin bộ nhớ người dùng."""
-    _load_user_memory()
-    return _user_memory.copy()
+def warm_up_gemini(device_id: Optional[str] = None):
+    """
+    Chuẩn bị trước khi có câu hỏi (gọi lúc phát hiện wake word): nạp memory/lịch sử
+    của thiết bị vào prompt builder, dựng system_instruction (và context cache nếu bật),
+    tạo client và mở sẵn kết nối HTTPS bằng 1 request metadata không tốn token.
+    """
+    system_instruction, _, _ = _build_prompt("", device_id)
+    for api_key in _api_keys():
+        client = _get_client(api_key)
+        _generation_config(client, system_instruction)
+        client.models.get(model=GEMINI_MODEL)
+
+def drain_memory_consolidator() -> bool:
+    """Tổng hợp memory từ các lượt còn chờ lô - gọi khi tắt server, trước shutdown_event và flush_memory_stores()."""
+    if _consolidator is None:
+        return True
+    return _consolidator.drain(config.MEMORY_CONSOLIDATE_DRAIN_SECONDS)
+
+def get_scheduler_stats() -> Dict[str, Any]:
+    """Thống kê LLM scheduler: slot đang chạy/giới hạn, hàng đợi, số lần 429, trạng thái từng key."""
+    return _get_scheduler().stats()
+
+def get_prompt_stats() -> Dict[str, Any]:
+    """Thống kê prompt: token ước lượng/thực tế trung bình, hệ số hiệu chỉnh, số lần tóm tắt, dòng lịch sử bị cắt."""
+    return _get_prompt_builder().stats()
+
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Thống kê cache câu trả lời: entries, hits, misses, skipped, evictions, hit_rate."""
+    return _response_cache.stats()
+
+def get_user_memory(device_id: Optional[str] = None) -> Dict[str, Any]:
+    """Lấy thông tin bộ nhớ người dùng của thiết bị."""
+    return _get_memory_backend().get_memory(device_id)
+
+def get_conversation_history(limit: int = 20, offset: int = 0, contains: Optional[str] = None,
+                             device_id: Optional[str] = None) -> list:
+    """
+    Truy vấn lịch sử hội thoại (kể cả ngoài 20 tin nhắn gần nhất).
+    
+    Args:
+        limit (int): Số tin nhắn tối đa
+        offset (int): Bỏ qua bao nhiêu tin nhắn mới nhất
+        contains (str): Lọc theo nội dung câu hỏi/câu trả lời
+        device_id (str): Thiết bị cần xem lịch sử
+        
+    Returns:
+        list: Các tin nhắn, mới nhất trước
+    """
+    return _get_memory_backend().query(device_id, limit=limit, offset=offset, contains=contains)
+
+def record_conversation_turn(user_message: str, ai_response: str, device_id: Optional[str] = None):
+    """Ghi 1 lượt hội thoại được trả lời ngoài Gemini (vd. local intent) vào lịch sử."""
+    _add_to_conversation_history(user_message, ai_response, device_id)
 
-def clear_user_memory():
-    """Xóa bộ nhớ người dùng."""
-    global _user_memory
-    _user_memory = {}
-    _save_user_memory()
+def clear_user_memory(device_id: Optional[str] = None):
+    """Xóa bộ nhớ người dùng của thiết bị."""
+    _get_memory_backend().clear_memory(device_id)
+    _get_prompt_builder().update_memory({}, device_id)
     logger.info("Đã xóa bộ nhớ người dùng")
 
 # Alias cho dễ sử dụng
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keyword Spotter - Phát hiện wake word cục bộ trên log-mel của feature cache
+So khớp template (DTW) với vài bản ghi mẫu "hello hello", không cần gọi
+Google Speech cho các câu nói xung quanh.
+"""
+
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+import audio_utils.server_config as config
+from .feature_cache import extract_features
+
+def _normalize_frames(log_mel):
+    """Chuẩn hóa từng frame: bỏ mức gain (trừ mean) rồi đưa về độ dài 1 - dùng cosine distance"""
+    centered = log_mel - log_mel.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1, keepdims=True)
+    return centered / np.maximum(norms, 1e-6)
+
+def dtw_distance(template, sequence, subsequence=True):
+    """
+    DTW giữa template và sequence (đã chuẩn hóa bằng _normalize_frames)
+    Bước (1,1), (1,2), (2,1) - mỗi hàng chỉ phụ thuộc các hàng trước nên
+    vector hóa được theo cột, độ dốc bị giới hạn trong [0.5, 2].
+
+    Args:
+        template (np.ndarray): (T, n_mels)
+        sequence (np.ndarray): (W, n_mels)
+        subsequence (bool): True = điểm bắt đầu tự do trong sequence, kết thúc ở frame cuối
+
+    Returns:
+        float: Khoảng cách trung bình mỗi frame template (càng nhỏ càng giống)
+    """
+    cost = 1.0 - template @ sequence.T
+    n_rows, n_cols = cost.shape
+    D = np.full((n_rows, n_cols), np.inf)
+    if subsequence:
+        D[0] = cost[0]
+    else:
+        D[0, 0] = cost[0, 0]
+
+    for i in range(1, n_rows):
+        best = np.full(n_cols, np.inf)
+        best[1:] = D[i - 1, :-1]                                # (1,1)
+        if n_cols > 2:
+            best[2:] = np.minimum(best[2:], D[i - 1, :-2])      # (1,2)
+        if i >= 2:
+            best[1:] = np.minimum(best[1:], D[i - 2, :-1])      # (2,1)
+        D[i] = cost[i] + best
+    return float(D[-1, -1] / n_rows)
+
+def _trim_silence(log_mel, rms, ratio=0.1, margin=2):
+    """Cắt bỏ phần im lặng đầu/cuối của bản ghi mẫu"""
+    active = np.flatnonzero(rms > rms.max() * ratio)
+    if len(active) == 0:
+        return log_mel
+    start = max(0, active[0] - margin)
+    end = min(len(log_mel), active[-1] + margin + 1)
+    return log_mel[start:end]
+
+class KeywordSpotter:
+    """Spotter wake word dựa trên template + DTW, chạy trên FeatureCache của asr_worker"""
+
+    def __init__(self, threshold: float = None, hop_frames: int = None, refractory_seconds: float = None):
+        """
+        Khởi tạo KeywordSpotter
+
+        Args:
+            threshold (float): Ngưỡng khoảng cách DTW (mặc định tự hiệu chỉnh từ các mẫu)
+            hop_frames (int): Chạy DTW mỗi bao nhiêu frame (mặc định KWS_HOP_FRAMES)
+            refractory_seconds (float): Thời gian bỏ qua sau mỗi lần phát hiện
+        """
+        self.templates = []
+        self.fixed_threshold = config.KWS_THRESHOLD if threshold is None else threshold
+        self.threshold = self.fixed_threshold or config.KWS_DEFAULT_THRESHOLD
+        self.hop_frames = hop_frames or config.KWS_HOP_FRAMES
+        self.refractory_seconds = config.KWS_REFRACTORY_SECONDS if refractory_seconds is None else refractory_seconds
+        self._frame_counter = 0
+        self._last_detection = 0.0
+        self.last_distance = None
+
+    @property
+    def enabled(self) -> bool:
+        return config.KWS_ENABLED and bool(self.templates)
+
+    def enroll(self, audio_data) -> bool:
+        """
+        Thêm 1 bản ghi mẫu của wake word
+
+        Args:
+            audio_data (bytes): PCM 16kHz mono 16-bit
+
+        Returns:
+            bool: True nếu thêm thành công
+        """
+        features = extract_features(audio_data)
+        log_mel = _trim_silence(features.log_mel, features.rms)
+        if len(log_mel) < 5:
+            print("⚠️ KWS: Bản ghi mẫu quá ngắn, bỏ qua")
+            return False
+        self.templates.append(_normalize_frames(log_mel))
+        self._calibrate()
+        return True
+
+    def enroll_wav(self, wav_path) -> bool:
+        """Thêm bản ghi mẫu từ file WAV (16kHz mono 16-bit)"""
+        try:
+            with wave.open(str(wav_path), 'rb') as wf:
+                if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() != config.SAMPLE_RATE:
+                    print(f"⚠️ KWS: {wav_path} không phải WAV 16kHz mono 16-bit")
+                    return False
+                return self.enroll(wf.readframes(wf.getnframes()))
+        except Exception as e:
+            print(f"❌ KWS: Lỗi đọc mẫu {wav_path}: {e}")
+            return False
+
+    def load_templates(self, template_dir=None) -> int:
+        """
+        Nạp tất cả file WAV mẫu trong thư mục
+
+        Returns:
+            int: Số template đã nạp
+        """
+        template_dir = Path(template_dir or config.KWS_TEMPLATE_DIR)
+        if not template_dir.is_absolute():
+            template_dir = Path(__file__).parent.parent / template_dir
+        if not template_dir.is_dir():
+            return 0
+        for wav_path in sorted(template_dir.glob("*.wav")):
+            self.enroll_wav(wav_path)
+        return len(self.templates)
+
+    def _calibrate(self):
+        """Ngưỡng = khoảng cách lớn nhất giữa các mẫu với nhau * KWS_THRESHOLD_MARGIN"""
+        if self.fixed_threshold or len(self.templates) < 2:
+            return
+        distances = [
+            dtw_distance(a, b, subsequence=False)
+            for i, a in enumerate(self.templates)
+            for j, b in enumerate(self.templates) if i != j
+        ]
+        finite = [d for d in distances if np.isfinite(d)]
+        if finite:
+            self.threshold = max(finite) * config.KWS_THRESHOLD_MARGIN
+
+    def score(self, log_mel) -> float:
+        """Khoảng cách DTW nhỏ nhất giữa các template và đoạn log-mel kết thúc ở frame cuối"""
+        sequence = _normalize_frames(log_mel)
+        best = np.inf
+        for template in self.templates:
+            window = sequence[-2 * len(template):]
+            if len(window) * 2 < len(template):
+                continue
+            best = min(best, dtw_distance(template, window))
+        return best
+
+    def process(self, feature_cache) -> bool:
+        """
+        Gọi sau mỗi frame đang có speech; cứ hop_frames frame thì chạy DTW 1 lần
+
+        Args:
+            feature_cache (FeatureCache): Cache đặc trưng của thiết bị
+
+        Returns:
+            bool: True nếu vừa phát hiện wake word
+        """
+        if not self.enabled:
+            return False
+        self._frame_counter += 1
+        if self._frame_counter % self.hop_frames:
+            return False
+        now = time.time()
+        if now - self._last_detection < self.refractory_seconds:
+            return False
+
+        max_len = max(len(t) for t in self.templates)
+        log_mel = feature_cache.get_log_mel(n_frames=2 * max_len)
+        if len(log_mel) * 2 < min(len(t) for t in self.templates):
+            return False
+
+        self.last_distance = self.score(log_mel)
+        if self.last_distance <= self.threshold:
+            self._last_detection = now
+            self._frame_counter = 0
+            print(f"⚡ KWS: Phát hiện wake word (DTW={self.last_distance:.3f} <= {self.threshold:.3f})")
+            return True
+        return False
+
+_keyword_spotter = None
+
+def get_keyword_spotter():
+    """Lấy KeywordSpotter dùng chung, nạp template ở lần gọi đầu"""
+    global _keyword_spotter
+    if _keyword_spotter is None:
+        _keyword_spotter = KeywordSpotter()
+        if config.KWS_ENABLED:
+            count = _keyword_spotter.load_templates()
+            if count:
+                print(f"⚡ KWS: Đã nạp {count} mẫu wake word, ngưỡng DTW={_keyword_spotter.threshold:.3f}")
+            else:
+                print(f"⚠️ KWS: Không có mẫu trong '{config.KWS_TEMPLATE_DIR}', dùng Google Speech để tìm wake word")
+    return _keyword_spotter
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM Scheduler - Giới hạn số request Gemini chạy đồng thời
+Mỗi request xin 1 slot: câu hỏi tương tác được ưu tiên hơn việc nền (tổng hợp
+memory), các thiết bị được phục vụ xoay vòng, khi gặp 429 thì key đó nghỉ theo
+back-off tăng dần và số slot giảm một nửa (tăng lại dần khi request thành công).
+Có thể dùng nhiều API key (GEMINI_API_KEYS) - slot được cấp cho key rảnh nhất.
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+import audio_utils.server_config as config
+
+INTERACTIVE = 0  # Câu hỏi người dùng đang chờ nghe trả lời
+BACKGROUND = 1   # Việc nền (tổng hợp memory...)
+
+class SchedulerTimeout(TimeoutError):
+    """Chờ slot quá thời hạn (server quá tải / mọi key đang bị giới hạn)"""
+
+def is_rate_limit_error(error):
+    """
+    Lỗi 429 / RESOURCE_EXHAUSTED từ Gemini - chỉ xét mã HTTP và trạng thái,
+    không tìm "429" trong text lỗi (số byte, cổng, ID... làm giảm nhầm số slot)
+    """
+    response = getattr(error, "response", None)
+    for code in (getattr(error, "code", None), getattr(error, "status_code", None),
+                 getattr(response, "status_code", None)):
+        if code == 429:
+            return True
+    if getattr(error, "status", None) == "RESOURCE_EXHAUSTED":
+        return True
+    return "RESOURCE_EXHAUSTED" in str(error)
+
+class _KeyState:
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.in_flight = 0
+        self.strikes = 0             # Số lần 429 liên tiếp
+        self.cooldown_until = 0.0
+        self.rate_limited = 0
+
+class _Ticket:
+    def __init__(self, device_id, priority):
+        self.device_id = device_id
+        self.priority = priority
+        self.key = None              # _KeyState được cấp
+
+class _Slot:
+    """Context manager giữ 1 slot; thoát với lỗi 429 thì key bị cho nghỉ"""
+
+    def __init__(self, scheduler, device_id, priority, deadline):
+        self.scheduler = scheduler
+        self.device_id = device_id
+        self.priority = priority
+        self.deadline = deadline
+        self.ticket = None
+
+    def __enter__(self):
+        self.ticket = self.scheduler._acquire(self.device_id, self.priority, self.deadline)
+        try:
+            return self.scheduler.client_factory(self.ticket.key.api_key)
+        except Exception as e:
+            # __exit__ không chạy khi __enter__ lỗi - trả slot ngay để không rò slot/in_flight
+            self.scheduler._release(self.ticket, e)
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        self.scheduler._release(self.ticket, exc)
+        return False
+
+class LLMScheduler:
+    """Cấp slot gọi LLM theo ưu tiên, xoay vòng thiết bị, back-off khi bị 429"""
+
+    def __init__(self, client_factory, api_keys, max_concurrency=None, max_retries=None,
+                 backoff_base=None, backoff_max=None):
+        """
+        Khởi tạo LLMScheduler
+
+        Args:
+            client_factory (callable): client_factory(api_key) -> client (nên cache theo key)
+            api_keys (list): Các API key dùng chung tải
+            max_concurrency (int): Số request đồng thời tối đa (mặc định LLM_MAX_CONCURRENCY)
+            max_retries (int): Số lần thử lại khi bị 429 (mặc định LLM_MAX_RETRIES)
+            backoff_base (float): Thời gian nghỉ sau lần 429 đầu tiên (giây)
+            backoff_max (float): Thời gian nghỉ tối đa của 1 key (giây)
+        """
+        if not api_keys:
+            raise ValueError("Cần ít nhất 1 API key")
+        self.client_factory = client_factory
+        self.max_concurrency = max_concurrency or config.LLM_MAX_CONCURRENCY
+        self.max_retries = config.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base or config.LLM_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max or config.LLM_BACKOFF_MAX_SECONDS
+        self._keys = [_KeyState(key) for key in api_keys]
+        self._cond = threading.Condition()
+        self._waiting = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}  # priority -> device_id -> deque[ticket]
+        self._active = 0
+        self._limit = self.max_concurrency  # Giới hạn hiện tại (giảm khi 429, tăng dần khi thành công)
+        self.completed = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+
+    @property
+    def key_count(self):
+        return len(self._keys)
+
+    def slot(self, device_id=None, priority=INTERACTIVE, timeout=None):
+        """
+        Xin 1 slot (dùng với with, trả về client của key được cấp)
+
+        Raises:
+            SchedulerTimeout: Không được cấp slot trong timeout giây
+        """
+        return _Slot(self, device_id, priority, None if timeout is None else time.time() + timeout)
+
+    def call(self, fn, device_id=None, priority=INTERACTIVE, timeout=None):
+        """
+        Chạy fn(client) trong 1 slot, tự thử lại (với key khác nếu có) khi bị 429
+
+        Args:
+            fn (callable): fn(client) -> kết quả
+            device_id (str): Thiết bị gửi request (để xoay vòng công bằng)
+            priority (int): INTERACTIVE hoặc BACKGROUND
+            timeout (float): Tổng thời gian chờ slot tối đa qua các lần thử (None = chờ mãi)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for attempt in range(self.max_retries + 1):
+            try:
+                with _Slot(self, device_id, priority, deadline) as client:
+                    return fn(client)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                print(f"⏳ LLM bị giới hạn (429), thử lại lần {attempt + 1}/{self.max_retries}")
+
+    # ----- Cấp/trả slot -----
+
+    def _acquire(self, device_id, priority, deadline):
+        ticket = _Ticket(device_id, priority)
+        with self._cond:
+            self._waiting[priority].setdefault(device_id, deque()).append(ticket)
+            while True:
+                self._dispatch()
+                if ticket.key is not None:
+                    return ticket
+                now = time.time()
+                if (deadline is not None and now >= deadline) or config.shutdown_event.is_set():
+                    self._remove_waiting(ticket)
+                    self.timeouts += 1
+                    raise SchedulerTimeout(f"Không có slot LLM sau khi chờ (đang chạy {self._active}/{self._limit})")
+                wait = self._next_cooldown(now)
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                self._cond.wait(timeout=max(0.01, min(wait, 1.0)))
+
+    def _release(self, ticket, error):
+        with self._cond:
+            key = ticket.key
+            key.in_flight -= 1
+            self._active -= 1
+            if error is None:
+                self.completed += 1
+                key.strikes = 0
+                self._limit = min(self.max_concurrency, self._limit + 1)
+            elif is_rate_limit_error(error):
+                self.rate_limited += 1
+                key.rate_limited += 1
+                key.strikes += 1
+                backoff = min(self.backoff_max, self.backoff_base * 2 ** (key.strikes - 1))
+                key.cooldown_until = time.time() + backoff * random.uniform(0.8, 1.2)
+                self._limit = max(1, self._limit // 2)
+                print(f"⚠️ Key #{self._keys.index(key) + 1} bị 429, nghỉ {backoff:.1f}s (giới hạn còn {self._limit} request)")
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+
+    def _dispatch(self):
+        """Cấp slot cho các ticket đang chờ (gọi khi giữ _cond)"""
+        granted = False
+        while self._active < self._limit:
+            key = self._free_key(time.time())
+            if key is None:
+                break
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            ticket.key = key
+            key.in_flight += 1
+            self._active += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _free_key(self, now):
+        """Key không bị nghỉ và ít request nhất"""
+        available = [k for k in self._keys if k.cooldown_until <= now]
+        return min(available, key=lambda k: k.in_flight) if available else None
+
+    def _next_ticket(self):
+        """Ticket ưu tiên cao nhất; cùng mức ưu tiên thì xoay vòng theo thiết bị"""
+        for priority in (INTERACTIVE, BACKGROUND):
+            queues = self._waiting[priority]
+            if not queues:
+                continue
+            # Giữ lại slot cho câu hỏi tương tác: việc nền không chiếm slot cuối cùng
+            if priority == BACKGROUND and self._limit > 1 and self._active >= self._limit - config.LLM_INTERACTIVE_RESERVED_SLOTS:
+                return None
+            device_id, tickets = next(iter(queues.items()))
+            ticket = tickets.popleft()
+            del queues[device_id]
+            if tickets:
+                queues[device_id] = tickets  # Xuống cuối hàng, thiết bị khác được phục vụ trước
+            return ticket
+        return None
+
+    def _remove_waiting(self, ticket):
+        tickets = self._waiting[ticket.priority].get(ticket.device_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[ticket.priority][ticket.device_id]
+
+    def _next_cooldown(self, now):
+        """Thời gian tới khi có key hết nghỉ"""
+        cooling = [k.cooldown_until - now for k in self._keys if k.cooldown_until > now]
+        return min(cooling) if len(cooling) == len(self._keys) else 1.0
+
+    def stats(self):
+        with self._cond:
+            now = time.time()
+            return {
+                "active": self._active,
+                "limit": self._limit,
+                "max_concurrency": self.max_concurrency,
+                "waiting_interactive": sum(len(q) for q in self._waiting[INTERACTIVE].values()),
+                "waiting_background": sum(len(q) for q in self._waiting[BACKGROUND].values()),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rate_limited": self.rate_limited,
+                "timeouts": self.timeouts,
+                "keys": [
+                    {"in_flight": k.in_flight, "rate_limited": k.rate_limited,
+                     "cooldown": max(0.0, k.cooldown_until - now)}
+                    for k in self._keys
+                ],
+            }
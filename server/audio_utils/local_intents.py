@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local Intents - Trả lời ngay các câu hỏi đơn giản không cần gọi Gemini
+Giờ, ngày/thứ, bật/tắt đèn (gửi lệnh LED qua UDP) và "tên tôi là gì"
+(đọc từ memory). Chỉ khớp khi cả câu ngắn là lệnh đó (kèm từ đệm như "đi",
+"nhé", "bây giờ"); hỏi đáp so trên text đã bỏ dấu để chịu được lỗi dấu của ASR,
+bật/tắt đèn so trên text còn dấu để không gửi lệnh LED nhầm.
+"""
+
+import re
+import unicodedata
+from datetime import datetime
+
+import audio_utils.server_config as config
+from .udp_handler import send_led_command
+
+# Intent điều khiển đèn: không mở cửa sổ hỏi tiếp vì LED xanh sẽ bị bật/tắt lại
+LED_INTENTS = {"light_on", "light_off"}
+
+WEEKDAYS = ["thứ Hai", "thứ Ba", "thứ Tư", "thứ Năm", "thứ Sáu", "thứ Bảy", "Chủ nhật"]
+
+def _clean_text(text):
+    """Lowercase (giữ dấu), bỏ dấu câu, gộp khoảng trắng"""
+    text = unicodedata.normalize("NFC", (text or "").lower())
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def _strip_diacritics(text):
+    text = text.replace("đ", "d")
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+def fold_text(text):
+    """Lowercase, bỏ dấu tiếng Việt (đ -> d), bỏ dấu câu, gộp khoảng trắng"""
+    return _strip_diacritics(_clean_text(text))
+
+def _answer_time(question, device_id):
+    now = datetime.now()
+    if now.minute == 0:
+        return f"Bây giờ là {now.hour} giờ đúng."
+    return f"Bây giờ là {now.hour} giờ {now.minute} phút."
+
+def _answer_date(question, device_id):
+    now = datetime.now()
+    return f"Hôm nay là {WEEKDAYS[now.weekday()]}, ngày {now.day} tháng {now.month} năm {now.year}."
+
+def _light_on(question, device_id):
+    send_led_command("LED_GREEN_ON")
+    return "Đã bật đèn."
+
+def _light_off(question, device_id):
+    send_led_command("LED_GREEN_OFF")
+    return "Đã tắt đèn."
+
+def _answer_name(question, device_id):
+    from .gemini_api import get_user_memory
+    name = (get_user_memory(device_id).get("user_name") or "").strip()
+    if name:
+        return f"Bạn tên là {name}."
+    return "Mình chưa biết tên bạn. Bạn tên là gì?"
+
+# Từ đệm/tiểu từ được phép quanh câu lệnh: cả câu phải chỉ gồm lệnh + các từ này,
+# câu có thêm nội dung khác ("ngày mai", "tàu chạy"...) chuyển cho Gemini
+_PREFIX = r"(?:(?:\w+ ){0,2}ơi )?(?:(?:cho )?(?:tôi|mình|em) (?:hỏi|muốn biết) )?(?:làm ơn |hãy |giúp (?:tôi|mình|em) )?"
+_SUFFIX = r"(?: (?:đi|nhé|nhe|nha|với|ạ|vậy|thế|nhỉ|hả|à|ơi|rồi|luôn|giúp (?:tôi|mình|em)|bây giờ|hiện tại))*"
+
+def _intent_pattern(core, keep_diacritics=False):
+    """Regex khớp cả câu: [từ đệm] lệnh [tiểu từ]; bỏ dấu nếu so trên text đã fold_text"""
+    pattern = f"{_PREFIX}(?:{core}){_SUFFIX}"
+    return re.compile(pattern if keep_diacritics else _strip_diacritics(pattern))
+
+# (tên intent, regex khớp cả câu, hàm trả lời, so trên text còn dấu)
+# Đèn so trên text còn dấu để "mơ đến", "bát đèn"... không bật đèn nhầm;
+# các intent hỏi đáp so trên text đã fold_text để chịu được lỗi dấu của ASR
+LOCAL_INTENTS = [
+    ("light_off", _intent_pattern(r"(?:tắt|tác) (?:đèn|điện)", keep_diacritics=True), _light_off, True),
+    ("light_on", _intent_pattern(r"(?:bật|mở) (?:đèn|điện)(?: lên)?", keep_diacritics=True), _light_on, True),
+    ("name", _intent_pattern(r"tên (?:tôi|mình|em|tao|tớ) là gì|(?:tôi|mình|em|tớ) tên (?:là )?gì"), _answer_name, False),
+    ("date", _intent_pattern(r"(?:hôm nay (?:là )?)?(?:thứ mấy|ngày (?:bao nhiêu|mấy|gì)(?: tháng mấy)?)"
+                             r"|what (?:day|date) is (?:it|today)"), _answer_date, False),
+    ("time", _intent_pattern(r"(?:(?:bây giờ|hiện tại) (?:là )?)?mấy giờ|giờ hiện tại|what time is it"), _answer_time, False),
+]
+
+# Số lần mỗi intent được trả lời cục bộ
+intent_hits = {name: 0 for name, _, _, _ in LOCAL_INTENTS}
+
+def match_local_intent(question):
+    """
+    Tìm intent cục bộ cho câu hỏi
+
+    Returns:
+        tuple: (tên intent, hàm trả lời) hoặc None
+    """
+    cleaned = _clean_text(question)
+    folded = _strip_diacritics(cleaned)
+    if not folded or len(folded.split()) > config.LOCAL_INTENT_MAX_WORDS:
+        return None  # Câu dài thường là yêu cầu phức tạp hơn, để Gemini xử lý
+    for name, pattern, handler, keep_diacritics in LOCAL_INTENTS:
+        if pattern.fullmatch(cleaned if keep_diacritics else folded):
+            return name, handler
+    return None
+
+def answer_locally(question, device_id=None):
+    """
+    Trả lời câu hỏi bằng intent cục bộ nếu khớp
+
+    Args:
+        question (str): Câu hỏi đã nhận dạng
+        device_id (str): Thiết bị hỏi (IP ESP32)
+
+    Returns:
+        tuple: (tên intent, câu trả lời), hoặc None nếu cần hỏi Gemini
+    """
+    if not config.LOCAL_INTENTS_ENABLED:
+        return None
+    matched = match_local_intent(question)
+    if not matched:
+        return None
+    name, handler = matched
+    try:
+        answer = handler(question, device_id)
+    except Exception as e:
+        print(f"⚠️ Local intent '{name}' lỗi, chuyển cho Gemini: {e}")
+        return None
+    intent_hits[name] += 1
+    print(f"⚡ Local intent '{name}': {answer}")
+    return name, answer
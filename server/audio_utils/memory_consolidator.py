@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory Consolidator - Cập nhật memory người dùng ở nền, tách khỏi câu trả lời
+Câu hỏi tương tác chỉ sinh câu trả lời; các lượt hội thoại được gom lại và
+gửi cho model rẻ hơn để tổng hợp memory mỗi N lượt, sau T giây, hoặc ngay khi
+người dùng nói ra thông tin cá nhân ("tôi tên là...", "tôi thích...").
+"""
+
+import re
+import threading
+import time
+
+import audio_utils.server_config as config
+
+# Câu kể (không phải câu hỏi) có khả năng chứa thông tin cá nhân cần nhớ ngay
+# "em"/"mình" hay dùng để gọi trợ lý ("em là ai") nên không đi với là/đang/có
+PERSONAL_FACT_PATTERNS = [
+    r"\b(tên|gọi) (tôi|mình|em|tao|tớ) là\b",
+    r"\b(tôi|tớ) (tên|là|thích|ghét|yêu|sống|ở|làm|học|đang|có|không thích|sinh)\b",
+    r"\b(mình|em) (tên|thích|ghét|yêu|sống|ở|làm|học|không thích|sinh)\b",
+    r"\b(sinh nhật|tuổi|quê|nhà) (của )?(tôi|mình|em|tớ)\b",
+    r"\b(hãy nhớ|nhớ (giúp|hộ|giùm|dùm|là|rằng)|ghi nhớ|đừng quên|remember)\b",
+    r"\bmy name is\b|\bi (like|love|live|work|am)\b",
+]
+_PERSONAL_FACT_RE = re.compile("|".join(PERSONAL_FACT_PATTERNS), re.IGNORECASE)
+# Câu hỏi ("tôi có nên mang ô không", "mình đang ở đâu") không phải thông tin để nhớ
+_QUESTION_RE = re.compile(r"(\b(gì|ai|đâu|không|nào|chưa|sao|mấy|bao nhiêu|nhỉ)|\?)\W*$", re.IGNORECASE)
+
+def has_personal_fact(text):
+    """Câu kể có vẻ chứa thông tin cá nhân (tên, sở thích, nơi ở...) không"""
+    return bool(text) and not _QUESTION_RE.search(text) and bool(_PERSONAL_FACT_RE.search(text))
+
+class MemoryConsolidator:
+    """Gom các lượt hội thoại theo thiết bị và gọi hàm tổng hợp memory ở thread nền"""
+
+    def __init__(self, consolidate, every_turns=None, interval_seconds=None):
+        """
+        Khởi tạo MemoryConsolidator
+
+        Args:
+            consolidate (callable): consolidate(device_id, turns) - tổng hợp và lưu memory mới
+            every_turns (int): Tổng hợp khi gom đủ số lượt này (mặc định MEMORY_CONSOLIDATE_EVERY_TURNS)
+            interval_seconds (float): Tổng hợp khi lượt cũ nhất đã chờ quá lâu
+                (mặc định MEMORY_CONSOLIDATE_INTERVAL_SECONDS)
+        """
+        self.consolidate = consolidate
+        self.every_turns = every_turns or config.MEMORY_CONSOLIDATE_EVERY_TURNS
+        self.interval_seconds = config.MEMORY_CONSOLIDATE_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+        self._cond = threading.Condition()
+        self._pending = {}   # device_id -> [turn, ...]
+        self._first_at = {}  # device_id -> thời điểm lượt cũ nhất được thêm
+        self._urgent = set()
+        self._not_before = {}  # device_id -> thời điểm được thử lại sau lỗi
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+
+    def add_turn(self, turn, device_id=None):
+        """Thêm 1 lượt hội thoại (trả về ngay)"""
+        with self._cond:
+            self._pending.setdefault(device_id, []).append(turn)
+            self._first_at.setdefault(device_id, time.time())
+            if has_personal_fact(turn.get("user")):
+                self._urgent.add(device_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-consolidator", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def pending_count(self, device_id=None):
+        with self._cond:
+            return len(self._pending.get(device_id, []))
+
+    def _due(self, now):
+        """Các thiết bị đến lượt tổng hợp và thời gian chờ tới hạn gần nhất"""
+        due = []
+        next_wait = None
+        for device_id, turns in self._pending.items():
+            deadline = self._first_at[device_id] + self.interval_seconds
+            retry_at = self._not_before.get(device_id, 0.0)
+            if now >= retry_at and (device_id in self._urgent or len(turns) >= self.every_turns or now >= deadline):
+                due.append(device_id)
+            else:
+                wait = (retry_at if now < retry_at else deadline) - now
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+        return due, next_wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due, next_wait = self._due(time.time())
+                if config.shutdown_event.is_set() or (not due and not self._pending):
+                    self._thread = None
+                    return
+                if not due:
+                    self._cond.wait(timeout=min(next_wait, 1.0))
+                    continue
+                batches = [(device_id, self._pending.pop(device_id)) for device_id in due]
+                for device_id in due:
+                    self._first_at.pop(device_id, None)
+                    self._urgent.discard(device_id)
+
+            for device_id, turns in batches:
+                self.flush_batch(device_id, turns)
+
+    def drain(self, timeout=None):
+        """
+        Tổng hợp ngay mọi lượt đang chờ đủ lô (gọi khi tắt server, trước khi đặt
+        shutdown_event, để thông tin của vài lượt cuối không bị mất)
+
+        Args:
+            timeout (float): Thời gian chờ tối đa (None = chờ tới khi xong)
+
+        Returns:
+            bool: True nếu đã tổng hợp xong mọi lô trong thời hạn
+        """
+        with self._cond:
+            batches = list(self._pending.items())
+            self._pending.clear()
+            self._first_at.clear()
+            self._urgent.clear()
+            self._not_before.clear()
+        if not batches:
+            return True
+
+        worker = threading.Thread(
+            target=lambda: [self.flush_batch(device_id, turns) for device_id, turns in batches],
+            name="memory-consolidator-drain", daemon=True,
+        )
+        worker.start()
+        worker.join(timeout)
+        if worker.is_alive():
+            print(f"⚠️ Memory consolidator: chưa tổng hợp xong {sum(len(t) for _, t in batches)} lượt sau {timeout}s")
+            return False
+        return True
+
+    def flush_batch(self, device_id, turns):
+        """Gọi hàm tổng hợp cho 1 lô (lô lỗi được trả lại hàng đợi để thử lần sau)"""
+        try:
+            self.consolidate(device_id, turns)
+            self.runs += 1
+            self._not_before.pop(device_id, None)
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Memory consolidator: lỗi tổng hợp memory ({len(turns)} lượt): {e}")
+            with self._cond:
+                self._pending[device_id] = turns + self._pending.get(device_id, [])
+                self._first_at[device_id] = time.time()
+                self._not_before[device_id] = time.time() + self.interval_seconds
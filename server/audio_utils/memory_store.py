@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory Store - Cache trong RAM cho memory và lịch sử hội thoại của Gemini
+Đọc file 1 lần, chỉ đọc lại khi mtime đổi (sửa tay từ bên ngoài); ghi được
+đẩy sang thread nền (write-behind), gộp nhiều lần ghi liên tiếp thành 1 và
+ghi atomic (file tạm + rename) để không còn I/O đĩa trên đường trả lời.
+Lịch sử hội thoại là journal JSONL chỉ ghi nối, không ghi lại cả file mỗi lượt.
+"""
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import audio_utils.server_config as config
+
+logger = logging.getLogger(__name__)
+
+# Khóa dùng khi không biết thiết bị (và cho dữ liệu cũ trước khi tách theo thiết bị)
+DEFAULT_DEVICE_ID = "default"
+
+def atomic_write_json(path, data, indent=2):
+    """Ghi JSON ra file tạm cùng thư mục rồi rename đè lên file đích"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class CachedJsonFile:
+    """1 file JSON được giữ trong RAM, ghi xuống đĩa qua WriteBehindPersister"""
+
+    def __init__(self, path, default=dict, persister=None):
+        """
+        Khởi tạo CachedJsonFile
+
+        Args:
+            path (str|Path): Đường dẫn file JSON
+            default (callable): Tạo giá trị mặc định khi file chưa có/lỗi (dict, list)
+            persister (WriteBehindPersister): Thread ghi nền (mặc định dùng chung)
+        """
+        self.path = Path(path)
+        self.default = default
+        self.persister = persister or get_persister()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._data = None
+        self._mtime = None
+        self._dirty = False
+
+    def _stat_mtime(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """
+        Dữ liệu hiện tại (không copy - caller không được sửa trực tiếp, dùng set())
+        Đọc lại từ đĩa nếu file bị sửa từ bên ngoài và không có thay đổi chờ ghi
+        """
+        with self._lock:
+            mtime = self._stat_mtime()
+            if self._data is None or (mtime != self._mtime and not self._dirty):
+                self._data = self._read()
+                self._mtime = mtime
+            return self._data
+
+    def _read(self):
+        if not self.path.exists():
+            return self.default()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            logger.info(f"Đã tải {self.path.name} vào bộ nhớ")
+            return data
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc {self.path}: {e}")
+            return self.default()
+
+    def set(self, data):
+        """Cập nhật dữ liệu trong RAM và lên lịch ghi nền (trả về ngay)"""
+        snapshot = list(data) if isinstance(data, list) else dict(data)
+        with self._lock:
+            self._data = snapshot
+            self._dirty = True
+        self.persister.schedule(self)
+
+    def flush(self) -> bool:
+        """Ghi xuống đĩa nếu có thay đổi, trả về True nếu đã ghi"""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return False
+                data = self._data
+                self._dirty = False
+            # Ghi ngoài _lock để get() trên đường trả lời không phải chờ I/O
+            try:
+                atomic_write_json(self.path, data)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                logger.error(f"Lỗi khi ghi {self.path}: {e}")
+                return False
+            with self._lock:
+                if self._data is data:
+                    self._mtime = self._stat_mtime()
+        logger.info(f"Đã lưu {self.path.name}")
+        return True
+
+def _iter_lines_reverse(path, block_size=8192):
+    """Đọc các dòng của file từ cuối lên đầu, không tải cả file vào RAM"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        remainder = b""
+        while pos > 0:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            remainder = lines[0]
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line
+        if remainder.strip():
+            yield remainder
+
+class ConversationJournal:
+    """
+    Lịch sử hội thoại dạng JSONL chỉ ghi nối (mỗi lượt 1 dòng) + cửa sổ
+    deque(maxlen=N) trong RAM cho prompt. Dòng ghi dở do crash bị bỏ qua khi đọc;
+    journal được nén lại (giữ JOURNAL_MAX_ENTRIES lượt gần nhất) khi vượt
+    JOURNAL_MAX_ENTRIES + JOURNAL_COMPACT_SLACK dòng.
+    """
+
+    def __init__(self, path, window=None, legacy_path=None, persister=None):
+        """
+        Khởi tạo ConversationJournal
+
+        Args:
+            path (str|Path): Đường dẫn file .jsonl
+            window (int): Số lượt giữ trong RAM (mặc định CONVERSATION_WINDOW)
+            legacy_path (str|Path): File JSON lịch sử cũ để chuyển sang journal lần đầu
+            persister (WriteBehindPersister): Thread ghi nền (mặc định dùng chung)
+        """
+        self.path = Path(path)
+        self.window = window or config.CONVERSATION_WINDOW
+        self.persister = persister or get_persister()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._recent = deque(maxlen=self.window)
+        self._pending = []
+        self._writing = []     # Lượt flush() đang ghi xuống đĩa (ngoài _lock)
+        self._line_count = 0
+
+        if not self.path.exists() and legacy_path and Path(legacy_path).exists():
+            self._import_legacy(Path(legacy_path))
+        self._load()
+
+    def _import_legacy(self, legacy_path):
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            logger.info(f"Đã chuyển {len(entries)} tin nhắn từ {legacy_path.name} sang {self.path.name}")
+        except Exception as e:
+            logger.error(f"Lỗi khi chuyển lịch sử cũ {legacy_path}: {e}")
+
+    def _load(self):
+        """Đếm số dòng và nạp N lượt cuối vào cửa sổ RAM"""
+        if not self.path.exists():
+            return
+        with open(self.path, 'rb+') as f:
+            self._line_count = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(65536), b""))
+            # Dòng cuối ghi dở (crash): kết thúc nó để lượt mới không bị dính vào
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+                    self._line_count += 1
+        self._recent.extendleft(self._read_reverse(limit=self.window))
+        logger.info(f"Đã tải lịch sử hội thoại từ {self.path.name} ({self._line_count} lượt)")
+
+    def _read_reverse(self, limit=None, offset=0, contains=None):
+        """Các lượt trong file, mới nhất trước"""
+        results = []
+        if not self.path.exists() or (limit is not None and limit <= 0):
+            return results
+        skipped = 0
+        for line in _iter_lines_reverse(self.path):
+            try:
+                entry = json.loads(line.decode('utf-8'))
+            except (ValueError, UnicodeDecodeError):
+                continue  # Dòng ghi dở khi crash
+            if contains and not _entry_contains(entry, contains):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            results.append(entry)
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+    def recent(self):
+        """N lượt gần nhất (cũ trước) cho prompt"""
+        with self._lock:
+            return list(self._recent)
+
+    def __len__(self):
+        with self._lock:
+            return self._line_count + len(self._writing) + len(self._pending)
+
+    def append(self, entry):
+        """Thêm 1 lượt (trả về ngay, dòng được ghi nối ở thread nền)"""
+        with self._lock:
+            self._recent.append(entry)
+            self._pending.append(entry)
+        self.persister.schedule(self)
+
+    def query(self, limit=20, offset=0, contains=None):
+        """
+        Truy vấn lịch sử vượt ra ngoài cửa sổ RAM, đọc ngược từ cuối file
+
+        Args:
+            limit (int): Số lượt tối đa
+            offset (int): Bỏ qua bao nhiêu lượt mới nhất
+            contains (str): Chỉ lấy lượt có câu hỏi/câu trả lời chứa chuỗi này
+
+        Returns:
+            list: Các lượt, mới nhất trước
+        """
+        # Giữ _write_lock để file không bị ghi nối/nén giữa lúc đọc; _lock chỉ giữ khi chép _pending
+        # để append()/recent() trên đường trả lời không phải chờ đọc đĩa
+        with self._write_lock:
+            with self._lock:
+                pending = list(self._pending)
+            pending = [e for e in reversed(pending) if not contains or _entry_contains(e, contains)]
+            results = pending[offset:offset + limit]
+            offset = max(0, offset - len(pending))
+            results += self._read_reverse(limit - len(results), offset, contains)
+        return results
+
+    def flush(self) -> bool:
+        """Ghi nối các lượt đang chờ, nén journal khi quá dài"""
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return False
+                self._writing, self._pending = self._pending, []
+                writing = self._writing
+            # Ghi ngoài _lock để append()/recent() trên đường trả lời không phải chờ I/O
+            lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in writing)
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                with self._lock:
+                    self._pending = writing + self._pending
+                    self._writing = []
+                logger.error(f"Lỗi khi ghi {self.path}: {e}")
+                return False
+            with self._lock:
+                self._line_count += len(writing)
+                self._writing = []
+                line_count = self._line_count
+            if line_count > config.JOURNAL_MAX_ENTRIES + config.JOURNAL_COMPACT_SLACK:
+                self._compact()
+        return True
+
+    def compact(self, keep=None):
+        """Giữ lại `keep` lượt gần nhất (ghi file mới rồi rename, không mất dữ liệu khi crash)"""
+        with self._write_lock:
+            self._compact(keep)
+
+    def _compact(self, keep=None):
+        """compact() khi đã giữ _write_lock (mọi thay đổi file đều giữ _write_lock, không cần _lock)"""
+        keep = keep or config.JOURNAL_MAX_ENTRIES
+        entries = self._read_reverse(limit=keep)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=str(self.path.parent))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for entry in reversed(entries):
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            logger.error(f"Lỗi khi nén {self.path}: {e}")
+            return
+        with self._lock:
+            logger.info(f"Đã nén {self.path.name}: {self._line_count} -> {len(entries)} lượt")
+            self._line_count = len(entries)
+
+def _entry_contains(entry, text):
+    text = text.lower()
+    return text in str(entry.get("user", "")).lower() or text in str(entry.get("ai", "")).lower()
+
+class JsonMemoryBackend:
+    """
+    Backend file: user_memory.json + journal JSONL, 1 memory chung cho mọi thiết bị.
+    Cùng interface với SQLiteMemoryBackend (device_id bị bỏ qua).
+    """
+
+    def __init__(self, memory_path, journal_path, legacy_history_path=None):
+        self.memory_file = CachedJsonFile(memory_path, default=dict)
+        self.journal = ConversationJournal(journal_path, legacy_path=legacy_history_path)
+
+    def get_memory(self, device_id=None) -> dict:
+        return dict(self.memory_file.get())
+
+    def set_memory(self, memory, device_id=None):
+        self.memory_file.set(memory)
+
+    def clear_memory(self, device_id=None):
+        self.memory_file.set({})
+
+    def recent(self, device_id=None) -> list:
+        return self.journal.recent()
+
+    def append_turn(self, entry, device_id=None):
+        self.journal.append(entry)
+
+    def query(self, device_id=None, limit=20, offset=0, contains=None) -> list:
+        return self.journal.query(limit=limit, offset=offset, contains=contains)
+
+class WriteBehindPersister:
+    """
+    Thread nền ghi các store (CachedJsonFile, ConversationJournal) bị đánh dấu thay đổi.
+    Chờ MEMORY_WRITE_DELAY_SECONDS sau lần set() đầu tiên để gộp các lần
+    ghi liên tiếp (memory + lịch sử của cùng 1 câu hỏi) thành 1 lần ghi mỗi file.
+    """
+
+    def __init__(self, delay: float = None):
+        self.delay = config.MEMORY_WRITE_DELAY_SECONDS if delay is None else delay
+        self._pending = {}  # id(store) -> store, giữ thứ tự
+        self._cond = threading.Condition()
+        self._thread = None
+        self.writes = 0
+        self.coalesced = 0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="memory-persister", daemon=True)
+            self._thread.start()
+
+    def schedule(self, store):
+        """Đánh dấu store cần ghi"""
+        with self._cond:
+            if id(store) in self._pending:
+                self.coalesced += 1
+            self._pending[id(store)] = store
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if config.shutdown_event.is_set():
+                        return
+                    self._cond.wait(timeout=1.0)
+            # Đợi gom thêm các lần ghi tới trong khoảng delay (dừng sớm khi shutdown)
+            config.shutdown_event.wait(self.delay)
+            self.flush()
+
+    def flush(self):
+        """Ghi ngay mọi store đang chờ (gọi khi shutdown)"""
+        with self._cond:
+            stores = list(self._pending.values())
+            self._pending.clear()
+        for store in stores:
+            if store.flush():
+                self.writes += 1
+
+_persister = None
+_persister_lock = threading.Lock()
+
+def get_persister():
+    """Lấy WriteBehindPersister dùng chung (flush tự động khi thoát chương trình)"""
+    global _persister
+    with _persister_lock:
+        if _persister is None:
+            _persister = WriteBehindPersister()
+            atexit.register(_persister.flush)
+        return _persister
+
+def flush_memory_stores():
+    """Ghi ngay mọi thay đổi đang chờ xuống đĩa"""
+    if _persister is not None:
+        start = time.perf_counter()
+        _persister.flush()
+        logger.info(f"Đã flush memory store ({(time.perf_counter() - start) * 1000:.1f} ms)")
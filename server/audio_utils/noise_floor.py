@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Noise Floor - Ước lượng noise nền bằng rolling quantile O(log n)
+Dùng chung cho adaptive threshold của VAD, AGC và endpointer thay cho việc
+sort lại toàn bộ cửa sổ RMS ở mỗi frame.
+"""
+
+import heapq
+import math
+from collections import deque
+
+import audio_utils.server_config as config
+
+class RollingQuantile:
+    """
+    Quantile của N giá trị gần nhất, cập nhật O(log n).
+    Hai heap: lower (max-heap) giữ phần nhỏ nhất, đỉnh của nó là quantile;
+    upper (min-heap) giữ phần còn lại. Giá trị rơi khỏi cửa sổ được xóa lười.
+    """
+
+    def __init__(self, window_size: int, quantile: float = 0.5):
+        """
+        Khởi tạo RollingQuantile
+
+        Args:
+            window_size (int): Số giá trị trong cửa sổ trượt
+            quantile (float): Phân vị cần theo dõi (0..1)
+        """
+        if window_size < 1:
+            raise ValueError("window_size phải >= 1")
+        if not 0.0 <= quantile <= 1.0:
+            raise ValueError("quantile phải nằm trong [0, 1]")
+        self.window_size = window_size
+        self.quantile = quantile
+        self.reset()
+
+    def reset(self):
+        """Xóa toàn bộ cửa sổ"""
+        self._window = deque()   # (value, seq) theo thứ tự thời gian
+        self._lower = []         # (-value, seq)
+        self._upper = []         # (value, seq)
+        self._side = {}          # seq -> True nếu nằm ở lower
+        self._dead = set()       # seq đã rời cửa sổ nhưng còn trong heap
+        self._lower_size = 0
+        self._upper_size = 0
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._window)
+
+    def push(self, value: float):
+        """Thêm giá trị mới, tự loại giá trị cũ nhất khi cửa sổ đầy"""
+        value = float(value)
+        self._seq += 1
+        seq = self._seq
+
+        self._prune(self._lower)
+        if self._lower and value <= -self._lower[0][0]:
+            heapq.heappush(self._lower, (-value, seq))
+            self._side[seq] = True
+            self._lower_size += 1
+        else:
+            heapq.heappush(self._upper, (value, seq))
+            self._side[seq] = False
+            self._upper_size += 1
+        self._window.append((value, seq))
+
+        if len(self._window) > self.window_size:
+            _, old_seq = self._window.popleft()
+            if self._side.pop(old_seq):
+                self._lower_size -= 1
+            else:
+                self._upper_size -= 1
+            self._dead.add(old_seq)
+
+        self._rebalance()
+        if len(self._dead) > self.window_size:
+            self._compact()
+
+    def value(self, default: float = 0.0) -> float:
+        """Quantile hiện tại (nearest-rank), hoặc default nếu cửa sổ trống"""
+        self._prune(self._lower)
+        if not self._lower:
+            return default
+        return -self._lower[0][0]
+
+    def _target_lower_size(self):
+        n = len(self._window)
+        return min(n, int(math.floor(self.quantile * (n - 1))) + 1) if n else 0
+
+    def _rebalance(self):
+        target = self._target_lower_size()
+        while self._lower_size > target:
+            self._prune(self._lower)
+            neg_value, seq = heapq.heappop(self._lower)
+            heapq.heappush(self._upper, (-neg_value, seq))
+            self._side[seq] = False
+            self._lower_size -= 1
+            self._upper_size += 1
+        while self._lower_size < target and self._upper_size > 0:
+            self._prune(self._upper)
+            value, seq = heapq.heappop(self._upper)
+            heapq.heappush(self._lower, (-value, seq))
+            self._side[seq] = True
+            self._upper_size -= 1
+            self._lower_size += 1
+        self._prune(self._lower)
+        self._prune(self._upper)
+
+    def _compact(self):
+        """Dựng lại 2 heap khi phần tử chết tích tụ quá nhiều (chi phí khấu hao O(log n))"""
+        self._lower = [item for item in self._lower if item[1] not in self._dead]
+        self._upper = [item for item in self._upper if item[1] not in self._dead]
+        heapq.heapify(self._lower)
+        heapq.heapify(self._upper)
+        self._dead.clear()
+
+    def _prune(self, heap):
+        """Bỏ các phần tử đã rời cửa sổ khỏi đỉnh heap"""
+        while heap and heap[0][1] in self._dead:
+            self._dead.discard(heapq.heappop(heap)[1])
+
+class NoiseFloorEstimator(RollingQuantile):
+    """Noise nền (RMS) theo phân vị thấp của cửa sổ tính bằng giây"""
+
+    def __init__(self, window_seconds: float = None, quantile: float = None,
+                 frame_seconds: float = None, min_frames: int = None):
+        """
+        Khởi tạo NoiseFloorEstimator
+
+        Args:
+            window_seconds (float): Độ dài cửa sổ (mặc định NOISE_FLOOR_WINDOW_SECONDS)
+            quantile (float): Phân vị coi là noise nền (mặc định NOISE_FLOOR_QUANTILE)
+            frame_seconds (float): Độ dài 1 frame (mặc định 20ms)
+            min_frames (int): Số frame tối thiểu trước khi ước lượng được dùng
+        """
+        self.window_seconds = config.NOISE_FLOOR_WINDOW_SECONDS if window_seconds is None else window_seconds
+        self.frame_seconds = frame_seconds or config.FRAME_SAMPLES / config.SAMPLE_RATE
+        self.min_frames = config.NOISE_FLOOR_MIN_FRAMES if min_frames is None else min_frames
+        window_size = max(1, int(round(self.window_seconds / self.frame_seconds)))
+        super().__init__(window_size, config.NOISE_FLOOR_QUANTILE if quantile is None else quantile)
+
+    @property
+    def ready(self) -> bool:
+        """Đã đủ dữ liệu để tin ước lượng chưa"""
+        return len(self) > self.min_frames
+
+def adaptive_speech_threshold(noise_floor, max_threshold=1000):
+    """
+    Ngưỡng RMS speech động: gấp đôi noise nền, kẹp trong [MIN_SPEECH_RMS/2, max_threshold]
+
+    Args:
+        noise_floor (NoiseFloorEstimator): Estimator của thiết bị
+        max_threshold (float): Giá trị tối đa để tránh quá nhạy
+
+    Returns:
+        float: Ngưỡng RMS
+    """
+    if not noise_floor.ready:
+        return config.MIN_SPEECH_RMS
+    threshold = max(config.MIN_SPEECH_RMS * 0.5, noise_floor.value() * 2)
+    return min(threshold, max_threshold)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prompt Builder - Ghép prompt Gemini theo phần tĩnh/động
+Phần tĩnh (system prompt + hướng dẫn JSON) được dựng 1 lần và gửi qua
+system_instruction, giữ nguyên giữa các câu hỏi để Gemini cache được prefix.
+Phần động (memory, lịch sử, câu hỏi) được serialize gọn và cập nhật dần:
+mỗi lượt hội thoại chỉ render 1 lần khi được thêm vào. Chỉ HISTORY_VERBATIM_TURNS
+lượt gần nhất được giữ nguyên văn, các lượt cũ hơn được tóm tắt ở nền, và phần
+lịch sử bị cắt bớt (cũ nhất trước) để prompt không vượt PROMPT_TOKEN_BUDGET.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import audio_utils.server_config as config
+from .token_budget import TokenEstimator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = 'Trả lời câu hỏi một cách ngắn gọn và chính xác bằng tiếng Việt. Giới hạn câu trả lời trong 100 ký tự.'
+
+JSON_INSTRUCTION = '''
+
+QUAN TRỌNG: Trả lời theo định dạng JSON sau:
+{
+  "main_response": "câu trả lời chính cho người dùng (tối đa 200 ký tự)",
+  "new_memory": {
+    "user_name": "tên người dùng",
+    "preferences": "sở thích/thói quen",
+    "personal_info": "thông tin cá nhân",
+    "interests": "lĩnh vực quan tâm",
+    "additional_info": "thông tin bổ sung khác"
+  }
+}
+
+Hãy cập nhật và trả về TOÀN BỘ memory file mới dựa trên:
+1. Memory hiện tại được cung cấp
+2. Lịch sử các cuộc hội thoại gần nhất (mỗi dòng: U = người dùng, A = AI)
+3. Câu hỏi/thông tin mới từ người dùng
+
+Nếu không có thông tin mới, hãy giữ nguyên memory cũ.
+'''
+
+# Khi memory được tổng hợp ở nền (MEMORY_CONSOLIDATION), câu hỏi tương tác chỉ cần câu trả lời
+ANSWER_INSTRUCTION = '''
+
+QUAN TRỌNG: Trả lời theo định dạng JSON sau:
+{
+  "main_response": "câu trả lời chính cho người dùng (tối đa 200 ký tự)"
+}
+
+Dùng memory và lịch sử hội thoại được cung cấp để cá nhân hóa câu trả lời (gọi tên người dùng nếu đã biết).
+'''
+
+CONSOLIDATION_INSTRUCTION = '''Bạn quản lý bộ nhớ dài hạn về người dùng của một trợ lý giọng nói.
+Dựa trên MEMORY HIỆN TẠI và CÁC LƯỢT HỘI THOẠI MỚI (mỗi dòng: U = người dùng, A = AI),
+hãy trả về TOÀN BỘ memory mới dạng JSON với các trường: user_name, preferences,
+personal_info, interests, additional_info.
+Giữ nguyên thông tin cũ còn đúng, thêm/sửa thông tin mới mà người dùng nói về bản thân,
+bỏ qua các chi tiết không liên quan tới người dùng. Mỗi trường là 1 chuỗi ngắn.
+'''
+
+SUMMARY_INSTRUCTION = '''Bạn tóm tắt hội thoại giữa người dùng và trợ lý giọng nói.
+Dựa trên TÓM TẮT CŨ và CÁC LƯỢT CẦN TÓM TẮT (mỗi dòng: U = người dùng, A = AI),
+viết 1 đoạn tóm tắt mới bằng tiếng Việt, tối đa 3-4 câu ngắn: các chủ đề đã nói,
+câu hỏi/yêu cầu còn dang dở, chi tiết có thể được nhắc lại. Chỉ trả về đoạn tóm tắt.
+'''
+
+def serialize_memory(memory):
+    """Memory dạng JSON 1 dòng, không khoảng trắng thừa"""
+    return json.dumps(memory, ensure_ascii=False, separators=(',', ':')) if memory else ""
+
+def serialize_turn(turn):
+    """1 lượt hội thoại thành 1 dòng gọn"""
+    return f"U: {turn.get('user', '')} | A: {turn.get('ai', '')}"
+
+class _DeviceContext:
+    """Phần động đã serialize của 1 thiết bị"""
+
+    def __init__(self, memory, turns, verbatim, window, summarized):
+        self.memory_text = serialize_memory(memory)
+        self.summary = ""
+        self.pending = []          # Lượt cũ hơn phần nguyên văn, chờ được tóm tắt
+        self.summarizing = False
+        self.failures = 0          # Số lần tóm tắt lỗi liên tiếp
+        self.retry_at = 0.0        # Chưa tóm tắt lại trước thời điểm này (sau khi lỗi)
+        self.turn_lines = deque()
+        self.verbatim = verbatim
+        self.window = window
+        self.summarized = summarized
+        for turn in turns:
+            self.add_line(serialize_turn(turn))
+
+    def add_line(self, line):
+        self.turn_lines.append(line)
+        while len(self.turn_lines) > self.verbatim:
+            line = self.turn_lines.popleft()
+            if self.summarized:
+                self.pending.append(line)
+        if not self.summarizing and len(self.pending) > self.window:
+            del self.pending[:-self.window]  # Tóm tắt lỗi mãi: không giữ quá cửa sổ cũ
+
+class PromptBuilder:
+    """Dựng system_instruction (cache theo nội dung) và contents (cập nhật dần theo thiết bị)"""
+
+    def __init__(self, loader, window=None, summarize=None, estimator=None):
+        """
+        Khởi tạo PromptBuilder
+
+        Args:
+            loader (callable): loader(device_id) -> (memory, danh sách lượt gần nhất),
+                chỉ gọi lần đầu gặp thiết bị
+            window (int): Số lượt lịch sử đưa vào prompt (mặc định CONVERSATION_WINDOW)
+            summarize (callable): summarize(device_id, tóm tắt cũ, các dòng lượt cũ) -> tóm tắt mới,
+                chạy ở thread nền; None = không tóm tắt, giữ nguyên văn cả cửa sổ
+            estimator (TokenEstimator): Ước lượng token để giữ ngân sách PROMPT_TOKEN_BUDGET
+        """
+        self.loader = loader
+        self.window = window or config.CONVERSATION_WINDOW
+        self.summarize = summarize
+        self.verbatim = min(self.window, config.HISTORY_VERBATIM_TURNS) if summarize else self.window
+        self.estimator = estimator or TokenEstimator()
+        self.dropped_lines = 0   # Số dòng lịch sử bị cắt vì vượt ngân sách token
+        self.summaries = 0
+        self._lock = threading.Lock()
+        self._contexts = {}
+        self._system_key = None
+        self._system_instruction = None
+
+    def system_instruction(self, system_prompt=None, instruction=JSON_INSTRUCTION) -> str:
+        """Phần tĩnh của prompt - chỉ ghép lại khi system prompt/hướng dẫn đổi"""
+        key = (system_prompt or DEFAULT_SYSTEM_PROMPT, instruction)
+        with self._lock:
+            if key != self._system_key:
+                self._system_key = key
+                self._system_instruction = key[0] + instruction
+            return self._system_instruction
+
+    def _context(self, device_id):
+        context = self._contexts.get(device_id)
+        if context is None:
+            memory, turns = self.loader(device_id)
+            context = _DeviceContext(memory, turns, self.verbatim, self.window, self.summarize is not None)
+            self._contexts[device_id] = context
+            self._maybe_summarize(device_id, context)
+        return context
+
+    def _maybe_summarize(self, device_id, context):
+        """Gom đủ HISTORY_SUMMARY_BATCH lượt cũ thì tóm tắt ở nền (gọi khi giữ _lock)"""
+        if not self.summarize or context.summarizing or len(context.pending) < config.HISTORY_SUMMARY_BATCH:
+            return
+        if time.time() < context.retry_at:
+            return  # Vừa tóm tắt lỗi, chờ hết thời gian nghỉ
+        context.summarizing = True
+        threading.Thread(target=self._summarize, args=(device_id, context, context.summary, list(context.pending)),
+                         name="history-summary", daemon=True).start()
+
+    def _summarize(self, device_id, context, summary, lines):
+        try:
+            new_summary = (self.summarize(device_id, summary, lines) or "").strip()
+        except Exception as e:
+            logger.warning(f"Lỗi tóm tắt lịch sử ({len(lines)} lượt): {e}")
+            new_summary = ""
+        with self._lock:
+            context.summarizing = False
+            if new_summary:
+                context.summary = new_summary[:config.HISTORY_SUMMARY_MAX_CHARS]
+                del context.pending[:len(lines)]
+                context.failures = 0
+                context.retry_at = 0.0
+                self.summaries += 1
+            else:
+                # Lỗi liên tiếp: nghỉ HISTORY_SUMMARY_RETRY_SECONDS, x2 mỗi lần, tối đa HISTORY_SUMMARY_RETRY_MAX_SECONDS
+                context.failures += 1
+                delay = min(config.HISTORY_SUMMARY_RETRY_SECONDS * 2 ** (context.failures - 1),
+                            config.HISTORY_SUMMARY_RETRY_MAX_SECONDS)
+                context.retry_at = time.time() + delay
+
+    def update_memory(self, memory, device_id=None):
+        """Gọi khi memory của thiết bị được thay"""
+        with self._lock:
+            self._context(device_id).memory_text = serialize_memory(memory)
+
+    def add_turn(self, turn, device_id=None):
+        """Gọi khi thêm 1 lượt hội thoại - chỉ lượt mới được render"""
+        with self._lock:
+            context = self._context(device_id)
+            context.add_line(serialize_turn(turn))
+            self._maybe_summarize(device_id, context)
+
+    def invalidate(self, device_id=None):
+        """Bỏ phần động đã cache (lần build sau sẽ nạp lại từ loader)"""
+        with self._lock:
+            if device_id is None:
+                self._contexts.clear()
+            else:
+                self._contexts.pop(device_id, None)
+
+    def build_contents(self, question, device_id=None, reserved_tokens=0) -> str:
+        """
+        Phần động: memory + tóm tắt + lịch sử + câu hỏi mới
+
+        Args:
+            reserved_tokens (int): Token đã dùng cho phần tĩnh (system_instruction);
+                lịch sử được cắt từ lượt cũ nhất để tổng không vượt PROMPT_TOKEN_BUDGET
+        """
+        estimate = self.estimator.estimate
+        question_part = f"CÂU HỎI MỚI: {question}"
+        with self._lock:
+            context = self._context(device_id)
+            parts = []
+            if context.memory_text:
+                parts.append(f"MEMORY HIỆN TẠI: {context.memory_text}")
+            if context.summary:
+                parts.append(f"TÓM TẮT HỘI THOẠI TRƯỚC: {context.summary}")
+            # Không quá cửa sổ: pending có thể dồn thêm trong lúc đang tóm tắt/chờ thử lại
+            history = (context.pending + list(context.turn_lines))[-self.window:]
+        
+        # Memory, tóm tắt và câu hỏi luôn giữ; lịch sử lấy từ mới nhất tới khi hết ngân sách
+        used = reserved_tokens + sum(estimate(p) for p in parts) + estimate(question_part)
+        lines = []
+        for line in reversed(history):
+            cost = estimate(line) + 1
+            if used + cost > config.PROMPT_TOKEN_BUDGET:
+                # Ước lượng token chạy ngoài _lock, chỉ cộng bộ đếm trong _lock (add_turn/tóm tắt chạy ở thread khác)
+                with self._lock:
+                    self.dropped_lines += len(history) - len(lines)
+                break
+            lines.append(line)
+            used += cost
+        if lines:
+            parts.append("LỊCH SỬ:\n" + "\n".join(reversed(lines)))
+        parts.append(question_part)
+        return "\n\n".join(parts)
+
+    def stats(self):
+        """Số lần tóm tắt, số dòng lịch sử bị cắt và thống kê ước lượng token"""
+        stats = self.estimator.stats()
+        with self._lock:
+            stats.update(summaries=self.summaries, dropped_lines=self.dropped_lines)
+        return stats
+
+def build_summary_contents(summary, lines) -> str:
+    """Prompt tóm tắt: tóm tắt cũ + các dòng lượt cần gộp vào"""
+    return f"TÓM TẮT CŨ: {summary or '(chưa có)'}\n\nCÁC LƯỢT CẦN TÓM TẮT:\n" + "\n".join(lines)
+
+def build_consolidation_contents(memory, turns) -> str:
+    """Prompt tổng hợp memory: memory hiện tại + các lượt mới"""
+    lines = "\n".join(serialize_turn(t) for t in turns)
+    return f"MEMORY HIỆN TẠI: {serialize_memory(memory) or '{}'}\n\nCÁC LƯỢT HỘI THOẠI MỚI:\n{lines}"
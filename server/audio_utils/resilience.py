@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resilience - Deadline, hedging và circuit breaker cho các bước ASR/LLM/TTS
+Mỗi câu nói có 1 ngân sách thời gian (UTTERANCE_DEADLINE_SECONDS) chia cho
+các bước; bước nào quá hạn thì bỏ chờ và chuyển sang phương án dự phòng.
+Circuit breaker ngắt hẳn 1 dịch vụ đang lỗi liên tục để không phải chờ timeout
+ở mỗi câu nói, thử lại sau BREAKER_RESET_SECONDS.
+"""
+
+import threading
+import time
+from collections import deque
+
+import audio_utils.server_config as config
+
+STAGES = ("asr", "llm", "tts")
+
+class StageTimeout(TimeoutError):
+    """Bước xử lý vượt quá ngân sách thời gian"""
+
+class CircuitOpen(RuntimeError):
+    """Circuit breaker đang mở - không gọi dịch vụ"""
+
+class Deadline:
+    """Ngân sách thời gian của 1 câu nói, tính từ lúc người dùng nói xong"""
+
+    def __init__(self, total=None):
+        self.total = config.UTTERANCE_DEADLINE_SECONDS if total is None else total
+        self.start = time.time()
+
+    def remaining(self):
+        return max(0.0, self.start + self.total - time.time())
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def budget(self, stage):
+        """
+        Thời gian tối đa cho 1 bước: giới hạn riêng của bước (STAGE_TIMEOUTS),
+        trừ phần tối thiểu để dành cho các bước sau (STAGE_MIN_SECONDS)
+        """
+        later = STAGES[STAGES.index(stage) + 1:]
+        reserve = sum(config.STAGE_MIN_SECONDS[s] for s in later)
+        return max(config.STAGE_MIN_SECONDS[stage], min(config.STAGE_TIMEOUTS[stage], self.remaining() - reserve))
+
+def stage_budget(stage, deadline=None):
+    """Ngân sách của bước theo deadline, hoặc giới hạn riêng của bước nếu không có deadline"""
+    return deadline.budget(stage) if deadline else config.STAGE_TIMEOUTS[stage]
+
+class StageMetrics:
+    """Thống kê 1 bước: số lần gọi, timeout, lỗi, dự phòng và độ trễ p50/p95"""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.hedges = 0
+
+    def record(self, seconds=None, outcome="ok"):
+        with self._lock:
+            self.calls += 1
+            if seconds is not None:
+                self.latencies.append(seconds)
+            if outcome == "timeout":
+                self.timeouts += 1
+            elif outcome == "error":
+                self.failures += 1
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self):
+        with self._lock:
+            ordered = sorted(self.latencies)
+            pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+            return {
+                "calls": self.calls, "timeouts": self.timeouts, "failures": self.failures,
+                "fallbacks": self.fallbacks, "hedges": self.hedges,
+                "p50": pick(0.5), "p95": pick(0.95),
+            }
+
+class CircuitBreaker:
+    """
+    Closed -> (BREAKER_FAILURE_THRESHOLD lỗi liên tiếp) -> Open -> (sau BREAKER_RESET_SECONDS)
+    -> Half-open: cho 1 request thử, thành công thì Closed, lỗi thì Open lại
+    (request thử không báo kết quả sau reset_seconds thì cho request thử khác)
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=None, reset_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or config.BREAKER_FAILURE_THRESHOLD
+        self.reset_seconds = config.BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self.trips = 0
+        self.short_circuits = 0
+
+    def allow(self):
+        """Có được gọi dịch vụ không (Half-open chỉ cho 1 request thử)"""
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and (not self._probing or
+                                                 time.time() - self._probe_started >= self.reset_seconds):
+                self._probing = True
+                self._probe_started = time.time()
+                return True
+            self.short_circuits += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"✅ Circuit '{self.name}' đóng lại, dịch vụ hoạt động bình thường")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    print(f"🔌 Circuit '{self.name}' mở sau {self._failures} lỗi, dùng dự phòng trong {self.reset_seconds:.0f}s")
+                self.state = self.OPEN
+                self._opened_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "trips": self.trips, "short_circuits": self.short_circuits,
+                    "consecutive_failures": self._failures}
+
+_breakers = {}
+_metrics = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(name):
+    """Circuit breaker dùng chung theo tên dịch vụ"""
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def get_stage_metrics(stage):
+    with _registry_lock:
+        if stage not in _metrics:
+            _metrics[stage] = StageMetrics()
+        return _metrics[stage]
+
+def get_resilience_stats():
+    """Thống kê theo bước và trạng thái các circuit breaker"""
+    with _registry_lock:
+        metrics = dict(_metrics)
+        breakers = dict(_breakers)
+    return {
+        "stages": {name: m.stats() for name, m in metrics.items()},
+        "breakers": {name: b.stats() for name, b in breakers.items()},
+    }
+
+def run_with_timeout(fn, timeout, *args, **kwargs):
+    """
+    Chạy fn trong thread riêng, chờ tối đa timeout giây
+
+    Thư viện mạng (gTTS, SpeechRecognition, google-genai) không hủy được giữa chừng,
+    nên khi quá hạn thread cũ vẫn chạy nốt ở nền và kết quả bị bỏ.
+
+    Raises:
+        StageTimeout: Quá hạn
+    """
+    result = {}
+    done = threading.Event()
+
+    def _target():
+        try:
+            result["value"] = fn(*args, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=_target, daemon=True).start()
+    if not done.wait(timeout):
+        raise StageTimeout(f"Quá {timeout:.1f}s")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+def hedged_call(fn, timeout, hedge_delay=None, attempts=2, metrics=None):
+    """
+    Gọi fn, nếu sau hedge_delay giây chưa xong thì gọi thêm 1 bản song song;
+    lấy kết quả của bản xong trước (bản lỗi bị bỏ qua nếu còn bản khác đang chạy)
+
+    Args:
+        fn (callable): Hàm không tham số
+        timeout (float): Tổng thời gian chờ
+        hedge_delay (float): Chờ bao lâu thì gửi bản dự phòng (None/0 = không hedge)
+        attempts (int): Tổng số bản tối đa
+
+    Raises:
+        StageTimeout: Không bản nào xong trong timeout
+        Exception: Lỗi của bản cuối cùng nếu tất cả đều lỗi
+    """
+    cond = threading.Condition()
+    outcomes = []  # [(ok, value)]
+
+    def _target():
+        try:
+            value = (True, fn())
+        except Exception as e:
+            value = (False, e)
+        with cond:
+            outcomes.append(value)
+            cond.notify_all()
+
+    end = time.time() + timeout
+    launched = 0
+    with cond:
+        while True:
+            # Kiểm tra thành công trước khi hedge: bản đã xong thì không gửi thêm request
+            for ok, value in outcomes:
+                if ok:
+                    return value
+            # Tới đây mọi outcome đều là lỗi - gửi lại sớm khi tất cả bản đã gửi đều lỗi
+            all_failed = len(outcomes) == launched
+            if launched == 0 or (hedge_delay and launched < attempts and
+                                 (time.time() >= start + hedge_delay or all_failed)):
+                threading.Thread(target=_target, daemon=True).start()
+                start = time.time()
+                if launched and metrics:
+                    metrics.count("hedges")
+                launched += 1
+                all_failed = False
+            if all_failed and (not hedge_delay or launched >= attempts):
+                raise outcomes[-1][1]
+            now = time.time()
+            if now >= end:
+                raise StageTimeout(f"Quá {timeout:.1f}s ({launched} lần gọi)")
+            wait = end - now
+            if hedge_delay and launched < attempts:
+                wait = min(wait, max(0.0, start + hedge_delay - now))
+            cond.wait(timeout=max(0.01, wait))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Response Cache - Cache câu trả lời Gemini theo câu hỏi đã chuẩn hóa
+Khóa = câu hỏi chuẩn hóa + hash memory hiện tại, có TTL và loại bỏ LRU.
+Câu hỏi phụ thuộc thời gian ("hôm nay", "bây giờ"...), câu kể cập nhật memory
+("nhớ giúp...", "tôi tên là Nam") hoặc câu tiếp nối lượt trước ("tại sao vậy",
+"nói tiếp đi", câu hỏi ngay sau 1 lượt hội thoại) thì không cache.
+"""
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import audio_utils.server_config as config
+from .prompt_builder import serialize_memory
+
+# Câu trả lời thay đổi theo thời điểm hỏi
+TIME_SENSITIVE_PATTERNS = [
+    r"\b(bây giờ|hiện (tại|nay|giờ)|lúc này|mấy giờ|giờ này)\b",
+    r"\b(hôm nay|hôm qua|ngày mai|ngày kia|tuần (này|sau|trước)|tháng (này|sau|trước)|năm (nay|sau|ngoái))\b",
+    r"\b(thứ mấy|ngày (bao nhiêu|mấy))\b",
+    r"\b(thời tiết|nhiệt độ|tin tức|giá vàng|tỉ giá|tỷ giá|kết quả|mới nhất)\b",
+    r"\b(now|today|tomorrow|yesterday|latest|weather|news)\b",
+]
+_TIME_SENSITIVE_RE = re.compile("|".join(TIME_SENSITIVE_PATTERNS), re.IGNORECASE)
+
+# Câu kể làm thay đổi memory ("nhớ giúp...", "tôi tên là Nam") - phải tới Gemini để cập nhật memory.
+# Câu hỏi về người dùng ("tôi tên là gì") vẫn cache được vì khóa đã gồm hash memory.
+MEMORY_STATEMENT_PATTERNS = [
+    r"^((à|ừ|ờ|nhân tiện|bạn|em|hãy|làm ơn) )*(nhớ|ghi nhớ|quên|đừng quên)\b",
+    r"^((à|ừ|ờ|nhân tiện) )*(tôi|tao|tớ|tui|mình) (tên|là|thích|không thích|ghét|yêu|sống|ở|làm|học|đang|có|sinh|năm nay)\b",
+    r"^((à|ừ|ờ|nhân tiện) )*(tên|sinh nhật|quê|nhà) (của )?(tôi|tao|tớ|tui|mình) (là|ở)\b",
+    r"^(remember|forget|my name is|i (am|like|love|live|work))\b",
+]
+_MEMORY_STATEMENT_RE = re.compile("|".join(MEMORY_STATEMENT_PATTERNS), re.IGNORECASE)
+# Câu kết thúc bằng từ hỏi là câu hỏi, không phải câu kể
+_QUESTION_END_RE = re.compile(r"\b(gì|ai|đâu|không|nào|chưa|sao|mấy|bao nhiêu|nhỉ|à|hả|what|who|where)$", re.IGNORECASE)
+
+# Câu hỏi tiếp nối chỉ trỏ tới lượt trước (đầu câu) - nghĩa phụ thuộc lịch sử hội thoại
+FOLLOW_UP_PATTERNS = [
+    r"^((thế|vậy) )?còn\b",
+    r"^(tại sao|vì sao|sao)( lại)?( (vậy|thế))?( (nhỉ|à|hả))?$",
+    r"^(nói|kể|giải thích|cho biết|trả lời) (thêm|tiếp|rõ hơn|kỹ hơn|lại)\b",
+    r"^(tiếp đi|tiếp tục|rồi sao)\b",
+    r"^(cái|điều|chuyện|người|chỗ|câu|nó|đó|đấy) (đó|đấy|kia|ấy|là)\b",
+    r"^(what about|how about|and then|tell me more|go on|why( is that| so)?$)",
+]
+_FOLLOW_UP_RE = re.compile("|".join(FOLLOW_UP_PATTERNS), re.IGNORECASE)
+
+def normalize_question(question):
+    """Chuẩn hóa câu hỏi làm khóa cache: NFC, lowercase, bỏ dấu câu, gộp khoảng trắng (giữ dấu tiếng Việt)"""
+    text = unicodedata.normalize("NFC", question or "").lower()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def is_time_sensitive(question):
+    return bool(_TIME_SENSITIVE_RE.search(question or ""))
+
+def is_memory_statement(question):
+    """Câu kể cung cấp/xóa thông tin cho memory (câu đã qua normalize_question)"""
+    return bool(_MEMORY_STATEMENT_RE.search(question or "")) and not _QUESTION_END_RE.search(question or "")
+
+def is_follow_up(question):
+    return bool(_FOLLOW_UP_RE.search(question or ""))
+
+def memory_fingerprint(memory):
+    """Hash ngắn của memory (memory đổi thì câu trả lời cá nhân hóa cũng đổi)"""
+    return hashlib.sha1(serialize_memory(memory).encode("utf-8")).hexdigest()[:16]
+
+class ResponseCache:
+    """Cache LRU có TTL cho câu trả lời, đếm hit/miss/skip"""
+
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        """
+        Khởi tạo ResponseCache
+
+        Args:
+            max_entries (int): Số câu trả lời tối đa (mặc định RESPONSE_CACHE_MAX_ENTRIES)
+            ttl_seconds (float): Thời gian sống của 1 câu trả lời (mặc định RESPONSE_CACHE_TTL_SECONDS)
+        """
+        self.max_entries = max_entries or config.RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl_seconds = config.RESPONSE_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (thời điểm hết hạn, câu trả lời)
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+
+    def make_key(self, question, memory, in_conversation=False):
+        """
+        Khóa cache của câu hỏi
+
+        Args:
+            question (str): Câu hỏi
+            memory (dict): Memory hiện tại của thiết bị
+            in_conversation (bool): Câu hỏi nằm ngay sau lượt trước (cửa sổ hỏi tiếp) - không cache
+
+        Returns:
+            tuple: Khóa, hoặc None nếu câu hỏi không được cache
+        """
+        normalized = normalize_question(question)
+        if (not normalized or in_conversation or is_time_sensitive(normalized)
+                or is_memory_statement(normalized) or is_follow_up(normalized)):
+            with self._lock:
+                self.skipped += 1
+            return None
+        return normalized, memory_fingerprint(memory)
+
+    def get(self, key):
+        """Câu trả lời đã cache (còn hạn) hoặc None"""
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, answer):
+        if key is None or not answer:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
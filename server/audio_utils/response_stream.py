@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Response Stream - Parser JSON tăng dần cho câu trả lời Gemini dạng stream
+Lấy giá trị "main_response" ngay khi từng phần được sinh ra và tách thành
+câu hoàn chỉnh để TTS bắt đầu đọc trước khi Gemini sinh xong "new_memory".
+"""
+
+import re
+
+_KEY_PATTERN = re.compile(r'"main_response"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+SENTENCE_END = ".!?…"
+
+class MainResponseStreamParser:
+    """
+    Nhận từng chunk text của stream, giải mã chuỗi "main_response" (kể cả escape
+    \\", \\n, \\uXXXX) và trả về các câu đã hoàn chỉnh.
+    """
+
+    def __init__(self):
+        self.raw = ""          # Toàn bộ text đã nhận (để parse lại đầy đủ khi stream kết thúc)
+        self.text = ""         # Phần main_response đã giải mã
+        self.started = False   # Đã gặp "main_response": "
+        self.done = False      # Đã gặp dấu " đóng chuỗi
+        self._pos = 0          # Vị trí đang đọc trong raw
+        self._sentence_start = 0
+
+    def feed(self, chunk):
+        """
+        Thêm 1 chunk từ stream
+
+        Returns:
+            list: Các câu mới hoàn chỉnh (câu cuối được trả về khi chuỗi đóng)
+        """
+        if not chunk or self.done:
+            self.raw += chunk or ""
+            return []
+        self.raw += chunk
+
+        if not self.started:
+            match = _KEY_PATTERN.search(self.raw)
+            if not match:
+                return []
+            self.started = True
+            self._pos = match.end()
+
+        while self._pos < len(self.raw):
+            c = self.raw[self._pos]
+            if c == '"':
+                self.done = True
+                self._pos += 1
+                break
+            if c == '\\':
+                decoded, consumed = self._decode_escape(self._pos)
+                if consumed == 0:
+                    break  # Escape bị cắt giữa 2 chunk, chờ chunk sau
+                self.text += decoded
+                self._pos += consumed
+            else:
+                self.text += c
+                self._pos += 1
+        return self._take_sentences()
+
+    def _decode_escape(self, pos):
+        """Giải mã escape tại pos, trả về (ký tự, số ký tự raw đã dùng) hoặc ("", 0) nếu chưa đủ"""
+        if pos + 1 >= len(self.raw):
+            return "", 0
+        kind = self.raw[pos + 1]
+        if kind == 'u':
+            if pos + 6 > len(self.raw):
+                return "", 0
+            try:
+                return chr(int(self.raw[pos + 2:pos + 6], 16)), 6
+            except ValueError:
+                return "", 6
+        return _ESCAPES.get(kind, kind), 2
+
+    def _take_sentences(self):
+        sentences = []
+        text = self.text
+        i = self._sentence_start
+        while i < len(text):
+            c = text[i]
+            boundary = False
+            if c == '\n':
+                boundary = True
+            elif c in SENTENCE_END:
+                # Cần thấy ký tự sau để không cắt "3.5" hay "..." giữa chừng
+                if i + 1 < len(text):
+                    boundary = text[i + 1].isspace()
+                else:
+                    boundary = self.done
+            if boundary:
+                sentence = text[self._sentence_start:i + 1].strip()
+                if sentence:
+                    sentences.append(sentence)
+                self._sentence_start = i + 1
+            i += 1
+        if self.done:
+            tail = text[self._sentence_start:].strip()
+            if tail:
+                sentences.append(tail)
+            self._sentence_start = len(text)
+        return sentences
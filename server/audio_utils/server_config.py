@@ -5,6 +5,7 @@ Server Configuration - Tất cả các constants và cấu hình cho server
 """
 
 from collections import deque
+import os
 import threading
 
 # ====== UDP CONFIG ======
@@ -15,6 +16,11 @@ COMMAND_PORT = 5006  # Port để gửi lệnh về ESP32
 
 # ====== WAKE WORD CONFIG ======
 WAKE_WORD = "hello hello"  # Wake word để kích hoạt LED
+WAKE_WORDS = []            # Các wake phrase bổ sung (dùng chung mọi thiết bị)
+DEVICE_WAKE_WORDS = {}     # Wake phrase riêng theo IP thiết bị, vd {"192.168.1.18": ["konan ơi"]}
+WAKE_WORD_MAX_EDITS = 2    # Số ký tự sai tối đa khi so khớp transcript (sau khi bỏ dấu/khoảng trắng)
+WAKE_WORD_CHARS_PER_EDIT = 5  # Phrase ngắn được sai ít hơn: tối đa len(phrase) // 5 ký tự
+WAKE_WORD_MIN_FUZZY_CHARS = 6  # Phrase ngắn hơn phải khớp chính xác; từ 6 ký tự được sai 1 ("hello hello" = 8 -> "hello hellu")
 
 # ====== AUDIO PROCESSING CONFIG ======
 ENABLE_PREPROCESSING = True   # Bật preprocessing để cải thiện chất lượng
@@ -38,6 +44,117 @@ SILENCE_AMPLITUDE_THRESHOLD = 800  # Ngưỡng amplitude để coi là silence
 MAX_RECORDING_DURATION = 10.0  # Tối đa 10 giây recording
 MIN_API_CALL_DELAY = 1.0      # Delay tối thiểu giữa các lần gọi API (giây)
 
+# ====== FEATURE CACHE CONFIG ======
+SAMPLE_RATE = 16000           # Sample rate của ESP32 (Hz)
+FRAME_SAMPLES = 320           # 20ms mỗi packet - khớp FRAME_MS trong firmware
+FRAME_BYTES = FRAME_SAMPLES * 2  # 640 bytes (16-bit)
+FEATURE_FFT_SIZE = 640        # Cửa sổ STFT = 2 frame (50% overlap, hop = 1 frame)
+FEATURE_N_MELS = 40           # Số băng log-mel
+FEATURE_MEL_FMIN = 80         # Tần số thấp nhất của mel filterbank (Hz)
+FEATURE_MEL_FMAX = 7600       # Tần số cao nhất của mel filterbank (Hz)
+
+# ====== VAD CONFIG ======
+VAD_ENGINE = "spectral"       # "spectral" (energy + ZCR + flatness) hoặc "amplitude" (luật cũ)
+VAD_MAX_FLATNESS = 0.3        # Spectral flatness tối đa của speech (noise trắng ~0.56, click ~1.0)
+VAD_MAX_ZCR = 0.3             # Zero-crossing rate tối đa (tiếng xì/hiss cao hơn)
+VAD_ONSET_FRAMES = 3          # Số frame speech liên tiếp để bắt đầu (60ms) - chặn tiếng click
+VAD_HANGOVER_FRAMES = 10      # Giữ trạng thái speech thêm 200ms sau frame speech cuối
+
+# ====== NOISE FLOOR CONFIG ======
+NOISE_FLOOR_WINDOW_SECONDS = 2.0  # Cửa sổ ước lượng noise nền (100 frame 20ms)
+NOISE_FLOOR_QUANTILE = 0.1        # Phân vị RMS coi là noise nền
+NOISE_FLOOR_MIN_FRAMES = 20       # Số frame tối thiểu trước khi dùng ngưỡng động
+
+# ====== KEYWORD SPOTTER CONFIG ======
+KWS_ENABLED = True                # Spotting wake word cục bộ (cần file mẫu trong KWS_TEMPLATE_DIR)
+KWS_TEMPLATE_DIR = "wake_word_templates"  # Thư mục WAV mẫu "hello hello" (16kHz mono 16-bit)
+KWS_HOP_FRAMES = 5                # Chạy DTW mỗi 5 frame (100ms)
+KWS_THRESHOLD = None              # Ngưỡng DTW cố định; None = tự hiệu chỉnh từ các mẫu
+KWS_DEFAULT_THRESHOLD = 0.35      # Ngưỡng khi chỉ có 1 mẫu
+KWS_THRESHOLD_MARGIN = 1.3        # Hệ số nới ngưỡng so với khoảng cách giữa các mẫu
+KWS_REFRACTORY_SECONDS = 1.5      # Bỏ qua sau mỗi lần phát hiện
+KWS_AMBIENT_TRANSCRIPTION = False # True = vẫn gửi câu nói thường lên Google Speech để ghi transcript
+
+# ====== FOLLOW-UP CONFIG ======
+FOLLOW_UP_WINDOW_SECONDS = 6.0    # Sau khi ESP32 phát xong câu trả lời, hỏi tiếp không cần wake word (0 = tắt)
+
+# ====== LOCAL INTENT CONFIG ======
+LOCAL_INTENTS_ENABLED = True      # Trả lời ngay giờ/ngày/bật tắt đèn/"tên tôi là gì" không cần gọi Gemini
+LOCAL_INTENT_MAX_WORDS = 8        # Câu dài hơn số từ này luôn chuyển cho Gemini
+
+# ====== GEMINI CONFIG ======
+GEMINI_STREAMING = True           # Stream câu trả lời, đọc từng câu ngay khi sinh xong (False = chờ trọn câu trả lời)
+MEMORY_CONSOLIDATION = True       # Câu hỏi chỉ sinh câu trả lời, memory được tổng hợp ở nền bằng GEMINI_MEMORY_MODEL
+MEMORY_CONSOLIDATE_EVERY_TURNS = 5        # Tổng hợp memory sau mỗi N lượt hội thoại...
+MEMORY_CONSOLIDATE_INTERVAL_SECONDS = 120 # ...hoặc khi lượt cũ nhất chờ quá T giây (hoặc ngay khi có thông tin cá nhân)
+MEMORY_CONSOLIDATE_DRAIN_SECONDS = 10     # Khi tắt server: chờ tối đa bấy nhiêu giây để tổng hợp các lượt còn chờ
+RESPONSE_CACHE_ENABLED = True     # Câu hỏi lặp lại (cùng memory) được trả lời từ cache, không tốn token
+RESPONSE_CACHE_TTL_SECONDS = 600  # Thời gian sống của 1 câu trả lời trong cache
+RESPONSE_CACHE_MAX_ENTRIES = 256  # Số câu trả lời tối đa (loại bỏ câu ít dùng gần đây nhất)
+RESPONSE_CACHE_CONTEXT_SECONDS = 60  # Câu hỏi trong khoảng này sau lượt trước (vd cửa sổ hỏi tiếp) có thể dựa vào lượt đó - không cache
+
+# ====== LLM SCHEDULER CONFIG ======
+LLM_MAX_CONCURRENCY = 2           # Số request Gemini chạy đồng thời tối đa (tất cả thiết bị)
+LLM_INTERACTIVE_RESERVED_SLOTS = 1  # Số slot việc nền không được chiếm (dành cho câu hỏi tương tác)
+LLM_QUEUE_TIMEOUT_SECONDS = 15.0  # Câu hỏi chờ slot quá lâu thì bỏ (trả lời lỗi thay vì treo)
+LLM_MAX_RETRIES = 2               # Số lần thử lại khi bị 429
+LLM_BACKOFF_BASE_SECONDS = 1.0    # Key bị 429 nghỉ 1s, 2s, 4s... (x2 mỗi lần liên tiếp)
+LLM_BACKOFF_MAX_SECONDS = 30.0    # Thời gian nghỉ tối đa của 1 key
+
+# ====== MEMORY STORE CONFIG ======
+MEMORY_BACKEND = "sqlite"         # "sqlite" (memory/lịch sử riêng từng thiết bị) hoặc "json" (file dùng chung như cũ)
+MEMORY_HISTORY_RETENTION = 5000   # Số lượt hội thoại giữ lại mỗi thiết bị (SQLite)
+MEMORY_WRITE_DELAY_SECONDS = 1.0  # Gộp các lần ghi memory/lịch sử trong khoảng này thành 1 lần ghi nền
+CONVERSATION_WINDOW = 20          # Số lượt hội thoại gần nhất giữ trong RAM và đưa vào prompt
+JOURNAL_MAX_ENTRIES = 5000        # Số lượt giữ lại trong journal sau khi nén
+JOURNAL_COMPACT_SLACK = 500       # Nén khi journal vượt JOURNAL_MAX_ENTRIES + slack dòng
+
+# ====== PROMPT BUDGET CONFIG ======
+HISTORY_SUMMARY_ENABLED = True    # Lượt cũ hơn HISTORY_VERBATIM_TURNS được tóm tắt ở nền bằng GEMINI_MEMORY_MODEL
+HISTORY_VERBATIM_TURNS = 6        # Số lượt gần nhất đưa nguyên văn vào prompt
+HISTORY_SUMMARY_BATCH = 4         # Gom đủ N lượt cũ mới gọi tóm tắt 1 lần
+HISTORY_SUMMARY_MAX_CHARS = 600   # Độ dài tối đa của bản tóm tắt hội thoại
+HISTORY_SUMMARY_RETRY_SECONDS = 30.0       # Tóm tắt lỗi thì nghỉ 30s, 60s, 120s... trước khi thử lại
+HISTORY_SUMMARY_RETRY_MAX_SECONDS = 600.0  # Thời gian nghỉ tối đa giữa 2 lần thử tóm tắt
+PROMPT_TOKEN_BUDGET = 2000        # Trần token ước lượng của prompt (system + contents), lịch sử cũ nhất bị cắt trước
+
+# ====== WARM-UP CONFIG ======
+WARMUP_ENABLED = True             # Khi phát hiện wake word: chuẩn bị Gemini client/kết nối, prompt, DNS, earcon
+WARMUP_MIN_INTERVAL_SECONDS = 5.0 # Không warm-up lại nếu vừa warm-up trong khoảng này
+WARMUP_HOSTS = ["www.google.com", "translate.google.com"]  # Host của Google Speech và gTTS (phân giải DNS trước)
+ACK_EARCON_ENABLED = True         # Phát earcon ngắn ngay khi nhận được câu hỏi (trước khi có câu trả lời)
+
+# ====== SPECULATION CONFIG ======
+SPECULATION_ENABLED = True        # Gửi Gemini sớm khi câu hỏi vừa bắt đầu im lặng (thêm 1 lần gọi Google Speech mỗi câu hỏi)
+SPECULATION_SILENCE_FRAMES = 15   # Số frame im lặng (300ms, trước MIN_SILENCE_DURATION) để đoán người dùng đã hỏi xong
+
+# ====== DEADLINE / CIRCUIT BREAKER CONFIG ======
+UTTERANCE_DEADLINE_SECONDS = 15.0 # Ngân sách từ lúc nói xong tới khi có câu trả lời (chia cho ASR -> LLM -> TTS)
+STAGE_TIMEOUTS = {"asr": 6.0, "llm": 8.0, "tts": 5.0}     # Thời gian tối đa của từng bước
+STAGE_MIN_SECONDS = {"asr": 2.0, "llm": 2.0, "tts": 2.0}  # Phần tối thiểu luôn để dành cho mỗi bước
+ASR_HEDGE_DELAY_SECONDS = 2.5     # Google Speech chưa trả lời sau khoảng này thì gửi thêm 1 bản (None = tắt)
+OFFLINE_ASR_MODEL_DIR = "vosk-model-small-vn-0.4"  # Model Vosk tiếng Việt cho ASR dự phòng (cần pip install vosk)
+BREAKER_FAILURE_THRESHOLD = 3     # Số lỗi/quá hạn liên tiếp để ngắt 1 dịch vụ
+BREAKER_RESET_SECONDS = 30.0      # Ngắt bao lâu rồi mới thử lại dịch vụ
+LLM_FALLBACK_REPLY = "Xin lỗi, mình đang gặp sự cố kết nối. Bạn hỏi lại sau nhé."
+TTS_FALLBACK_WAV = ""             # WAV thu sẵn phát khi gTTS lỗi (trống = âm báo 2 nốt)
+
+# ====== TTS PIPELINE CONFIG ======
+TTS_PIPELINE_ENABLED = True       # Câu trả lời không stream cũng được tách câu, tổng hợp song song, gửi theo thứ tự
+TTS_PIPELINE_WORKERS = 3          # Số đoạn tổng hợp (gTTS + decode) cùng lúc
+TTS_CHUNK_MAX_CHARS = 100         # Độ dài tối đa 1 đoạn (gTTS tự tách mỗi 100 ký tự thành 1 request)
+
+# ====== TTS CACHE CONFIG ======
+TTS_CACHE_ENABLED = True          # Lưu WAV đã tổng hợp (16kHz mono) trên đĩa, câu lặp lại không gọi gTTS
+TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tts_cache")  # Thư mục cache (trong thư mục server, như memory.db)
+TTS_CACHE_MAX_MB = 50             # Dung lượng tối đa, vượt thì xóa file dùng lâu nhất
+TTS_CACHE_PRELOAD = [             # Tổng hợp sẵn lúc khởi động (nếu chưa có trong cache)
+    "Đã bật đèn.",
+    "Đã tắt đèn.",
+    "Mình chưa biết tên bạn. Bạn tên là gì?",
+    LLM_FALLBACK_REPLY,
+]
+
 # ====== GOOGLE SPEECH CONFIG ======
 GOOGLE_SPEECH_LANGUAGE = "vi-VN"  # Tiếng Việt
 GOOGLE_SPEECH_TIMEOUT = 5         # Timeout 5 giây
@@ -53,6 +170,8 @@ esp32_address = None
 
 # State variables for wake word detection
 is_listening_for_question = False
+follow_up_active = False        # Đang trong cửa sổ hỏi tiếp (sau câu trả lời)
+utterance_in_progress = False   # ASR worker đang record 1 câu nói
 question_logger = None
 
 # Global shutdown event
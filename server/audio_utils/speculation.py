@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Speculation - Hỏi Gemini trước khi người dùng chắc chắn đã nói xong
+Khi đang nghe câu hỏi và VAD thấy SPECULATION_SILENCE_FRAMES frame im lặng
+(chưa đủ MIN_SILENCE_DURATION để chốt câu), audio tới thời điểm đó được nhận
+dạng và gửi Gemini ở nền. Transcript cuối khớp (sau chuẩn hóa) thì dùng luôn
+câu trả lời đoán trước; người dùng nói tiếp hoặc transcript khác thì hủy.
+"""
+
+import os
+import threading
+import time
+
+import audio_utils.server_config as config
+from .audio_processing import audio_preprocessing_improved
+from .response_cache import normalize_question
+
+_stats = {"started": 0, "hits": 0, "misses": 0, "cancelled": 0, "failed": 0, "wasted_tokens": 0}
+_stats_lock = threading.Lock()
+
+def _count(field, amount=1):
+    with _stats_lock:
+        _stats[field] += amount
+
+def get_speculation_stats():
+    """Thống kê đoán trước: started, hits, misses, cancelled, failed, wasted_tokens, hit_rate"""
+    with _stats_lock:
+        stats = dict(_stats)
+    resolved = stats["hits"] + stats["misses"] + stats["failed"]
+    stats["hit_rate"] = stats["hits"] / resolved if resolved else 0.0
+    return stats
+
+class Speculation:
+    """1 lần đoán trước: ASR trên audio tới lúc bắt đầu im lặng, rồi hỏi Gemini (không ghi memory/lịch sử)"""
+
+    def __init__(self, audio_data, device_id=None):
+        self.device_id = device_id
+        self.transcript = None
+        self.result = None
+        self.cancelled = False
+        self.used = False  # Đã được dùng làm câu trả lời
+        self._lock = threading.Lock()
+        self._asr_done = threading.Event()
+        self._llm_done = threading.Event()
+        _count("started")
+        threading.Thread(target=self._run, args=(audio_data,), name="speculation", daemon=True).start()
+
+    def _run(self, audio_data):
+        from .asr_processor import save_audio_to_wav
+        from .speech_recognition import transcribe_audio_with_google
+        from .local_intents import match_local_intent
+        from .gemini_api import speculate_answer
+
+        try:
+            processed = audio_preprocessing_improved(audio_data) if config.ENABLE_PREPROCESSING else audio_data
+            wav_file = save_audio_to_wav(processed)
+            if wav_file:
+                try:
+                    self.transcript = transcribe_audio_with_google(wav_file, config.GOOGLE_SPEECH_LANGUAGE)
+                finally:
+                    try:
+                        os.unlink(wav_file)
+                    except OSError:
+                        pass
+        except Exception as e:
+            print(f"⚠️ Đoán trước: lỗi ASR: {e}")
+        finally:
+            self._asr_done.set()
+
+        result = None
+        if self.transcript and not self.cancelled and not match_local_intent(self.transcript):
+            print(f"🔮 Đoán trước câu hỏi: '{self.transcript}', gửi Gemini sớm")
+            result = speculate_answer(self.transcript, self.device_id)
+        with self._lock:
+            self.result = result
+            self._llm_done.set()
+            if self.cancelled and result:
+                _count("wasted_tokens", result["tokens"])
+
+    def cancel(self, reason=""):
+        """Hủy (kết quả Gemini nếu có bị bỏ, token đã dùng tính vào wasted_tokens)"""
+        with self._lock:
+            if self.cancelled or self.used:
+                return
+            self.cancelled = True
+            if self._llm_done.is_set() and self.result:
+                _count("wasted_tokens", self.result["tokens"])
+        _count("cancelled")
+        if reason:
+            print(f"🔮 Hủy đoán trước ({reason})")
+
+    def resolve(self, final_transcript, timeout=None):
+        """
+        So transcript cuối với transcript đoán trước
+
+        Args:
+            final_transcript (str): Transcript của cả câu nói
+            timeout (float): Tổng thời gian chờ tối đa cho Gemini đoán trước
+
+        Returns:
+            bool: True nếu dùng được (câu trả lời ở self.result), False thì đã hủy
+        """
+        if self.cancelled:
+            return False
+        end_time = time.time() + timeout if timeout is not None else None
+        if not self._asr_done.is_set():
+            # ASR đoán trước (audio ngắn hơn) còn chậm hơn ASR cả câu: không chờ, hỏi Gemini luôn
+            _count("failed")
+            self.cancel("ASR đoán trước chưa xong")
+            return False
+        if not self.transcript or normalize_question(self.transcript) != normalize_question(final_transcript):
+            _count("misses")
+            self.cancel(f"transcript khác: '{self.transcript}'")
+            return False
+        remaining = max(0.0, end_time - time.time()) if end_time is not None else None
+        if not self._llm_done.wait(remaining) or not self.result:
+            _count("failed")
+            self.cancel("Gemini đoán trước lỗi/chậm")
+            return False
+        self.used = True
+        _count("hits")
+        print(f"🔮 Đoán trước trúng, dùng câu trả lời đã có")
+        return True
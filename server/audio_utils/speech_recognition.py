@@ -5,9 +5,73 @@ Speech Recognition Module
 Chứa các hàm nhận dạng giọng nói chung cho server
 """
 
+import json
+import os
 import time
+import wave
 import speech_recognition as sr
 
+import audio_utils.server_config as config
+from .resilience import get_breaker, get_stage_metrics, hedged_call, stage_budget, StageTimeout
+
+try:
+    import vosk
+    VOSK_AVAILABLE = True
+except ImportError:
+    VOSK_AVAILABLE = False
+
+_vosk_model = None
+
+def _recognize_google(wav_file_path, language="vi-VN"):
+    """
+    Gọi Google Speech 1 lần
+
+    Returns:
+        str: Text đã nhận dạng, "" nếu Google không nghe ra chữ nào
+
+    Raises:
+        sr.RequestError: Lỗi mạng/API
+    """
+    # Khởi tạo recognizer
+    recognizer = sr.Recognizer()
+    
+    # Cấu hình parameters tối ưu
+    recognizer.energy_threshold = 100
+    recognizer.dynamic_energy_threshold = True
+    recognizer.pause_threshold = 0.8
+    recognizer.non_speaking_duration = 0.3
+    recognizer.phrase_threshold = 0.3
+    recognizer.operation_timeout = config.STAGE_TIMEOUTS["asr"]
+    
+    # Đọc audio file
+    with sr.AudioFile(wav_file_path) as source:
+        print(f"🎤 Đang đọc audio file: {wav_file_path}")
+        # Điều chỉnh cho ambient noise
+        recognizer.adjust_for_ambient_noise(source, duration=0.1)
+        audio = recognizer.record(source)
+    
+    # Nhận dạng với Google Speech
+    print(f"🔄 Đang gửi đến Google Speech API...")
+    start_time = time.time()
+    
+    # GOOGLE_SPEECH_URL: trỏ tới server giả lập (mock_services.py), cần SpeechRecognition>=3.11
+    endpoint = os.getenv('GOOGLE_SPEECH_URL')
+    try:
+        text = recognizer.recognize_google(
+            audio,
+            language=language,
+            show_all=False,
+            **({"endpoint": endpoint} if endpoint else {})
+        )
+    except sr.UnknownValueError:
+        print("🔇 Google Speech không thể nhận dạng được giọng nói")
+        return ""
+    
+    processing_time = time.time() - start_time
+    print(f"✅ Google Speech xử lý xong trong {processing_time:.2f}s")
+    
+    return text.strip()
+
 def transcribe_audio_with_google(wav_file_path, language="vi-VN"):
     """
     Sử dụng Google Speech Recognition để nhận dạng giọng nói
@@ -20,45 +84,74 @@ def transcribe_audio_with_google(wav_file_path, language="vi-VN"):
         str: Text đã được nhận dạng, hoặc "" nếu không nhận dạng được
     """
     try:
-        # Khởi tạo recognizer
-        recognizer = sr.Recognizer()
-        
-        # Cấu hình parameters tối ưu
-        recognizer.energy_threshold = 100
-        recognizer.dynamic_energy_threshold = True
-        recognizer.pause_threshold = 0.8
-        recognizer.non_speaking_duration = 0.3
-        recognizer.phrase_threshold = 0.3
-        recognizer.operation_timeout = 15
-        
-        # Đọc audio file
-        with sr.AudioFile(wav_file_path) as source:
-            print(f"🎤 Đang đọc audio file: {wav_file_path}")
-            # Điều chỉnh cho ambient noise
-            recognizer.adjust_for_ambient_noise(source, duration=0.1)
-            audio = recognizer.record(source)
-        
-        # Nhận dạng với Google Speech
-        print(f"🔄 Đang gửi đến Google Speech API...")
-        start_time = time.time()
-        
-        text = recognizer.recognize_google(
-            audio,
-            language=language,
-            show_all=False
-        )
-        
-        processing_time = time.time() - start_time
-        print(f"✅ Google Speech xử lý xong trong {processing_time:.2f}s")
-        
-        return text.strip()
-        
-    except sr.UnknownValueError:
-        print("🔇 Google Speech không thể nhận dạng được giọng nói")
-        return ""
+        return _recognize_google(wav_file_path, language)
     except sr.RequestError as e:
         print(f"❌ Lỗi Google Speech API: {e}")
         return ""
     except Exception as e:
         print(f"❌ Lỗi xử lý Google Speech: {e}")
-        return "" 
\ No newline at end of file
+        return ""
+
+def transcribe_offline(wav_file_path):
+    """
+    Nhận dạng offline bằng Vosk (dự phòng khi Google Speech lỗi/quá hạn)
+    Cần `pip install vosk` và model tiếng Việt ở OFFLINE_ASR_MODEL_DIR.
+    
+    Returns:
+        str: Text đã nhận dạng, "" nếu không có Vosk/model hoặc không nghe ra
+    """
+    global _vosk_model
+    if not VOSK_AVAILABLE or not os.path.isdir(config.OFFLINE_ASR_MODEL_DIR):
+        return ""
+    try:
+        if _vosk_model is None:
+            _vosk_model = vosk.Model(config.OFFLINE_ASR_MODEL_DIR)
+        with wave.open(wav_file_path, "rb") as wf:
+            recognizer = vosk.KaldiRecognizer(_vosk_model, wf.getframerate())
+            while True:
+                data = wf.readframes(4000)
+                if not data:
+                    break
+                recognizer.AcceptWaveform(data)
+        text = json.loads(recognizer.FinalResult()).get("text", "").strip()
+        print(f"🛟 ASR offline (Vosk): '{text}'")
+        return text
+    except Exception as e:
+        print(f"❌ Lỗi ASR offline: {e}")
+        return ""
+
+def transcribe_with_deadline(wav_file_path, language="vi-VN", deadline=None):
+    """
+    Nhận dạng trong ngân sách thời gian của câu nói: gửi Google Speech (gửi thêm
+    1 bản nếu bản đầu chậm hơn ASR_HEDGE_DELAY_SECONDS), quá hạn/lỗi hoặc circuit
+    đang mở thì dùng ASR offline
+    
+    Args:
+        wav_file_path (str): Đường dẫn đến file WAV
+        language (str): Ngôn ngữ nhận dạng
+        deadline (Deadline): Ngân sách thời gian của câu nói
+    
+    Returns:
+        str: Text đã được nhận dạng, hoặc "" nếu không nhận dạng được
+    """
+    breaker = get_breaker("asr")
+    metrics = get_stage_metrics("asr")
+    if breaker.allow():
+        timeout = stage_budget("asr", deadline)
+        start_time = time.time()
+        try:
+            text = hedged_call(lambda: _recognize_google(wav_file_path, language), timeout,
+                               hedge_delay=config.ASR_HEDGE_DELAY_SECONDS, metrics=metrics)
+            breaker.record_success()
+            metrics.record(time.time() - start_time)
+            return text
+        except StageTimeout:
+            print(f"⏱️ Google Speech quá {timeout:.1f}s, chuyển ASR offline")
+            metrics.record(time.time() - start_time, "timeout")
+        except Exception as e:
+            print(f"❌ Lỗi Google Speech API: {e}")
+            metrics.record(time.time() - start_time, "error")
+        breaker.record_failure()
+    
+    metrics.count("fallbacks")
+    return transcribe_offline(wav_file_path)
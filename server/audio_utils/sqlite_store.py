@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite Store - Memory và lịch sử hội thoại của Gemini theo từng thiết bị
+1 file SQLite (WAL) thay cho các file JSON dùng chung: mỗi robot (IP ESP32)
+có memory và lịch sử riêng, tra cứu qua index (device_id, id), giữ tối đa
+MEMORY_HISTORY_RETENTION lượt mỗi thiết bị. Đọc từ cache trong RAM, ghi được
+gom lại và commit theo lô ở thread nền (WriteBehindPersister).
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+from pathlib import Path
+
+import audio_utils.server_config as config
+from .memory_store import DEFAULT_DEVICE_ID, get_persister
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_memory (
+    device_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS conversation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    timestamp TEXT,
+    user TEXT,
+    ai TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_device ON conversation(device_id, id);
+"""
+
+class SQLiteMemoryBackend:
+    """Backend SQLite: memory + lịch sử theo device_id, commit theo lô"""
+
+    def __init__(self, db_path, window=None, retention=None, persister=None):
+        """
+        Khởi tạo SQLiteMemoryBackend
+
+        Args:
+            db_path (str|Path): File SQLite
+            window (int): Số lượt gần nhất giữ trong RAM cho prompt (mặc định CONVERSATION_WINDOW)
+            retention (int): Số lượt tối đa giữ lại mỗi thiết bị (mặc định MEMORY_HISTORY_RETENTION)
+            persister (WriteBehindPersister): Thread ghi nền (mặc định dùng chung)
+        """
+        self.path = Path(db_path)
+        self.window = window or config.CONVERSATION_WINDOW
+        self.retention = retention or config.MEMORY_HISTORY_RETENTION
+        self.persister = persister or get_persister()
+        self._lock = threading.Lock()      # Cache + hàng đợi ghi
+        self._db_lock = threading.Lock()   # Connection dùng chung giữa các thread
+        self._memory = {}   # device_id -> dict
+        self._recent = {}   # device_id -> deque(maxlen=window)
+        self._pending = []  # ("memory", device_id, dict) | ("turn", device_id, entry)
+
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def _key(device_id):
+        return device_id or DEFAULT_DEVICE_ID
+
+    def is_empty(self) -> bool:
+        """Database chưa có dữ liệu nào (dùng để quyết định chuyển dữ liệu cũ)"""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM user_memory) + (SELECT COUNT(*) FROM conversation)"
+            ).fetchone()
+        return row[0] == 0
+
+    def import_legacy(self, memory, turns, device_id=None):
+        """Chuyển memory + lịch sử từ backend file sang database (1 transaction)"""
+        key = self._key(device_id)
+        with self._db_lock, self._conn:
+            if memory:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO user_memory (device_id, data, updated_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(memory, ensure_ascii=False), memory.get('last_updated')),
+                )
+            self._conn.executemany(
+                "INSERT INTO conversation (device_id, timestamp, user, ai) VALUES (?, ?, ?, ?)",
+                [(key, t.get('timestamp'), t.get('user'), t.get('ai')) for t in turns],
+            )
+        logger.info(f"Đã chuyển memory và {len(turns)} tin nhắn cũ vào {self.path.name} (thiết bị '{key}')")
+
+    def get_memory(self, device_id=None) -> dict:
+        """Memory của thiết bị (thiết bị mới kế thừa memory chung cũ nếu có)"""
+        key = self._key(device_id)
+        with self._lock:
+            if key not in self._memory:
+                memory = self._select_memory(key)
+                if memory is None and key != DEFAULT_DEVICE_ID:
+                    memory = self._select_memory(DEFAULT_DEVICE_ID)
+                self._memory[key] = memory or {}
+            return dict(self._memory[key])
+
+    def _select_memory(self, key):
+        with self._db_lock:
+            row = self._conn.execute("SELECT data FROM user_memory WHERE device_id = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError as e:
+            logger.error(f"Memory của thiết bị '{key}' bị hỏng: {e}")
+            return {}
+
+    def set_memory(self, memory, device_id=None):
+        """Thay memory của thiết bị (ghi nền)"""
+        key = self._key(device_id)
+        with self._lock:
+            self._memory[key] = dict(memory)
+            self._pending.append(("memory", key, dict(memory)))
+        self.persister.schedule(self)
+
+    def recent(self, device_id=None) -> list:
+        """N lượt gần nhất của thiết bị (cũ trước)"""
+        key = self._key(device_id)
+        with self._lock:
+            return list(self._recent_window(key))
+
+    def _recent_window(self, key):
+        if key not in self._recent:
+            with self._db_lock:
+                rows = self._conn.execute(
+                    "SELECT timestamp, user, ai FROM conversation WHERE device_id = ? ORDER BY id DESC LIMIT ?",
+                    (key, self.window),
+                ).fetchall()
+            self._recent[key] = deque(
+                ({"timestamp": t, "user": u, "ai": a} for t, u, a in reversed(rows)), maxlen=self.window
+            )
+        return self._recent[key]
+
+    def append_turn(self, entry, device_id=None):
+        """Thêm 1 lượt hội thoại (ghi nền)"""
+        key = self._key(device_id)
+        with self._lock:
+            self._recent_window(key).append(entry)
+            self._pending.append(("turn", key, entry))
+        self.persister.schedule(self)
+
+    def query(self, device_id=None, limit=20, offset=0, contains=None) -> list:
+        """Truy vấn lịch sử của thiết bị, mới nhất trước"""
+        self.flush()
+        sql = "SELECT timestamp, user, ai FROM conversation WHERE device_id = ?"
+        params = [self._key(device_id)]
+        if contains:
+            sql += " AND (user LIKE ? OR ai LIKE ?)"
+            params += [f"%{contains}%", f"%{contains}%"]
+        sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self._db_lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{"timestamp": t, "user": u, "ai": a} for t, u, a in rows]
+
+    def clear_memory(self, device_id=None):
+        """Xóa memory của thiết bị"""
+        self.set_memory({}, device_id)
+
+    def flush(self) -> bool:
+        """Commit mọi thay đổi đang chờ trong 1 transaction, cắt lịch sử cũ vượt retention"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return False
+
+        memory_rows = {}
+        turn_rows = []
+        for kind, key, payload in pending:
+            if kind == "memory":
+                memory_rows[key] = payload  # Chỉ bản mới nhất của mỗi thiết bị
+            else:
+                turn_rows.append((key, payload.get('timestamp'), payload.get('user'), payload.get('ai')))
+
+        try:
+            with self._db_lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO user_memory (device_id, data, updated_at) VALUES (?, ?, ?)",
+                    [(key, json.dumps(m, ensure_ascii=False), m.get('last_updated')) for key, m in memory_rows.items()],
+                )
+                self._conn.executemany(
+                    "INSERT INTO conversation (device_id, timestamp, user, ai) VALUES (?, ?, ?, ?)", turn_rows
+                )
+                for key in {row[0] for row in turn_rows}:
+                    self._conn.execute(
+                        "DELETE FROM conversation WHERE device_id = ? AND id <= "
+                        "(SELECT id FROM conversation WHERE device_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (key, key, self.retention),
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"Lỗi khi ghi {self.path}: {e}")
+            with self._lock:
+                self._pending = pending + self._pending
+            return False
+
+        logger.info(f"Đã commit {len(memory_rows)} memory, {len(turn_rows)} tin nhắn vào {self.path.name}")
+        return True
+
+    def close(self):
+        """Flush và đóng database"""
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Token Budget - Ước lượng số token của prompt để giữ prompt trong ngân sách
+Ước lượng theo số byte UTF-8 (tiếng Việt có dấu tốn nhiều token hơn tiếng Anh
+cùng độ dài), tự hiệu chỉnh theo prompt_token_count Gemini trả về mỗi lần gọi.
+"""
+
+import math
+import threading
+
+BYTES_PER_TOKEN = 4.0  # Ước lượng ban đầu trước khi có số liệu thật
+
+class TokenEstimator:
+    """Ước lượng token từ text, hệ số hiệu chỉnh cập nhật theo số token thật (EMA)"""
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self.ratio = 1.0  # token thật / token ước lượng
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.estimated_total = 0
+        self.actual_total = 0
+        self.last_estimated = 0
+        self.last_actual = 0
+
+    def estimate(self, text):
+        if not text:
+            return 0
+        return math.ceil(len(text.encode("utf-8")) / BYTES_PER_TOKEN * self.ratio)
+
+    def observe(self, estimated, actual):
+        """Ghi nhận 1 lần gọi: số token ước lượng và số token Gemini báo (None nếu không có)"""
+        with self._lock:
+            self.calls += 1
+            self.estimated_total += estimated
+            self.last_estimated = estimated
+            if actual:
+                self.actual_total += actual
+                self.last_actual = actual
+                if estimated:
+                    observed = self.ratio * actual / estimated
+                    self.ratio += self.smoothing * (observed - self.ratio)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "avg_estimated": self.estimated_total / self.calls if self.calls else 0.0,
+                "avg_actual": self.actual_total / self.calls if self.calls else 0.0,
+                "last_estimated": self.last_estimated,
+                "last_actual": self.last_actual,
+                "ratio": self.ratio,
+            }
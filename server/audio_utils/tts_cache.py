@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS Cache - Lưu WAV đã tổng hợp (16kHz mono 16-bit, đúng định dạng gửi ESP32) trên đĩa
+Khóa = hash nội dung (text, ngôn ngữ, tốc độ, định dạng), câu lặp lại (chào hỏi,
+báo lỗi, "Đã bật đèn."...) bỏ qua cả gTTS lẫn decode/resample. Chỉ mục LRU giữ
+trong RAM, dựng lại từ thư mục khi khởi động (thứ tự theo mtime), tổng dung lượng
+giới hạn bởi TTS_CACHE_MAX_MB.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import audio_utils.server_config as config
+
+OUTPUT_FORMAT = "wav16k_mono_s16"  # Đổi khi đổi định dạng gửi ESP32 để không dùng nhầm file cũ
+
+def cache_key(text, language, slow, output_format=OUTPUT_FORMAT):
+    """Hash nội dung: text (gộp khoảng trắng) + ngôn ngữ + tốc độ + định dạng"""
+    text = " ".join(text.split())
+    raw = f"{output_format}\x00{language}\x00{int(bool(slow))}\x00{text}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class TTSCache:
+    """Cache LRU các file WAV đã tổng hợp, giới hạn theo tổng dung lượng"""
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        Khởi tạo TTSCache
+
+        Args:
+            directory (str): Thư mục lưu file (mặc định TTS_CACHE_DIR)
+            max_bytes (int): Tổng dung lượng tối đa (mặc định TTS_CACHE_MAX_MB)
+        """
+        self.directory = directory or config.TTS_CACHE_DIR
+        self.max_bytes = max_bytes or int(config.TTS_CACHE_MAX_MB * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> kích thước file, cũ nhất trước
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def _load_index(self):
+        """Dựng chỉ mục từ các file có sẵn, dùng gần nhất = mtime mới nhất"""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".wav"):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+            elif name.endswith(".tmp"):
+                os.remove(path)  # Ghi dở lần chạy trước
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.total_bytes += size
+        self._evict()
+        if self._entries:
+            print(f"🗂️ TTS cache: {len(self._entries)} file ({self.total_bytes / 1024 / 1024:.1f} MB) trong {self.directory}")
+
+    def get(self, text, language, slow):
+        """
+        Returns:
+            bytes: Nội dung WAV đã cache hoặc None
+        """
+        key = cache_key(text, language, slow)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Giữ thứ tự LRU qua các lần khởi động
+        except OSError:
+            with self._lock:  # File bị xóa ngoài cache
+                self.total_bytes -= self._entries.pop(key, 0)
+            return None
+        return data
+
+    def contains(self, text, language, slow):
+        """Có trong cache không (không tính vào hits/misses)"""
+        with self._lock:
+            return cache_key(text, language, slow) in self._entries
+
+    def put(self, text, language, slow, wav_data):
+        """
+        Lưu WAV vừa tổng hợp (bytes) vào cache, ghi file tạm rồi đổi tên để không có file ghi dở
+
+        Returns:
+            bool: True nếu đã lưu
+        """
+        key = cache_key(text, language, slow)
+        path = self._path(key)
+        size = len(wav_data)
+        if size > self.max_bytes:
+            return False
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(wav_data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ TTS cache: không lưu được {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+        return True
+
+    def _evict(self):
+        """Xóa file dùng lâu nhất tới khi tổng dung lượng <= max_bytes (gọi khi giữ _lock hoặc lúc khởi tạo)"""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_tts_cache():
+    """TTSCache dùng chung (None nếu TTS_CACHE_ENABLED = False hoặc không tạo được thư mục)"""
+    global _cache
+    if not config.TTS_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = TTSCache()
+            except OSError as e:
+                print(f"⚠️ Không mở được TTS cache {config.TTS_CACHE_DIR}: {e}")
+                config.TTS_CACHE_ENABLED = False
+                return None
+        return _cache
+
+def get_tts_cache_stats():
+    """Thống kê TTS cache: entries, bytes, hits, misses, evictions, hit_rate"""
+    cache = get_tts_cache()
+    return cache.stats() if cache else {}
@@ -5,10 +5,23 @@ TTS Utils - Simple Text-to-Speech utility
 Chỉ nhận chuỗi vào và trả về file âm thanh
 """
 
+import io
 import os
+import queue
+import re
 import tempfile
+import threading
 import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from gtts import gTTS
+
+import audio_utils.server_config as config
+from .resilience import get_breaker, get_stage_metrics, run_with_timeout, stage_budget, StageTimeout
+from .response_stream import SENTENCE_END
+from .tts_cache import get_tts_cache
 try:
     import pygame
     PYGAME_AVAILABLE = True
@@ -16,48 +29,183 @@ except ImportError:
     PYGAME_AVAILABLE = False
     print("⚠️ pygame không có, sẽ sử dụng phương pháp fallback")
 
-def text_to_audio_file(text, language='vi', slow=False, output_dir=None):
+class _RedirectedTTS(gTTS):
+    """gTTS gửi request tới GTTS_BASE_URL (server giả lập mock_services.py) thay vì translate.google.com"""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+
+    def _prepare_requests(self):
+        prepared_requests = super()._prepare_requests()
+        for request in prepared_requests:
+            request.url = f"{self.base_url}/_/TranslateWebserverUi/data/batchexecute"
+        return prepared_requests
+
+def _make_tts(text, language, slow):
+    base_url = os.getenv('GTTS_BASE_URL')
+    if base_url:
+        return _RedirectedTTS(base_url, text=text, lang=language, slow=slow)
+    return gTTS(text=text, lang=language, slow=slow)
+
+def text_to_mp3_bytes(text, language='vi', slow=False, timeout=None):
     """
-    Chuyển đổi text thành file âm thanh MP3
+    Chuyển đổi text thành MP3 trong bộ nhớ (gTTS.write_to_fp, không ghi file)
     
     Args:
         text (str): Văn bản cần chuyển đổi
         language (str): Ngôn ngữ (vi: tiếng Việt, en: tiếng Anh)
         slow (bool): Tốc độ đọc (False: bình thường, True: chậm)
-        output_dir (str): Thư mục lưu file (mặc định: temp)
+        timeout (float): Thời gian chờ gTTS tối đa (mặc định STAGE_TIMEOUTS["tts"])
         
     Returns:
-        str: Đường dẫn file âm thanh đã tạo hoặc None nếu lỗi
+        bytes: Nội dung MP3 hoặc None nếu lỗi/quá hạn/circuit gTTS đang mở
     """
+    breaker = get_breaker("tts")
+    metrics = get_stage_metrics("tts")
+    start_time = time.time()
     try:
         if not text or not text.strip():
             print("⚠️ TTS: Text rỗng, bỏ qua")
             return None
         
-        # Tạo đối tượng gTTS
-        tts = gTTS(text=text.strip(), lang=language, slow=slow)
+        if not breaker.allow():
+            print("🔌 TTS: gTTS đang bị ngắt (circuit mở), bỏ qua")
+            return None
         
-        # Tạo đường dẫn file output
-        if not output_dir:
-            output_dir = tempfile.gettempdir()
+        # Tạo đối tượng gTTS
+        tts = _make_tts(text.strip(), language, slow)
         
-        timestamp = int(time.time() * 1000)
-        output_file = os.path.join(output_dir, f"tts_{timestamp}.mp3")
+        # Ghi MP3 vào buffer (gTTS gọi mạng, có thể treo lâu)
+        buffer = io.BytesIO()
+        run_with_timeout(tts.write_to_fp, timeout or config.STAGE_TIMEOUTS["tts"], buffer)
+        breaker.record_success()
+        metrics.record(time.time() - start_time)
         
-        # Lưu file âm thanh
-        tts.save(output_file)
-        print(f"✅ TTS: Đã tạo file: {output_file}")
+        return buffer.getvalue()
         
-        return output_file
+    except StageTimeout as e:
+        print(f"⏱️ TTS: gTTS quá hạn ({e})")
+        breaker.record_failure()
+        metrics.record(time.time() - start_time, "timeout")
+        return None
+    except Exception as e:
+        print(f"❌ TTS: Lỗi tạo audio: {e}")
+        breaker.record_failure()
+        metrics.record(time.time() - start_time, "error")
+        return None
+
+def text_to_audio_file(text, language='vi', slow=False, output_dir=None, timeout=None):
+    """
+    Chuyển đổi text thành file âm thanh MP3 (phát local; gửi ESP32 dùng synthesize_wav)
+    
+    Args:
+        text (str): Văn bản cần chuyển đổi
+        language (str): Ngôn ngữ (vi: tiếng Việt, en: tiếng Anh)
+        slow (bool): Tốc độ đọc (False: bình thường, True: chậm)
+        output_dir (str): Thư mục lưu file (mặc định: temp)
+        timeout (float): Thời gian chờ gTTS tối đa (mặc định STAGE_TIMEOUTS["tts"])
         
+    Returns:
+        str: Đường dẫn file âm thanh đã tạo hoặc None nếu lỗi/quá hạn/circuit gTTS đang mở
+    """
+    mp3_data = text_to_mp3_bytes(text, language, slow, timeout)
+    if not mp3_data:
+        return None
+    
+    fd, output_file = tempfile.mkstemp(prefix=f"tts_{int(time.time() * 1000)}_", suffix=".mp3",
+                                       dir=output_dir or tempfile.gettempdir())
+    with os.fdopen(fd, "wb") as f:
+        f.write(mp3_data)
+    print(f"✅ TTS: Đã tạo file: {output_file}")
+    return output_file
+
+_fallback_wav = None
+_ack_earcon_wav = None
+
+def _render_earcon(filename, freqs, tone_seconds=0.18, gap_seconds=0.05):
+    """Tạo file WAV 16kHz mono gồm các nốt sin liên tiếp (trong thư mục temp)"""
+    rate = 16000
+    tones = []
+    for freq in freqs:
+        t = np.arange(int(rate * tone_seconds)) / rate
+        envelope = np.minimum(1.0, np.minimum(t, t[::-1]) / 0.01)  # Fade 10ms tránh tiếng click
+        tones.append(0.4 * envelope * np.sin(2 * np.pi * freq * t))
+        tones.append(np.zeros(int(rate * gap_seconds)))
+    samples = (np.concatenate(tones) * 32767).astype(np.int16)
+    
+    path = os.path.join(tempfile.gettempdir(), filename)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.tobytes())
+    return path
+
+def fallback_audio_file():
+    """
+    File WAV dự phòng khi không tạo được TTS: TTS_FALLBACK_WAV nếu có
+    (vd. câu "xin lỗi, mình đang gặp sự cố" thu sẵn), không thì 1 earcon 2 nốt đi xuống
+    
+    Returns:
+        str: Đường dẫn file WAV (dùng chung, không xóa) hoặc None nếu lỗi
+    """
+    global _fallback_wav
+    if config.TTS_FALLBACK_WAV and os.path.exists(config.TTS_FALLBACK_WAV):
+        return config.TTS_FALLBACK_WAV
+    if _fallback_wav and os.path.exists(_fallback_wav):
+        return _fallback_wav
+    try:
+        _fallback_wav = _render_earcon("tts_fallback_earcon.wav", (660, 440))
+        return _fallback_wav
+    except Exception as e:
+        print(f"❌ Lỗi tạo âm báo dự phòng: {e}")
+        return None
+
+def ack_earcon_file():
+    """
+    Earcon "đã nghe" (2 nốt ngắn đi lên) phát ngay khi nhận được câu hỏi,
+    được render sẵn lúc warm-up để không tốn thời gian khi cần
+    
+    Returns:
+        str: Đường dẫn file WAV (dùng chung, không xóa) hoặc None nếu lỗi
+    """
+    global _ack_earcon_wav
+    if _ack_earcon_wav and os.path.exists(_ack_earcon_wav):
+        return _ack_earcon_wav
+    try:
+        _ack_earcon_wav = _render_earcon("ack_earcon.wav", (880, 1320), tone_seconds=0.08, gap_seconds=0.03)
+        return _ack_earcon_wav
     except Exception as e:
-        print(f"❌ TTS: Lỗi tạo file audio: {e}")
+        print(f"❌ Lỗi tạo earcon: {e}")
         return None
 
+def decode_mp3_to_pcm(mp3_data):
+    """
+    Decode MP3 (bytes) thẳng ra PCM 16kHz mono 16-bit: miniaudio chuyển
+    định dạng/kênh/tần số mẫu ngay khi decode, không cần downmix/resample thêm
+    
+    Returns:
+        bytes: PCM 16-bit little-endian
+    """
+    import miniaudio
+    decoded = miniaudio.decode(mp3_data, output_format=miniaudio.SampleFormat.SIGNED16,
+                               nchannels=1, sample_rate=config.SAMPLE_RATE)
+    return decoded.samples.tobytes()
+
+def pcm_to_wav_bytes(pcm_data, sample_rate=None):
+    """Đóng gói PCM 16-bit mono thành WAV trong bộ nhớ"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate or config.SAMPLE_RATE)
+        wf.writeframes(pcm_data)
+    return buffer.getvalue()
+
 def convert_mp3_to_wav(mp3_file, wav_file=None):
     """
-    Chuyển đổi file MP3 sang WAV để ESP32 có thể phát
-    Sử dụng miniaudio để decode MP3 và wave để ghi WAV
+    Chuyển đổi file MP3 sang WAV 16kHz mono để ESP32 có thể phát
     
     Args:
         mp3_file (str): Đường dẫn file MP3
@@ -67,10 +215,6 @@ def convert_mp3_to_wav(mp3_file, wav_file=None):
         str: Đường dẫn file WAV hoặc None nếu lỗi
     """
     try:
-        import miniaudio
-        import wave
-        import numpy as np
-        
         if not os.path.exists(mp3_file):
             print(f"❌ File MP3 không tồn tại: {mp3_file}")
             return None
@@ -80,53 +224,12 @@ def convert_mp3_to_wav(mp3_file, wav_file=None):
             base_name = os.path.splitext(mp3_file)[0]
             wav_file = f"{base_name}.wav"
         
-        # Decode MP3 thành PCM
-        decoded = miniaudio.decode_file(mp3_file)
-        print(f"📊 MP3 Info - Sample rate: {decoded.sample_rate}, Channels: {decoded.nchannels}, Sample width: {decoded.sample_width} bytes")
+        with open(mp3_file, "rb") as f:
+            wav_data = pcm_to_wav_bytes(decode_mp3_to_pcm(f.read()))
+        with open(wav_file, "wb") as f:
+            f.write(wav_data)
         
-        # Convert sang format tương thích với ESP32 nếu cần
-        samples = decoded.samples
-        sample_rate = decoded.sample_rate
-        nchannels = decoded.nchannels
-        sample_width = decoded.sample_width
-        
-        # Chuyển sang 16kHz mono 16-bit nếu cần thiết
-        if decoded.nchannels > 1 or decoded.sample_rate != 16000:
-            # Convert numpy array để xử lý
-            if decoded.sample_width == 2:  # 16-bit
-                audio_array = np.frombuffer(samples, dtype=np.int16)
-            elif decoded.sample_width == 4:  # 32-bit
-                audio_array = np.frombuffer(samples, dtype=np.int32)
-                # Convert về 16-bit
-                audio_array = (audio_array / 65536).astype(np.int16)
-            else:
-                audio_array = np.frombuffer(samples, dtype=np.int16)
-            
-            # Chuyển sang mono nếu stereo
-            if decoded.nchannels == 2:
-                audio_array = audio_array.reshape(-1, 2)
-                audio_array = np.mean(audio_array, axis=1).astype(np.int16)
-                nchannels = 1
-            
-            # Resample về 16kHz nếu cần (đơn giản bằng cách skip samples)
-            if decoded.sample_rate != 16000:
-                ratio = decoded.sample_rate / 16000
-                new_length = int(len(audio_array) / ratio)
-                indices = np.linspace(0, len(audio_array) - 1, new_length).astype(int)
-                audio_array = audio_array[indices]
-                sample_rate = 16000
-            
-            samples = audio_array.tobytes()
-            sample_width = 2  # 16-bit
-        
-        # Ghi ra file WAV
-        with wave.open(wav_file, "wb") as wf:
-            wf.setnchannels(nchannels)
-            wf.setsampwidth(sample_width)
-            wf.setframerate(sample_rate)
-            wf.writeframes(samples)
-        
-        print(f"✅ Đã chuyển đổi MP3 -> WAV: {wav_file} (Rate: {sample_rate}Hz, Channels: {nchannels}, Width: {sample_width} bytes)")
+        print(f"✅ Đã chuyển đổi MP3 -> WAV: {wav_file} (Rate: {config.SAMPLE_RATE}Hz, Channels: 1, Width: 2 bytes)")
         return wav_file
         
     except ImportError:
@@ -180,7 +283,81 @@ def play_audio_file(audio_file):
         print(f"❌ Lỗi phát audio: {e}")
         return False
 
-def text_to_speech_esp32(text, esp32_ip="192.168.1.18", esp32_port=8080, language='vi', slow=False):
+def _wav_duration(wav):
+    """Độ dài WAV (giây) - bytes hoặc đường dẫn file, 0 nếu không đọc được"""
+    try:
+        with wave.open(io.BytesIO(wav) if isinstance(wav, bytes) else wav, "rb") as wf:
+            return wf.getnframes() / float(wf.getframerate())
+    except Exception:
+        return 0.0
+
+def _read_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except (OSError, TypeError):
+        return None
+
+def _device_filename():
+    """Tên file cho ESP32 (SPIFFS giới hạn 31 ký tự kể cả dấu '/')"""
+    return f"tts_{int(time.time() * 1000)}.wav"
+
+def synthesize_wav(text, language='vi', slow=False, timeout=None):
+    """
+    Text -> WAV 16kHz mono trong bộ nhớ, sẵn sàng gửi ESP32; dùng TTS cache nếu bật
+    (trúng cache thì không gọi gTTS, không decode)
+    
+    Returns:
+        bytes: Nội dung WAV (cả header) hoặc None nếu lỗi
+    """
+    cache = get_tts_cache()
+    if cache:
+        cached = cache.get(text, language, slow)
+        if cached:
+            print(f"🗂️ TTS cache: dùng lại audio '{text[:50]}'")
+            return cached
+    
+    mp3_data = text_to_mp3_bytes(text, language, slow, timeout=timeout)
+    if not mp3_data:
+        return None
+    try:
+        wav_data = pcm_to_wav_bytes(decode_mp3_to_pcm(mp3_data))
+    except ImportError:
+        print("❌ Cần cài đặt miniaudio: pip install miniaudio")
+        return None
+    except Exception as e:
+        print(f"❌ Lỗi decode MP3: {e}")
+        return None
+    if cache:
+        cache.put(text, language, slow, wav_data)
+    return wav_data
+
+def preload_tts_cache(phrases=None, language='vi'):
+    """
+    Tổng hợp sẵn các câu hay dùng (TTS_CACHE_PRELOAD) vào TTS cache ở thread nền
+    
+    Returns:
+        threading.Thread: Thread preload hoặc None nếu cache tắt/không có gì để làm
+    """
+    cache = get_tts_cache()
+    if not cache:
+        return None
+    missing = [p for p in (phrases or config.TTS_CACHE_PRELOAD) if p and not cache.contains(p, language, False)]
+    if not missing:
+        return None
+    
+    def _run():
+        for phrase in missing:
+            if not synthesize_wav(phrase, language):
+                print(f"⚠️ TTS cache: không tổng hợp sẵn được '{phrase[:50]}'")
+        print(f"🗂️ TTS cache: đã tổng hợp sẵn {len(missing)} câu")
+    
+    thread = threading.Thread(target=_run, name="tts-preload", daemon=True)
+    thread.start()
+    return thread
+
+def text_to_speech_esp32(text, esp32_ip="192.168.1.18", esp32_port=8080, language='vi', slow=False,
+                         on_complete=None, deadline=None):
     """
     Chuyển text thành âm thanh và gửi tới ESP32 thay vì phát từ loa máy tính
     
@@ -190,45 +367,45 @@ def text_to_speech_esp32(text, esp32_ip="192.168.1.18", esp32_port=8080, languag
         esp32_port (int): Port TCP của ESP32
         language (str): Ngôn ngữ
         slow (bool): Tốc độ đọc
+        on_complete (callable): Gọi với thời gian (giây) tới khi ESP32 phát xong, sau khi đã
+            nhận xong file cuối (ESP32 lưu hết file rồi mới phát)
+        deadline (Deadline): Ngân sách thời gian của câu nói
         
     Returns:
         bool: True nếu gửi thành công
     """
+    if config.TTS_PIPELINE_ENABLED:
+        # Tách câu/mệnh đề, tổng hợp song song, gửi theo thứ tự - câu đầu phát trong lúc các câu sau đang tổng hợp
+        speaker = SentenceSpeaker(esp32_ip, esp32_port, language, slow, on_complete=on_complete, deadline=deadline)
+        speaker.speak(text)
+        speaker.finish()
+        print(f"🔊 Đang đọc TTS '{text[:50]}...' tới ESP32 theo từng câu")
+        return True
+    
     try:
         # Import ESP32AudioSender từ cùng package
-        from .esp32_audio_sender import send_audio_to_esp32_async
+        from .esp32_audio_sender import ESP32AudioSender
         
-        # Tạo file MP3
-        mp3_file = text_to_audio_file(text, language, slow)
-        if not mp3_file:
-            return False
-        
-        # Chuyển đổi MP3 -> WAV
-        wav_file = convert_mp3_to_wav(mp3_file)
-        if not wav_file:
-            return False
+        # Tạo WAV trong bộ nhớ (gTTS -> MP3 -> PCM 16kHz mono, hoặc lấy từ TTS cache)
+        wav_data = synthesize_wav(text, language, slow, timeout=stage_budget("tts", deadline))
+        if not wav_data:
+            # gTTS lỗi/quá hạn: phát âm báo dự phòng để người dùng biết đã có lỗi
+            get_stage_metrics("tts").count("fallbacks")
+            wav_data = _read_file(fallback_audio_file())
+            if not wav_data:
+                return False
         
         # Gửi WAV tới ESP32 bất đồng bộ
-        def on_success(file_path):
-            print(f"✅ Đã gửi TTS tới ESP32: {os.path.basename(file_path)}")
-            # Dọn dẹp file tạm
-            try:
-                os.remove(mp3_file)
-                os.remove(wav_file)
-            except:
-                pass
+        def on_success(filename):
+            print(f"✅ Đã gửi TTS tới ESP32: {filename}")
+            if on_complete:
+                on_complete(_wav_duration(wav_data))
         
         def on_error(error_msg):
             print(f"❌ Lỗi gửi TTS tới ESP32: {error_msg}")
-            # Dọn dẹp file tạm
-            try:
-                os.remove(mp3_file)
-                os.remove(wav_file)
-            except:
-                pass
         
         # Gửi bất đồng bộ
-        thread = send_audio_to_esp32_async(wav_file, esp32_ip, esp32_port, on_success, on_error)
+        ESP32AudioSender(esp32_ip, esp32_port).send_bytes_async(wav_data, _device_filename(), on_success, on_error)
         print(f"🔊 Đã gửi TTS '{text[:50]}...' tới ESP32")
         
         return True
@@ -237,7 +414,148 @@ def text_to_speech_esp32(text, esp32_ip="192.168.1.18", esp32_port=8080, languag
         print(f"❌ Lỗi TTS -> ESP32: {e}")
         return False
 
-def text_to_speech(text, language='vi', slow=False, auto_play=True, esp32_mode=False, esp32_ip="192.168.1.18", esp32_port=8080):
+_SENTENCE_SPLIT = re.compile(rf"(?<=[{SENTENCE_END}])\s+|\n+")
+_CLAUSE_SPLIT = re.compile(r"(?<=[,;:])\s+")
+
+def split_for_tts(text, max_chars=None, keep_first=True):
+    """
+    Tách text thành các đoạn đọc: theo câu, câu dài hơn max_chars thì theo mệnh đề
+    (dấu , ; :), vẫn dài thì theo khoảng trắng. Các đoạn ngắn liền nhau được gộp lại
+    tới max_chars (ít request gTTS và ít lần gửi file hơn), trừ đoạn đầu tiên khi
+    keep_first=True (đoạn đầu ngắn = ESP32 bắt đầu phát sớm).
+    
+    Returns:
+        list: Các đoạn theo thứ tự
+    """
+    max_chars = max_chars or config.TTS_CHUNK_MAX_CHARS
+    pieces = []
+    for sentence in _SENTENCE_SPLIT.split(text):
+        sentence = sentence.strip()
+        if len(sentence) <= max_chars:
+            if sentence:
+                pieces.append(sentence)
+            continue
+        for clause in _CLAUSE_SPLIT.split(sentence):
+            while len(clause) > max_chars:
+                cut = clause.rfind(" ", 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                pieces.append(clause[:cut].strip())
+                clause = clause[cut:].strip()
+            if clause:
+                pieces.append(clause)
+    
+    chunks = []
+    for piece in pieces:
+        if chunks and (len(chunks) > 1 or not keep_first) and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] += " " + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+_synthesis_pool = None
+_synthesis_pool_lock = threading.Lock()
+
+def _get_synthesis_pool():
+    """Pool nhỏ dùng chung để tổng hợp nhiều đoạn song song (TTS_PIPELINE_WORKERS)"""
+    global _synthesis_pool
+    with _synthesis_pool_lock:
+        if _synthesis_pool is None:
+            _synthesis_pool = ThreadPoolExecutor(max_workers=config.TTS_PIPELINE_WORKERS, thread_name_prefix="tts-synth")
+        return _synthesis_pool
+
+class SentenceSpeaker:
+    """
+    Đọc câu trả lời theo từng câu trên ESP32: mỗi câu (câu dài thì tách theo mệnh đề)
+    được tổng hợp ngay trên pool TTS_PIPELINE_WORKERS thread, các đoạn được gửi đúng
+    thứ tự khi tổng hợp xong (ESP32 phát xong file trước mới nhận file sau).
+    """
+    
+    # Gửi câu tiếp theo trước khi câu trước phát xong khoảng này (giây) - tránh timeout socket
+    SEND_LEAD_SECONDS = 2.0
+    
+    def __init__(self, esp32_ip="192.168.1.18", esp32_port=8080, language='vi', slow=False, on_complete=None,
+                 deadline=None):
+        """
+        Khởi tạo SentenceSpeaker
+        
+        Args:
+            esp32_ip (str): IP của ESP32
+            esp32_port (int): Port TCP của ESP32
+            language (str): Ngôn ngữ
+            slow (bool): Tốc độ đọc
+            on_complete (callable): Gọi với thời gian (giây) còn lại tới khi ESP32 phát xong câu cuối
+            deadline (Deadline): Ngân sách thời gian của câu nói (áp dụng cho câu đầu tiên)
+        """
+        from .esp32_audio_sender import ESP32AudioSender
+        
+        self.sender = ESP32AudioSender(esp32_ip, esp32_port)
+        self.language = language
+        self.slow = slow
+        self.on_complete = on_complete
+        self.deadline = deadline
+        self.sent_count = 0
+        self.submitted_count = 0
+        self.fallback_sent = False
+        self._queue = queue.Queue()
+        self._playback_end = 0.0
+        self._thread = threading.Thread(target=self._run, name="sentence-speaker", daemon=True)
+        self._thread.start()
+    
+    def speak(self, sentence):
+        """Bắt đầu tổng hợp 1 câu (hoặc cả đoạn text) và xếp vào hàng đợi gửi (trả về ngay)"""
+        if not sentence or not sentence.strip():
+            return
+        pool = _get_synthesis_pool()
+        for chunk in split_for_tts(sentence, keep_first=not self.submitted_count):
+            # Chỉ đoạn đầu tiên bị giới hạn theo deadline (người dùng đang chờ nghe)
+            deadline = self.deadline if not self.submitted_count else None
+            future = pool.submit(synthesize_wav, chunk, self.language, self.slow, stage_budget("tts", deadline))
+            self.submitted_count += 1
+            self._queue.put((chunk, future))
+    
+    def finish(self):
+        """Báo đã hết câu; on_complete được gọi sau khi gửi xong câu cuối"""
+        self._queue.put(None)
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._speak_one(*item)
+        
+        if self.sent_count and self.on_complete:
+            self.on_complete(max(0.0, self._playback_end - time.time()))
+    
+    def _speak_one(self, sentence, future):
+        try:
+            wav_data = future.result()
+        except Exception as e:
+            print(f"❌ Lỗi tổng hợp câu '{sentence[:50]}': {e}")
+            wav_data = None
+        if not wav_data:
+            if self.fallback_sent:
+                return
+            # Chỉ phát âm báo dự phòng 1 lần cho cả câu trả lời
+            get_stage_metrics("tts").count("fallbacks")
+            self.fallback_sent = True
+            wav_data = _read_file(fallback_audio_file())
+            if not wav_data:
+                return
+        # ESP32 chỉ đọc socket khi phát xong file trước - chờ gần hết rồi mới gửi
+        wait = self._playback_end - self.SEND_LEAD_SECONDS - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        if self.sender.send_bytes_sync(wav_data, _device_filename()):
+            self.sent_count += 1
+            self._playback_end = max(self._playback_end, time.time()) + _wav_duration(wav_data)
+            print(f"🔊 Đã gửi câu {self.sent_count} tới ESP32: '{sentence[:50]}'")
+        else:
+            print(f"❌ Lỗi gửi câu tới ESP32: '{sentence[:50]}'")
+
+def text_to_speech(text, language='vi', slow=False, auto_play=True, esp32_mode=False, esp32_ip="192.168.1.18", esp32_port=8080,
+                   on_complete=None, deadline=None):
     """
     Chuyển text thành âm thanh và tự động phát HOẶC gửi tới ESP32
     
@@ -249,13 +567,15 @@ def text_to_speech(text, language='vi', slow=False, auto_play=True, esp32_mode=F
         esp32_mode (bool): Nếu True, gửi tới ESP32 thay vì phát từ loa máy tính
         esp32_ip (str): IP của ESP32 (khi esp32_mode=True)
         esp32_port (int): Port TCP của ESP32 (khi esp32_mode=True)
+        on_complete (callable): Callback khi ESP32 nhận xong audio (chỉ ESP32 mode)
+        deadline (Deadline): Ngân sách thời gian của câu nói (chỉ ESP32 mode)
         
     Returns:
         str|bool: Đường dẫn file âm thanh (local mode) hoặc True/False (ESP32 mode)
     """
     if esp32_mode:
         # Gửi tới ESP32
-        return text_to_speech_esp32(text, esp32_ip, esp32_port, language, slow)
+        return text_to_speech_esp32(text, esp32_ip, esp32_port, language, slow, on_complete=on_complete, deadline=deadline)
     else:
         # Chế độ cũ: phát từ loa máy tính
         audio_file = text_to_audio_file(text, language, slow)
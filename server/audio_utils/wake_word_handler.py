@@ -5,33 +5,133 @@ Wake Word Handler - Xử lý wake word detection và state management
 Bao gồm tích hợp Gemini AI để trả lời câu hỏi tự động
 """
 
+import threading
+import time
+
 import audio_utils.server_config as config
 from .udp_handler import send_led_command
-from .gemini_api import ask_gemini
-from .tts_utils import text_to_speech
+from .wake_word_matcher import get_wake_word_matcher, normalize_for_matching
+from .gemini_api import ask_gemini, ask_gemini_stream, record_conversation_turn, commit_speculative_answer
+from .local_intents import answer_locally, LED_INTENTS
+from .tts_utils import text_to_speech, SentenceSpeaker, ack_earcon_file
+from .esp32_audio_sender import send_audio_to_esp32_async
+from .warmup import warm_up
+from .resilience import Deadline, StageTimeout, get_breaker, get_stage_metrics, run_with_timeout, stage_budget
 
-def check_wake_word(text):
-    """Kiểm tra text có chứa wake word không"""
-    if not text:
-        return False
+# Timer của cửa sổ hỏi tiếp (mở sau khi phát xong / đóng khi hết hạn)
+_follow_up_timer = None
+_follow_up_lock = threading.Lock()
+
+def _schedule_follow_up(delay, callback):
+    """Đặt timer follow-up mới, hủy timer cũ nếu có"""
+    global _follow_up_timer
+    with _follow_up_lock:
+        if _follow_up_timer:
+            _follow_up_timer.cancel()
+        _follow_up_timer = threading.Timer(max(0.0, delay), callback)
+        _follow_up_timer.daemon = True
+        _follow_up_timer.start()
+
+def _cancel_follow_up():
+    """Hủy timer follow-up đang chờ"""
+    global _follow_up_timer
+    with _follow_up_lock:
+        if _follow_up_timer:
+            _follow_up_timer.cancel()
+            _follow_up_timer = None
+    config.follow_up_active = False
+
+def open_follow_up_window(delay=0.0):
+    """
+    Mở cửa sổ hỏi tiếp: câu nói kế tiếp được coi là câu hỏi, không cần wake word
+    
+    Args:
+        delay (float): Thời gian chờ ESP32 phát xong câu trả lời (giây)
+    """
+    if config.FOLLOW_UP_WINDOW_SECONDS <= 0:
+        return
+    
+    def _open():
+        if config.is_listening_for_question:
+            return  # Người dùng đã gọi wake word lại trong lúc phát
+        config.is_listening_for_question = True
+        config.follow_up_active = True
+        send_led_command("LED_GREEN_ON")
+        print(f"💬 Mở cửa sổ hỏi tiếp {config.FOLLOW_UP_WINDOW_SECONDS:.0f}s (không cần wake word)")
+        _schedule_follow_up(config.FOLLOW_UP_WINDOW_SECONDS, close_follow_up_window)
     
-    # Chuyển về lowercase để so sánh không phân biệt hoa thường
-    text_lower = text.lower().strip()
-    wake_word_lower = config.WAKE_WORD.lower()
+    _schedule_follow_up(delay, _open)
+
+def close_follow_up_window():
+    """Đóng cửa sổ hỏi tiếp khi hết hạn (chờ thêm nếu người dùng đang nói dở)"""
+    if not config.follow_up_active:
+        return
+    if config.utterance_in_progress:
+        _schedule_follow_up(0.5, close_follow_up_window)
+        return
+    config.follow_up_active = False
+    config.is_listening_for_question = False
+    send_led_command("LED_GREEN_OFF")
+    print("💬 Hết cửa sổ hỏi tiếp, quay lại chế độ chờ wake word")
+
+def find_wake_word(text, device_id=None):
+    """
+    Tìm wake word trong text (không phân biệt dấu, khoảng trắng, hoa thường; cho phép sai vài ký tự)
     
-    # Kiểm tra wake word có trong text không
-    if wake_word_lower in text_lower:
-        print(f"🎯 WAKE WORD DETECTED: '{text}' chứa '{config.WAKE_WORD}'")
+    Args:
+        text (str): Transcript
+        device_id (str): IP thiết bị để lấy wake phrase riêng (mặc định: ESP32 hiện tại)
+    
+    Returns:
+        WakeWordMatch: Vị trí wake word trong text, hoặc None
+    """
+    if not text:
+        return None
+    
+    if device_id is None and config.esp32_address:
+        device_id = config.esp32_address[0]
+    return get_wake_word_matcher(device_id).find(text)
+
+def check_wake_word(text, device_id=None):
+    """Kiểm tra text có chứa wake word không"""
+    match = find_wake_word(text, device_id)
+    if match:
+        print(f"🎯 WAKE WORD DETECTED: '{text}' chứa '{match.phrase}' (sai {match.distance} ký tự)")
         return True
     
     return False
 
-def process_wake_word_detection(transcription, timestamp, seq, socketio):
-    """Xử lý khi phát hiện wake word"""
+def split_wake_word(transcription, match=None):
+    """
+    Tách phần câu hỏi nói liền sau wake word ("hello hello, mấy giờ rồi" -> "mấy giờ rồi")
+    
+    Returns:
+        str: Câu hỏi phía sau wake word, hoặc "" nếu chỉ có wake word
+    """
+    if match is None:
+        match = find_wake_word(transcription)
+    if match is None:
+        return ""
+    question = transcription[match.end:].strip(" \t\n,.!?;:-…")
+    # Bỏ wake word bị nói lặp ở đầu câu hỏi ("hello hello hello, mấy giờ" -> "mấy giờ")
+    wake_words = {normalize_for_matching(word)[0] for word in match.phrase.split()}
+    while question:
+        first, _, rest = question.partition(" ")
+        if normalize_for_matching(first)[0] not in wake_words:
+            break
+        question = rest.strip(" \t\n,.!?;:-…")
+    return question if any(c.isalnum() for c in question) else ""
+
+def process_wake_word_detection(transcription, timestamp, seq, socketio, deadline=None):
+    """Xử lý khi phát hiện wake word, câu hỏi nói liền sau wake word được trả lời luôn"""
+    _cancel_follow_up()
     # Kích hoạt chế độ nghe câu hỏi
     config.is_listening_for_question = True
     print("🎯 Wake word detected! Chuyển sang chế độ nghe câu hỏi...")
     
+    # Chuẩn bị Gemini/prompt/DNS/earcon trong lúc người dùng nói câu hỏi
+    warm_up(config.esp32_address[0] if config.esp32_address else None)
+    
     # Gửi lệnh BẬT đèn xanh liên tục
     send_led_command("LED_GREEN_ON")
     
@@ -42,17 +142,108 @@ def process_wake_word_detection(transcription, timestamp, seq, socketio):
         "timestamp": timestamp,
         "seq": seq
     })
+    
+    # Wake word + câu hỏi trong cùng 1 câu nói: không bắt người dùng nói lại
+    question = split_wake_word(transcription)
+    if question:
+        print(f"⚡ Câu hỏi nói liền sau wake word: '{question}'")
+        process_question_capture(question, timestamp, socketio, deadline=deadline)
 
-def process_question_capture(transcription, timestamp, socketio):
-    """Xử lý khi capture được câu hỏi và tạo AI response với memory tự động"""
+def _ask_llm(transcription, device_id, deadline, speaker=None):
+    """
+    Hỏi Gemini trong ngân sách thời gian của câu nói; circuit đang mở, quá hạn
+    hoặc lỗi thì trả lời bằng LLM_FALLBACK_REPLY
+    
+    Returns:
+        str: Câu trả lời (chế độ stream: các câu đã chuyển cho speaker)
+    """
+    breaker = get_breaker("llm")
+    metrics = get_stage_metrics("llm")
+    spoken = []
+    spoken_lock = threading.Lock()
+    abandoned = threading.Event()  # Đặt khi quá hạn: câu đến muộn và lượt hỏi-đáp của thread nền bị bỏ
+    
+    def on_sentence(sentence):
+        with spoken_lock:
+            if abandoned.is_set():
+                return  # Đã quá hạn và trả lời dự phòng, bỏ các câu đến muộn
+            spoken.append(sentence)
+            speaker.speak(sentence)
+    
+    if breaker.allow():
+        timeout = stage_budget("llm", deadline)
+        start_time = time.time()
+        try:
+            if speaker:
+                answer = run_with_timeout(ask_gemini_stream, timeout, transcription, device_id=device_id,
+                                          on_sentence=on_sentence, abandoned=abandoned)
+            else:
+                answer = run_with_timeout(ask_gemini, timeout, transcription, device_id=device_id, abandoned=abandoned)
+            metrics.record(time.time() - start_time, "ok" if answer else "error")
+            if answer:
+                breaker.record_success()
+                return answer
+            breaker.record_failure()
+        except StageTimeout:
+            with spoken_lock:
+                abandoned.set()
+                partial = " ".join(spoken)
+            metrics.record(time.time() - start_time, "timeout")
+            if partial:
+                # Gemini vẫn đang trả lời, chỉ chậm: giữ phần đã đọc, tính là thành công
+                # (cũng để kết thúc request thử khi circuit half-open)
+                print(f"⏱️ Gemini quá {timeout:.1f}s, dừng ở {len(spoken)} câu đã đọc")
+                record_conversation_turn(transcription, partial, device_id=device_id)  # Lịch sử chỉ giữ phần người dùng đã nghe
+                breaker.record_success()
+                return partial
+            print(f"⏱️ Gemini quá {timeout:.1f}s, trả lời dự phòng")
+            breaker.record_failure()
+    
+    metrics.count("fallbacks")
+    if speaker:
+        speaker.speak(config.LLM_FALLBACK_REPLY)
+    return config.LLM_FALLBACK_REPLY
+
+def process_question_capture(transcription, timestamp, socketio, deadline=None, speculation=None):
+    """
+    Xử lý khi capture được câu hỏi và tạo AI response với memory tự động
+    (speculation: câu trả lời Gemini đã đoán trước từ audio tới lúc bắt đầu im lặng)
+    """
     print(f"❓ Câu hỏi đã nhận dạng: {transcription}")
+    deadline = deadline or Deadline()
+    _cancel_follow_up()
     
     # Gửi lệnh tắt đèn xanh
     send_led_command("LED_GREEN_OFF")
     
+    # Earcon "đã nghe" (render sẵn lúc warm-up) phát trong lúc chờ câu trả lời
+    earcon = ack_earcon_file() if config.ACK_EARCON_ENABLED else None
+    if earcon:
+        send_audio_to_esp32_async(earcon, "192.168.1.18", 8080)
+    
     # Tạo AI response bằng Gemini (đã tích hợp memory tự động)
     print("🤖 Đang tạo AI response và phân tích memory...")
-    ai_response = ask_gemini(transcription)
+    device_id = config.esp32_address[0] if config.esp32_address else None
+    on_spoken = lambda duration: open_follow_up_window(delay=duration)  # Phát xong thì mở cửa sổ hỏi tiếp
+    speaker = None
+    local = answer_locally(transcription, device_id=device_id)
+    if local:
+        # Câu hỏi đơn giản (giờ, ngày, đèn...) được trả lời ngay, không gọi Gemini
+        intent, ai_response = local
+        record_conversation_turn(transcription, ai_response, device_id=device_id)
+        if intent in LED_INTENTS:
+            on_spoken = None  # Giữ trạng thái đèn người dùng vừa yêu cầu
+    elif speculation and speculation.resolve(transcription, stage_budget("llm", deadline)):
+        # Transcript cuối khớp câu đoán trước: dùng câu trả lời đã có, đọc như chế độ không stream
+        ai_response = commit_speculative_answer(speculation.result, transcription, device_id=device_id)
+    elif config.GEMINI_STREAMING:
+        # Mỗi câu của câu trả lời được đọc ngay khi Gemini sinh xong
+        speaker = SentenceSpeaker(esp32_ip="192.168.1.18", esp32_port=8080, language='vi', on_complete=on_spoken,
+                                  deadline=deadline)
+        ai_response = _ask_llm(transcription, device_id, deadline, speaker)
+        speaker.finish()
+    else:
+        ai_response = _ask_llm(transcription, device_id, deadline)
     
     # Chuẩn bị log entry với cả câu hỏi và câu trả lời
     if ai_response:
@@ -69,12 +260,13 @@ def process_question_capture(transcription, timestamp, socketio):
     if config.question_logger:
         config.question_logger.log_transcript_simple(log_entry)
     
-    # Đọc to câu trả lời AI nếu có
-    if ai_response:
+    # Đọc to câu trả lời AI nếu có (chế độ stream đã đọc trong lúc sinh câu trả lời)
+    if ai_response and speaker is None:
         try:
             print(f"🔊 Đang gửi câu trả lời AI tới ESP32...")
             # Sử dụng ESP32 mode thay vì phát từ loa máy tính
-            success = text_to_speech(ai_response, language='vi', esp32_mode=True, esp32_ip="192.168.1.18", esp32_port=8080)
+            success = text_to_speech(ai_response, language='vi', esp32_mode=True, esp32_ip="192.168.1.18", esp32_port=8080,
+                                     on_complete=on_spoken, deadline=deadline)
             if success:
                 print(f"✅ Đã gửi câu trả lời AI tới ESP32")
             else:
@@ -96,6 +288,7 @@ def process_question_capture(transcription, timestamp, socketio):
 
 def reset_question_mode():
     """Reset về chế độ mặc định nếu có lỗi"""
+    _cancel_follow_up()
     if config.is_listening_for_question:
         print("🔇 Reset về chế độ mặc định do lỗi")
         send_led_command("LED_GREEN_OFF")
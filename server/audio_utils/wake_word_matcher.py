@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wake Word Matcher - Tìm wake word trong transcript, không phân biệt dấu/khoảng trắng
+Nhiều wake phrase được biên dịch sẵn thành 1 automaton Aho-Corasick; cho phép
+sai tối đa k ký tự (edit distance) bằng cách chia mỗi phrase thành k+1 mảnh:
+mọi kết quả sai <= k ký tự đều chứa ít nhất 1 mảnh khớp chính xác, vùng quanh
+mảnh đó mới được kiểm tra bằng DP.
+"""
+
+import threading
+import unicodedata
+from collections import deque, namedtuple
+
+import audio_utils.server_config as config
+
+WakeWordMatch = namedtuple("WakeWordMatch", ["phrase", "start", "end", "distance"])
+WakeWordMatch.__doc__ = "Kết quả khớp: start/end là vị trí trong text gốc (end không bao gồm)"
+
+def normalize_for_matching(text):
+    """
+    Chuẩn hóa text để so khớp: bỏ dấu tiếng Việt, lowercase, bỏ khoảng trắng/dấu câu,
+    gộp ký tự lặp liên tiếp ("hê lô" -> "helo", "hello" -> "helo")
+
+    Returns:
+        tuple: (chuỗi đã chuẩn hóa, list (vị trí đầu, vị trí cuối) trong text gốc của mỗi ký tự)
+    """
+    chars = []
+    positions = []
+    for index, char in enumerate(text or ""):
+        if char in "đĐ":
+            base = "d"
+        else:
+            decomposed = unicodedata.normalize("NFD", char)
+            base = "".join(c for c in decomposed if unicodedata.category(c) != "Mn").lower()
+        for c in base:
+            if not c.isalnum():
+                continue
+            if chars and chars[-1] == c:
+                positions[-1] = (positions[-1][0], index)  # Gộp ký tự lặp
+                continue
+            chars.append(c)
+            positions.append((index, index))
+    return "".join(chars), positions
+
+def _best_approximate_match(pattern, window, max_edits):
+    """
+    DP Sellers: pattern khớp ở đâu đó trong window với ít edit nhất
+
+    Returns:
+        tuple: (distance, start, end) trong window, hoặc None nếu > max_edits
+    """
+    n = len(window)
+    prev = [0] * (n + 1)
+    prev_start = list(range(n + 1))
+    for i in range(1, len(pattern) + 1):
+        cur = [i] + [0] * n
+        cur_start = [0] * (n + 1)
+        for j in range(1, n + 1):
+            substitution = prev[j - 1] + (pattern[i - 1] != window[j - 1])
+            deletion = prev[j] + 1
+            insertion = cur[j - 1] + 1
+            if substitution <= deletion and substitution <= insertion:
+                cur[j], cur_start[j] = substitution, prev_start[j - 1]
+            elif deletion <= insertion:
+                cur[j], cur_start[j] = deletion, prev_start[j]
+            else:
+                cur[j], cur_start[j] = insertion, cur_start[j - 1]
+        prev, prev_start = cur, cur_start
+
+    best_end = min(range(1, n + 1), key=lambda j: (prev[j], j), default=None)
+    if best_end is None or prev[best_end] > max_edits:
+        return None
+    return prev[best_end], prev_start[best_end], best_end
+
+def _starts_word(text, index):
+    """Vị trí index trong text gốc có là đầu từ không (bỏ qua dấu tổ hợp khi text ở dạng NFD)"""
+    index -= 1
+    while index >= 0 and unicodedata.category(text[index]) == "Mn":
+        index -= 1
+    return index < 0 or not text[index].isalnum()
+
+class WakeWordMatcher:
+    """Matcher nhiều wake phrase, biên dịch sẵn 1 lần và dùng lại cho mọi transcript"""
+
+    def __init__(self, phrases, max_edits=None):
+        """
+        Khởi tạo WakeWordMatcher
+
+        Args:
+            phrases (list): Danh sách wake phrase
+            max_edits (int): Số ký tự sai tối đa (mặc định WAKE_WORD_MAX_EDITS,
+                giảm theo độ dài phrase - WAKE_WORD_CHARS_PER_EDIT ký tự mỗi edit;
+                phrase ngắn hơn WAKE_WORD_MIN_FUZZY_CHARS phải khớp chính xác,
+                phrase từ WAKE_WORD_MIN_FUZZY_CHARS ký tự được sai ít nhất 1)
+        """
+        self.max_edits = config.WAKE_WORD_MAX_EDITS if max_edits is None else max_edits
+        self.phrases = []
+        self.patterns = []
+        self.allowed_edits = []
+        for phrase in phrases:
+            pattern, _ = normalize_for_matching(phrase)
+            if not pattern or pattern in self.patterns:
+                continue
+            self.phrases.append(phrase)
+            self.patterns.append(pattern)
+            if len(pattern) < config.WAKE_WORD_MIN_FUZZY_CHARS:
+                self.allowed_edits.append(0)
+            else:
+                edits = max(1, len(pattern) // config.WAKE_WORD_CHARS_PER_EDIT)
+                self.allowed_edits.append(min(self.max_edits, edits))
+        self._build_automaton()
+
+    def _build_automaton(self):
+        """Dựng automaton Aho-Corasick từ các mảnh của mọi pattern"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]  # node -> [(pattern_id, offset của mảnh trong pattern, độ dài mảnh)]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            n_pieces = self.allowed_edits[pattern_id] + 1
+            piece_len = len(pattern) / n_pieces
+            for p in range(n_pieces):
+                start, end = int(round(p * piece_len)), int(round((p + 1) * piece_len))
+                node = 0
+                for c in pattern[start:end]:
+                    if c not in self._goto[node]:
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._output.append([])
+                        self._goto[node][c] = len(self._goto) - 1
+                    node = self._goto[node][c]
+                self._output[node].append((pattern_id, start, end - start))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(c, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text):
+        """
+        Tìm wake phrase khớp sớm nhất trong text
+
+        Returns:
+            WakeWordMatch: Kết quả khớp (vị trí theo text gốc), hoặc None
+        """
+        normalized, positions = normalize_for_matching(text)
+        if not normalized:
+            return None
+
+        best = None
+        checked = set()
+        node = 0
+        for index, c in enumerate(normalized):
+            while node and c not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(c, 0)
+            for pattern_id, offset, length in self._output[node]:
+                k = self.allowed_edits[pattern_id]
+                pattern = self.patterns[pattern_id]
+                window_start = max(0, index - length + 1 - offset - k)
+                if (pattern_id, window_start) in checked:
+                    continue
+                checked.add((pattern_id, window_start))
+                window_end = min(len(normalized), window_start + len(pattern) + 2 * k)
+                result = _best_approximate_match(pattern, normalized[window_start:window_end], k)
+                if result is None:
+                    continue
+                distance, start, end = result
+                # Wake word phải bắt đầu ở đầu từ: "thể lô hê lô" không được khớp "hello hello" từ giữa "thể"
+                if not _starts_word(text, positions[window_start + start][0]):
+                    continue
+                # Cùng số lỗi thì lấy kết quả dài hơn ("hello hellu" khớp cả "hellu", không dừng ở "hell")
+                candidate = (window_start + start, distance, -(window_start + end), pattern_id)
+                if best is None or candidate < best:
+                    best = candidate
+
+        if best is None:
+            return None
+        start, distance, end, pattern_id = best
+        # Kéo end tới hết từ trong text gốc để phần sau wake word không bắt đầu giữa từ
+        end = positions[-end - 1][1] + 1
+        while end < len(text) and text[end].isalnum():
+            end += 1
+        return WakeWordMatch(
+            phrase=self.phrases[pattern_id],
+            start=positions[start][0],
+            end=end,
+            distance=distance,
+        )
+
+# Matcher đã biên dịch theo thiết bị
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+def wake_phrases_for_device(device_id=None):
+    """Danh sách wake phrase của thiết bị (chung + riêng theo DEVICE_WAKE_WORDS)"""
+    phrases = [config.WAKE_WORD] + list(config.WAKE_WORDS)
+    if device_id is not None:
+        phrases += list(config.DEVICE_WAKE_WORDS.get(device_id, []))
+    return phrases
+
+def get_wake_word_matcher(device_id=None):
+    """Lấy matcher đã biên dịch cho thiết bị (biên dịch lại nếu cấu hình wake word đổi)"""
+    phrases = tuple(wake_phrases_for_device(device_id))
+    with _matchers_lock:
+        cached = _matchers.get(device_id)
+        if cached is None or cached[0] != phrases:
+            cached = (phrases, WakeWordMatcher(phrases))
+            _matchers[device_id] = cached
+        return cached[1]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Warm-up - Chuẩn bị sẵn khi vừa phát hiện wake word
+Trong lúc người dùng đang nói câu hỏi: tạo Gemini client + mở kết nối, nạp
+memory/lịch sử và dựng phần tĩnh của prompt, phân giải DNS của Google Speech/gTTS,
+render sẵn earcon. Chạy ở thread nền, không chặn luồng ASR.
+"""
+
+import socket
+import threading
+import time
+
+import audio_utils.server_config as config
+
+_lock = threading.Lock()
+_running = False
+_last_warm_up = 0.0
+last_timings = {}  # Bước -> thời gian (ms) của lần warm-up gần nhất, hoặc "error: ..."
+
+def _resolve_hosts():
+    """Phân giải DNS trước (Google Speech, gTTS mở kết nối mới cho mỗi request nên chỉ làm ấm được DNS)"""
+    for host in config.WARMUP_HOSTS:
+        socket.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP)
+
+def _warm_gemini(device_id):
+    from .gemini_api import warm_up_gemini
+    warm_up_gemini(device_id)
+
+def _warm_earcons():
+    from .tts_utils import ack_earcon_file, fallback_audio_file
+    ack_earcon_file()
+    fallback_audio_file()
+
+def _run(device_id):
+    global _running
+    steps = [
+        ("gemini", lambda: _warm_gemini(device_id)),
+        ("dns", _resolve_hosts),
+        ("earcon", _warm_earcons),
+    ]
+    timings = {}
+    try:
+        for name, step in steps:
+            start_time = time.time()
+            try:
+                step()
+                timings[name] = round((time.time() - start_time) * 1000)
+            except Exception as e:
+                timings[name] = f"error: {e}"
+        last_timings.clear()
+        last_timings.update(timings)
+        print(f"🔥 Warm-up xong: {timings}")
+    finally:
+        with _lock:
+            _running = False
+
+def warm_up(device_id=None):
+    """
+    Bắt đầu warm-up ở thread nền (bỏ qua nếu đang chạy hoặc vừa warm-up
+    trong WARMUP_MIN_INTERVAL_SECONDS)
+
+    Returns:
+        bool: True nếu đã bắt đầu warm-up
+    """
+    global _running, _last_warm_up
+    if not config.WARMUP_ENABLED:
+        return False
+    with _lock:
+        now = time.time()
+        if _running or now - _last_warm_up < config.WARMUP_MIN_INTERVAL_SECONDS:
+            return False
+        _running = True
+        _last_warm_up = now
+    threading.Thread(target=_run, args=(device_id,), name="warm-up", daemon=True).start()
+    return True
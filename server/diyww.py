@@ -21,13 +21,19 @@ from audio_utils import (
     # Configuration
     FLASK_PORT, transcript_logger, question_logger,
     # ESP32 Audio Sender
-    ESP32AudioSender, send_audio_to_esp32, send_audio_to_esp32_async
+    ESP32AudioSender, send_audio_to_esp32, send_audio_to_esp32_async,
+    # Memory store
+    drain_memory_consolidator, flush_memory_stores,
+    # TTS cache
+    preload_tts_cache
 )
 
 def signal_handler(signum, frame):
     """Signal handler để graceful shutdown"""
     print(f"\n[SHUTDOWN] Nhận signal {signum}, đang dừng server...")
+    drain_memory_consolidator()  # Tổng hợp memory từ các lượt cuối (cần scheduler, trước shutdown_event)
     shutdown_event.set()
+    flush_memory_stores()  # Ghi memory/lịch sử Gemini còn chờ
     time.sleep(2)  # Đợi threads dừng
     print("[SHUTDOWN] Server đã dừng an toàn")
     sys.exit(0)
@@ -105,6 +111,9 @@ def main():
     # Tạo templates directory
     create_templates()
     
+    # Tổng hợp sẵn các câu hay dùng vào TTS cache (nền)
+    preload_tts_cache()
+    
     # Khởi động processing threads
     udp_thread = threading.Thread(target=udp_listener, daemon=True)
     asr_thread = threading.Thread(target=lambda: asr_worker(socketio), daemon=True)  # Pass socketio to asr_worker
@@ -130,12 +139,16 @@ def main():
         socketio.run(app, host="0.0.0.0", port=FLASK_PORT, debug=False)
     except KeyboardInterrupt:
         print("\n[SHUTDOWN] Nhận Ctrl+C, đang dừng server...")
+        drain_memory_consolidator()
         shutdown_event.set()
+        flush_memory_stores()
         time.sleep(2)
         print("[SHUTDOWN] Server đã dừng an toàn")
     except Exception as e:
         print(f"[ERROR] Lỗi Flask server: {e}")
+        drain_memory_consolidator()
         shutdown_event.set()
+        flush_memory_stores()
         time.sleep(2)
         print("[SHUTDOWN] Server đã dừng an toàn")
 
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gemini Parse Benchmark - Đo thời gian parse và tỉ lệ thất bại của câu trả lời Gemini
+So sánh câu trả lời structured output (JSON đúng schema) với câu trả lời tự do
+(bọc ```json, có chữ thừa, bị cắt...) đi qua chuỗi regex dự phòng.
+
+Định dạng corpus: file JSONL, mỗi dòng {"mode": "structured"|"legacy", "raw": "..."}
+(mode không bắt buộc, mặc định "corpus").
+
+Sử dụng:
+    python gemini_parse_benchmark.py                       # corpus giả lập
+    python gemini_parse_benchmark.py --corpus responses.jsonl
+"""
+
+import argparse
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+import audio_utils.gemini_api as gemini_api
+
+ANSWERS = [
+    "Chào Đăng! Konan đã ghi nhớ tên bạn rồi.",
+    "Hôm nay trời nắng nhẹ, bạn nhớ mang nước nhé!",
+    "Bạn tên là Đăng, đúng không? Konan có thể giúp gì thêm?",
+    "Konan xin đọc tặng bạn một câu thơ: \"Sen tàn cúc lại nở hoa\".",
+    "Để ngủ ngon, bạn hãy tránh cà phê buổi tối.\nChúc bạn ngủ ngon!",
+]
+
+MEMORY = {
+    "user_name": "Đăng",
+    "preferences": "thích nghe thơ {lục bát}",
+    "personal_info": "",
+    "interests": "thơ ca, công nghệ",
+    "additional_info": "",
+}
+
+def _legacy_variant(rng, payload):
+    """1 câu trả lời tự do theo các kiểu lỗi đã gặp khi không có schema"""
+    text = json.dumps(payload, ensure_ascii=False, indent=2)
+    kind = rng.choice(["plain", "fenced", "preamble", "truncated", "text_only"])
+    if kind == "plain":
+        return text
+    if kind == "fenced":
+        return f"```json\n{text}\n```"
+    if kind == "preamble":
+        return f"Đây là câu trả lời của tôi:\n{text}\nHy vọng hữu ích!"
+    if kind == "truncated":
+        return text[:int(len(text) * rng.uniform(0.5, 0.9))]
+    return payload["main_response"]
+
+def create_synthetic_corpus(n=500, seed=0):
+    """Corpus giả lập: n câu structured + n câu tự do"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        payload = {"main_response": rng.choice(ANSWERS), "new_memory": dict(MEMORY)}
+        corpus.append(("structured", json.dumps(payload, ensure_ascii=False)))
+        corpus.append(("legacy", _legacy_variant(rng, payload)))
+    return corpus
+
+def load_corpus(path):
+    """Đọc corpus JSONL"""
+    corpus = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                corpus.append((item.get("mode", "corpus"), item["raw"]))
+    return corpus
+
+def run_benchmark(corpus, repeat=20):
+    """Parse từng câu trả lời, thống kê nhánh parse và thời gian theo mode"""
+    stats = defaultdict(lambda: {"count": 0, "time": 0.0, "paths": defaultdict(int)})
+    for mode, raw in corpus:
+        before = gemini_api.get_parse_stats()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            gemini_api._parse_ai_response(raw)
+        elapsed = (time.perf_counter() - start) / repeat
+        after = gemini_api.get_parse_stats()
+        path = max(after, key=lambda k: after[k] - before[k])
+        stats[mode]["count"] += 1
+        stats[mode]["time"] += elapsed
+        stats[mode]["paths"][path] += 1
+
+    paths = list(gemini_api.get_parse_stats())
+    print("=" * 90)
+    print(f"{'mode':<12} {'n':>5} {'µs/parse':>9} {'fail %':>7}  " + " ".join(f"{p:>12}" for p in paths))
+    for mode, s in stats.items():
+        fail_rate = s["paths"]["raw"] / max(1, s["count"])
+        print(f"{mode:<12} {s['count']:>5} {s['time'] / max(1, s['count']) * 1e6:>9.1f} {fail_rate:>7.1%}  "
+              + " ".join(f"{s['paths'][p]:>12}" for p in paths))
+    print("=" * 90)
+    print("fail % = không tìm được main_response, phải đọc nguyên văn (cắt ngắn) câu trả lời")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse câu trả lời Gemini")
+    parser.add_argument("--corpus", help="File JSONL câu trả lời thô (mặc định: corpus giả lập)")
+    parser.add_argument("--size", type=int, default=500, help="Số câu mỗi mode của corpus giả lập")
+    parser.add_argument("--repeat", type=int, default=20, help="Số lần parse mỗi câu để đo thời gian")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)  # Log của parser làm sai lệch thời gian đo
+    corpus = load_corpus(args.corpus) if args.corpus else create_synthetic_corpus(args.size)
+    print(f"📂 {len(corpus)} câu trả lời")
+    run_benchmark(corpus, args.repeat)
+
+if __name__ == "__main__":
+    main()
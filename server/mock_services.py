@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mock Services - Server giả lập Gemini, Google Speech và gTTS để test tải offline
+Trả lời theo kịch bản, độ trễ lấy từ phân phối cấu hình được, tỉ lệ lỗi 500
+và 429 (RESOURCE_EXHAUSTED) riêng cho từng dịch vụ. Cùng seed + cùng kịch bản
+cho cùng chuỗi độ trễ/lỗi, để so sánh các thay đổi hiệu năng lặp lại được.
+
+Endpoint (đúng định dạng thư viện client đang dùng):
+    POST /v1beta/models/<model>:generateContent          google-genai
+    POST /v1beta/models/<model>:streamGenerateContent    google-genai (SSE)
+    GET  /v1beta/models/<model>                          warm-up (client.models.get)
+    POST /v1beta/cachedContents                          GEMINI_CONTEXT_CACHE=true
+    POST /speech-api/v2/recognize                        SpeechRecognition (recognize_google)
+    POST /_/TranslateWebserverUi/data/batchexecute       gTTS (trả MP3 im lặng dài theo số ký tự)
+    GET  /stats                                          số request/lỗi/429 từng dịch vụ (?reset=1 để xóa)
+
+Cấu hình trong file .env (server giả lập):
+    MOCK_HOST=127.0.0.1
+    MOCK_PORT=8787
+    MOCK_SCRIPT_FILE=mock_script.json
+    MOCK_SEED=1
+    MOCK_GEMINI_LATENCY=lognormal:0.8:0.3   # fixed:S | uniform:A:B | normal:MEAN:STD | lognormal:MEDIAN:SIGMA (giây)
+    MOCK_GEMINI_CHUNK_DELAY=fixed:0.05      # Giữa các chunk khi stream
+    MOCK_GEMINI_CHUNK_CHARS=24              # Số ký tự mỗi chunk khi stream
+    MOCK_GEMINI_ERROR_RATE=0.0              # Tỉ lệ trả 500
+    MOCK_GEMINI_429_RATE=0.0                # Tỉ lệ trả 429
+    MOCK_SPEECH_LATENCY=uniform:0.6:1.2     (và MOCK_SPEECH_ERROR_RATE, MOCK_SPEECH_429_RATE)
+    MOCK_TTS_LATENCY=uniform:0.3:0.8        (và MOCK_TTS_ERROR_RATE, MOCK_TTS_429_RATE)
+    MOCK_TTS_SECONDS_PER_CHAR=0.07          # Độ dài audio trả về
+
+Trỏ server chính tới server giả lập (cũng trong .env):
+    GEMINI_BASE_URL=http://127.0.0.1:8787
+    GOOGLE_SPEECH_URL=http://127.0.0.1:8787/speech-api/v2/recognize
+    GTTS_BASE_URL=http://127.0.0.1:8787
+
+Kịch bản (JSON, đều không bắt buộc):
+    {
+      "gemini": [
+        {"match": "tên (tôi|mình) là", "answer": "Chào bạn, Konan nhớ rồi!", "memory": {"name": "An"}},
+        {"match": "thời tiết", "answer": "Trời nắng nhẹ.", "latency": 3.0},
+        {"match": "lỗi", "status": 429}
+      ],
+      "speech": ["bật đèn", "thủ đô của Pháp là gì", ""],
+      "summary": "Người dùng hỏi về thời tiết và thủ đô các nước."
+    }
+    "match" là regex (không phân biệt hoa thường) so với câu hỏi mới, "{question}"
+    trong answer được thay bằng câu hỏi; "speech" được trả lần lượt xoay vòng
+    ("" = không nghe ra chữ nào).
+
+Sử dụng:
+    python mock_services.py
+    python mock_services.py --port 8787 --script mock_script.json --seed 1
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+SERVICES = ("gemini", "speech", "tts")
+DEFAULT_LATENCY = {"gemini": "lognormal:0.8:0.3", "speech": "uniform:0.6:1.2", "tts": "uniform:0.3:0.8"}
+
+# 1 frame MPEG-1 Layer III 32kbps 32kHz mono, side info toàn 0 = im lặng (1152 mẫu = 36ms),
+# nối bao nhiêu frame cũng vẫn là MP3 hợp lệ (gTTS ghi nối các phần liền nhau)
+SILENT_MP3_FRAME = bytes([0xFF, 0xFB, 0x18, 0xC0]) + bytes(140)
+SILENT_MP3_FRAME_SECONDS = 1152 / 32000
+
+def parse_latency(spec):
+    """
+    Đọc phân phối độ trễ "fixed:S", "uniform:A:B", "normal:MEAN:STD", "lognormal:MEDIAN:SIGMA"
+
+    Returns:
+        callable: sample(rng) -> số giây (>= 0)
+    """
+    kind, _, args = spec.strip().partition(":")
+    values = [float(v) for v in args.split(":") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Phân phối độ trễ không hợp lệ: '{spec}'")
+
+class ServiceProfile:
+    """Độ trễ và tỉ lệ lỗi của 1 dịch vụ giả lập (đọc từ MOCK_<SERVICE>_*)"""
+
+    def __init__(self, name):
+        prefix = f"MOCK_{name.upper()}_"
+        self.name = name
+        self.latency = parse_latency(os.getenv(prefix + "LATENCY", DEFAULT_LATENCY[name]))
+        self.error_rate = float(os.getenv(prefix + "ERROR_RATE", "0"))
+        self.rate_limit_rate = float(os.getenv(prefix + "429_RATE", "0"))
+
+class MockState:
+    """Kịch bản, nguồn ngẫu nhiên (có seed) và bộ đếm dùng chung giữa các request"""
+
+    def __init__(self, script, seed=None):
+        self.script = script
+        self.profiles = {name: ServiceProfile(name) for name in SERVICES}
+        self.chunk_delay = parse_latency(os.getenv("MOCK_GEMINI_CHUNK_DELAY", "fixed:0.05"))
+        self.chunk_chars = int(os.getenv("MOCK_GEMINI_CHUNK_CHARS", "24"))
+        self.tts_seconds_per_char = float(os.getenv("MOCK_TTS_SECONDS_PER_CHAR", "0.07"))
+        self.rules = [(re.compile(entry.get("match", ""), re.IGNORECASE), entry) for entry in script.get("gemini", [])]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._speech_index = 0
+        self._cache_index = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {name: {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "latency_total": 0.0}
+                          for name in SERVICES}
+
+    def draw(self, service, entry=None):
+        """
+        Bốc thăm 1 request: độ trễ và lỗi (kịch bản "latency"/"status" được ưu tiên)
+
+        Returns:
+            tuple: (độ trễ giây, HTTP status)
+        """
+        profile = self.profiles[service]
+        with self._lock:
+            latency = profile.latency(self._rng)
+            roll = self._rng.random()
+            status = 200
+            if roll < profile.rate_limit_rate:
+                status = 429
+            elif roll < profile.rate_limit_rate + profile.error_rate:
+                status = 500
+            if entry:
+                latency = entry.get("latency", latency)
+                status = entry.get("status", status)
+            stats = self.stats[service]
+            stats["requests"] += 1
+            stats["latency_total"] += latency
+            stats["ok" if status == 200 else "rate_limited" if status == 429 else "errors"] += 1
+        return latency, status
+
+    def sample_chunk_delay(self):
+        with self._lock:
+            return self.chunk_delay(self._rng)
+
+    def match(self, question):
+        for pattern, entry in self.rules:
+            if pattern.search(question):
+                return entry
+        return {}
+
+    def next_transcript(self):
+        transcripts = self.script.get("speech") or ["xin chào"]
+        with self._lock:
+            transcript = transcripts[self._speech_index % len(transcripts)]
+            self._speech_index += 1
+        return transcript
+
+    def next_cache_name(self):
+        with self._lock:
+            self._cache_index += 1
+            return f"cachedContents/mock-{self._cache_index}"
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(stats, avg_latency=stats["latency_total"] / stats["requests"] if stats["requests"] else 0.0)
+                    for name, stats in self.stats.items()}
+
+def _request_text(body):
+    """Toàn bộ text trong contents của request Gemini"""
+    return "\n".join(part.get("text", "") for content in body.get("contents", [])
+                     for part in content.get("parts", []))
+
+def _estimate_tokens(text):
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+def gemini_reply(state, body):
+    """
+    Sinh text trả lời đúng dạng gemini_api chờ: JSON main_response/new_memory cho câu hỏi,
+    JSON memory cho tổng hợp memory, text thường cho tóm tắt hội thoại
+
+    Returns:
+        tuple: (text, entry kịch bản đã khớp)
+    """
+    text = _request_text(body)
+    generation = body.get("generationConfig", {})
+    schema = generation.get("responseSchema") or generation.get("responseJsonSchema") or {}
+    properties = schema.get("properties", {})
+    if "CÂU HỎI MỚI:" in text:
+        question = text.rsplit("CÂU HỎI MỚI:", 1)[1].strip()
+        entry = state.match(question)
+        answer = entry.get("answer", "Konan giả lập đã nghe câu hỏi: {question}").replace("{question}", question)
+        reply = {"main_response": answer}
+        if "new_memory" in properties or not properties:
+            reply["new_memory"] = entry.get("memory", {})
+        return json.dumps(reply, ensure_ascii=False), entry
+    if generation.get("responseMimeType") == "application/json":
+        # Tổng hợp memory: gộp memory của các câu kịch bản xuất hiện trong các lượt
+        memory = {}
+        for pattern, entry in state.rules:
+            if "memory" in entry and pattern.search(text):
+                memory.update(entry["memory"])
+        return json.dumps(memory, ensure_ascii=False), {}
+    return state.script.get("summary", f"Người dùng đã trò chuyện {text.count('U: ')} lượt với Konan."), {}
+
+def _gemini_chunk(text, finish=False, prompt_tokens=0, reply_tokens=0):
+    chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+    if finish:
+        chunk["candidates"][0]["finishReason"] = "STOP"
+        chunk["usageMetadata"] = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": reply_tokens,
+                                  "totalTokenCount": prompt_tokens + reply_tokens}
+    return chunk
+
+def _gemini_error(status):
+    if status == 429:
+        return {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                          "message": "Resource has been exhausted (e.g. check quota). [mock]"}}
+    return {"error": {"code": status, "status": "INTERNAL", "message": "An internal error has occurred. [mock]"}}
+
+def _speech_response(transcript):
+    """Định dạng trả về của Google Speech API v2 (mỗi dòng 1 JSON)"""
+    lines = [{"result": []}]
+    if transcript:
+        lines.append({"result": [{"alternative": [{"transcript": transcript, "confidence": 0.92}], "final": True}],
+                      "result_index": 0})
+    return "\n".join(json.dumps(line, ensure_ascii=False) for line in lines) + "\n"
+
+def _tts_text(body):
+    """Lấy text gTTS gửi lên từ f.req=[[["jQ1olc","[text,lang,speed,null]",null,"generic"]]]"""
+    rpc = json.loads(urllib.parse.parse_qs(body)["f.req"][0])
+    return json.loads(rpc[0][0][1])[0]
+
+def _tts_response(state, text):
+    """Định dạng batchexecute của gTTS: audio MP3 base64 nằm trong dòng jQ1olc"""
+    frames = max(1, math.ceil(len(text) * state.tts_seconds_per_char / SILENT_MP3_FRAME_SECONDS))
+    audio = base64.b64encode(SILENT_MP3_FRAME * frames).decode("ascii")
+    line = json.dumps([["wrb.fr", "jQ1olc", json.dumps([audio]), None, None, None, "generic"]], separators=(",", ":"))
+    return f")]}}'\n\n{len(line)}\n{line}\n"
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockServices/1.0"
+    state = None
+    verbose = False
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            print(f"🧪 {self.address_string()} {format % args}")
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, payload, content_type="application/json; charset=UTF-8"):
+        data = payload if isinstance(payload, bytes) else (
+            payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/stats":
+            stats = self.state.snapshot()
+            if "reset=1" in query:
+                self.state.reset_stats()
+            return self._send(200, stats)
+        match = re.fullmatch(r"/v1beta/models/([^/:]+)", path)
+        if match:
+            return self._send(200, {"name": f"models/{match.group(1)}", "displayName": f"{match.group(1)} (mock)",
+                                    "inputTokenLimit": 1048576, "outputTokenLimit": 65536})
+        self._send(404, {"error": {"code": 404, "message": f"Không có endpoint {path}", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        path = self.path.partition("?")[0]
+        body = self._body()
+        try:
+            match = re.fullmatch(r"/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)", path)
+            if match:
+                return self._gemini(json.loads(body or b"{}"), stream=match.group(2) == "streamGenerateContent")
+            if path == "/v1beta/cachedContents":
+                request = json.loads(body or b"{}")
+                return self._send(200, {"name": self.state.next_cache_name(), "model": request.get("model"),
+                                        "expireTime": "2099-01-01T00:00:00Z"})
+            if path == "/speech-api/v2/recognize":
+                return self._speech()
+            if path == "/_/TranslateWebserverUi/data/batchexecute":
+                return self._tts(body.decode("utf-8"))
+        except (ValueError, KeyError, IndexError) as e:
+            return self._send(400, {"error": {"code": 400, "message": f"Request không hợp lệ: {e}", "status": "INVALID_ARGUMENT"}})
+        self._send(404, {"error": {"code": 404, "message": f"Không có endpoint {path}", "status": "NOT_FOUND"}})
+
+    def _gemini(self, body, stream):
+        reply, entry = gemini_reply(self.state, body)
+        latency, status = self.state.draw("gemini", entry)
+        time.sleep(latency)
+        if status != 200:
+            return self._send(status, _gemini_error(status))
+        prompt_tokens = _estimate_tokens(_request_text(body) + json.dumps(body.get("systemInstruction", "")))
+        reply_tokens = _estimate_tokens(reply)
+        if not stream:
+            return self._send(200, _gemini_chunk(reply, True, prompt_tokens, reply_tokens))
+
+        # SSE theo từng đoạn chunk_chars ký tự, chunk cuối mang usageMetadata
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, self.state.chunk_chars)
+        pieces = [reply[i:i + step] for i in range(0, len(reply), step)] or [""]
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(self.state.sample_chunk_delay())
+            chunk = _gemini_chunk(piece, index == len(pieces) - 1, prompt_tokens, reply_tokens)
+            self._send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+        self._send_chunk(b"")
+
+    def _speech(self):
+        latency, status = self.state.draw("speech")
+        time.sleep(latency)
+        if status != 200:
+            return self._send(status, "", "text/plain")
+        self._send(200, _speech_response(self.state.next_transcript()), "application/json; charset=utf-8")
+
+    def _tts(self, body):
+        text = _tts_text(body)
+        latency, status = self.state.draw("tts")
+        time.sleep(latency)
+        if status != 200:
+            return self._send(status, "", "text/plain")
+        self._send(200, _tts_response(self.state, text), "application/json; charset=utf-8")
+
+def load_script(path):
+    """Đọc kịch bản JSON (không có file thì dùng câu trả lời mặc định)"""
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def create_server(host="127.0.0.1", port=8787, script=None, seed=None, verbose=False):
+    """Tạo server giả lập (chưa chạy) - dùng được trong script benchmark khác"""
+    handler = type("Handler", (MockHandler,), {"state": MockState(script or {}, seed), "verbose": verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    if load_dotenv:
+        load_dotenv(Path(__file__).parent / ".env")
+
+    parser = argparse.ArgumentParser(description="Server giả lập Gemini / Google Speech / gTTS")
+    parser.add_argument("--host", default=os.getenv("MOCK_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MOCK_PORT", "8787")))
+    parser.add_argument("--script", default=os.getenv("MOCK_SCRIPT_FILE"), help="File kịch bản JSON")
+    parser.add_argument("--seed", type=int, default=int(os.getenv("MOCK_SEED")) if os.getenv("MOCK_SEED") else None)
+    parser.add_argument("--verbose", action="store_true", help="In từng request")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, load_script(args.script), args.seed, args.verbose)
+    print(f"🧪 Mock services chạy tại http://{args.host}:{args.port} (seed={args.seed}, kịch bản={args.script or 'mặc định'})")
+    for name, profile in server.RequestHandlerClass.state.profiles.items():
+        print(f"   {name}: lỗi {profile.error_rate:.0%}, 429 {profile.rate_limit_rate:.0%}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Dừng mock services")
+        print(json.dumps(server.RequestHandlerClass.state.snapshot(), ensure_ascii=False, indent=2))
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
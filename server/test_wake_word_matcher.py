@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test WakeWordMatcher: các câu phải đánh thức và các câu nói thường không được đánh thức
+"""
+
+import pytest
+
+from audio_utils.wake_word_matcher import WakeWordMatcher
+
+# Không phân biệt dấu/khoảng trắng/ký tự lặp, sai 1 ký tự vẫn đánh thức
+WAKE_CASES = [
+    "hello hello",
+    "Hê lô hê lô, hôm nay thứ mấy",
+    "helo helo",
+    "hellooo hello bật đèn",
+    "ừ hello hello",
+    "hello hellu",
+]
+
+# Câu nói thường: wake word không được bắt đầu giữa từ
+FALSE_WAKE_CASES = [
+    "thế lo hết lòng",
+    "chè lô hẹn lo",
+    "khe lo he lo",
+    "thể lô hê lô",
+]
+
+@pytest.fixture(scope="module")
+def matcher():
+    return WakeWordMatcher(["hello hello"])
+
+@pytest.mark.parametrize("text", WAKE_CASES)
+def test_wake(matcher, text):
+    match = matcher.find(text)
+    assert match is not None
+    assert match.phrase == "hello hello"
+
+@pytest.mark.parametrize("text", FALSE_WAKE_CASES)
+def test_false_wake(matcher, text):
+    assert matcher.find(text) is None
+
+def test_match_ends_on_word_boundary(matcher):
+    text = "hello hellu hôm nay thứ mấy"
+    match = matcher.find(text)
+    assert text[match.end:].strip() == "hôm nay thứ mấy"
+
+def test_short_phrase_is_exact():
+    matcher = WakeWordMatcher(["alo"])
+    assert matcher.find("alo alo") is not None
+    assert matcher.find("ali") is None
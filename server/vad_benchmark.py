@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+VAD Benchmark - Phát lại các bản ghi đã gán nhãn qua từng VAD engine
+Báo cáo tỉ lệ false trigger (mở record khi không có giọng nói), số câu bị bỏ lỡ
+và thời gian CPU mỗi frame 20ms.
+
+Định dạng dữ liệu: 1 thư mục chứa các file WAV (16kHz mono 16-bit) và file
+labels.json ánh xạ tên file -> danh sách đoạn speech [start_s, end_s]:
+    {
+        "hello_01.wav": [[1.2, 2.8]],
+        "door_click.wav": []
+    }
+
+Sử dụng:
+    python vad_benchmark.py test_recordings/vad_labeled
+    python vad_benchmark.py --synthetic test_recordings/vad_synthetic   # tạo bộ dữ liệu giả lập rồi chạy
+"""
+
+import argparse
+import json
+import os
+import time
+import wave
+
+import numpy as np
+
+import audio_utils.server_config as config
+from audio_utils.feature_cache import FeatureCache
+from audio_utils.asr_processor import VAD_ENGINES, create_vad
+from audio_utils.noise_floor import NoiseFloorEstimator, adaptive_speech_threshold
+
+# Onset sớm hơn đầu câu trong khoảng này vẫn tính là đúng (lookback sẽ bù)
+ONSET_TOLERANCE = 0.3
+
+def load_wav(path):
+    """Đọc WAV 16-bit mono, trả về bytes PCM"""
+    with wave.open(path, 'rb') as wf:
+        if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() != config.SAMPLE_RATE:
+            raise ValueError(f"{path}: cần WAV 16kHz mono 16-bit")
+        return wf.readframes(wf.getnframes())
+
+def replay(audio_data, engine):
+    """
+    Phát lại 1 bản ghi qua FeatureCache + VAD giống asr_worker
+
+    Returns:
+        tuple: (mảng is_speech theo frame, thời gian feature (s), thời gian VAD (s))
+    """
+    cache = FeatureCache()
+    vad = create_vad(engine)
+    noise_floor = NoiseFloorEstimator()
+
+    decisions = []
+    feature_time = 0.0
+    vad_time = 0.0
+    for offset in range(0, len(audio_data) - config.FRAME_BYTES + 1, config.FRAME_BYTES):
+        chunk = audio_data[offset:offset + config.FRAME_BYTES]
+
+        start = time.perf_counter()
+        slot = cache.push(chunk)
+        feature_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        noise_floor.push(cache.rms[slot])
+        adaptive_rms_threshold = adaptive_speech_threshold(noise_floor)
+        is_speech, _ = vad.process(cache, slot, adaptive_rms_threshold)
+        vad_time += time.perf_counter() - start
+
+        decisions.append(is_speech)
+    return np.array(decisions, dtype=bool), feature_time, vad_time
+
+def score(decisions, segments):
+    """So sánh quyết định VAD với nhãn, trả về dict thống kê"""
+    frame_s = config.FRAME_SAMPLES / config.SAMPLE_RATE
+    times = np.arange(len(decisions)) * frame_s
+    labels = np.zeros(len(decisions), dtype=bool)
+    for seg_start, seg_end in segments:
+        labels |= (times >= seg_start) & (times < seg_end)
+
+    onsets = np.flatnonzero(decisions & ~np.concatenate(([False], decisions[:-1])))
+    false_onsets = 0
+    for idx in onsets:
+        t = times[idx]
+        if not any(seg_start - ONSET_TOLERANCE <= t < seg_end for seg_start, seg_end in segments):
+            false_onsets += 1
+    missed = sum(1 for seg_start, seg_end in segments
+                 if not decisions[(times >= seg_start) & (times < seg_end)].any())
+
+    return {
+        "frames": len(decisions),
+        "correct_frames": int(np.sum(decisions == labels)),
+        "onsets": len(onsets),
+        "false_onsets": false_onsets,
+        "segments": len(segments),
+        "missed_segments": missed,
+        "non_speech_seconds": float(np.sum(~labels) * frame_s),
+    }
+
+def run_benchmark(data_dir, engines):
+    """Chạy benchmark trên thư mục dữ liệu cho các VAD engine"""
+    with open(os.path.join(data_dir, "labels.json"), 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+
+    recordings = []
+    for filename, segments in sorted(labels.items()):
+        path = os.path.join(data_dir, filename)
+        if not os.path.exists(path):
+            print(f"⚠️ Bỏ qua file không tồn tại: {path}")
+            continue
+        recordings.append((filename, load_wav(path), segments))
+    print(f"📂 {len(recordings)} bản ghi từ {data_dir}")
+
+    results = {}
+    for engine in engines:
+        totals = {}
+        feature_time = vad_time = 0.0
+        for filename, audio_data, segments in recordings:
+            decisions, f_time, v_time = replay(audio_data, engine)
+            feature_time += f_time
+            vad_time += v_time
+            for key, value in score(decisions, segments).items():
+                totals[key] = totals.get(key, 0) + value
+        totals["feature_us_per_frame"] = feature_time / max(1, totals["frames"]) * 1e6
+        totals["vad_us_per_frame"] = vad_time / max(1, totals["frames"]) * 1e6
+        results[engine] = totals
+
+    print("=" * 78)
+    print(f"{'engine':<10} {'acc':>6} {'onsets':>7} {'false':>6} {'false/min':>10} "
+          f"{'missed':>8} {'feat µs':>8} {'vad µs':>8}")
+    for engine, t in results.items():
+        false_per_min = t["false_onsets"] / max(t["non_speech_seconds"] / 60.0, 1e-9)
+        print(f"{engine:<10} {t['correct_frames'] / max(1, t['frames']):>6.1%} {t['onsets']:>7} "
+              f"{t['false_onsets']:>6} {false_per_min:>10.2f} "
+              f"{t['missed_segments']:>4}/{t['segments']:<3} "
+              f"{t['feature_us_per_frame']:>8.1f} {t['vad_us_per_frame']:>8.1f}")
+    print("=" * 78)
+    return results
+
+def create_synthetic_dataset(data_dir, n_files=6, seed=0):
+    """
+    Tạo bộ dữ liệu giả lập: noise nền + tiếng click (không phải speech)
+    và các đoạn âm hữu thanh có formant (đóng vai speech)
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    sr = config.SAMPLE_RATE
+    labels = {}
+
+    for i in range(n_files):
+        duration = 6.0
+        t = np.arange(int(duration * sr)) / sr
+        audio = rng.normal(0, 150, len(t))
+        segments = []
+
+        # Tiếng click/gõ: xung ngắn biên độ lớn
+        for click_t in rng.uniform(0.2, duration - 0.2, size=4):
+            start = int(click_t * sr)
+            length = int(0.004 * sr)
+            audio[start:start + length] += rng.normal(0, 6000, length) * np.hanning(length)
+
+        # Nửa số file có "giọng nói": âm hữu thanh f0 ~120-220Hz, nhiều harmonic
+        if i % 2 == 0:
+            seg_start = rng.uniform(1.0, 2.0)
+            seg_end = seg_start + rng.uniform(1.0, 2.5)
+            mask = (t >= seg_start) & (t < seg_end)
+            f0 = rng.uniform(120, 220) * (1 + 0.05 * np.sin(2 * np.pi * 3 * t))
+            phase = 2 * np.pi * np.cumsum(f0) / sr
+            voiced = sum(np.sin(k * phase) / k for k in range(1, 15))
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+            audio[mask] += 2500 * voiced[mask] * envelope[mask]
+            segments.append([round(seg_start, 3), round(seg_end, 3)])
+
+        filename = f"synthetic_{i:02d}.wav"
+        with wave.open(os.path.join(data_dir, filename), 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(sr)
+            wf.writeframes(np.clip(audio, -32768, 32767).astype(np.int16).tobytes())
+        labels[filename] = segments
+
+    with open(os.path.join(data_dir, "labels.json"), 'w', encoding='utf-8') as f:
+        json.dump(labels, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã tạo {n_files} bản ghi giả lập trong {data_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark độ chính xác và CPU của các VAD engine")
+    parser.add_argument("data_dir", help="Thư mục chứa WAV + labels.json")
+    parser.add_argument("--engines", nargs="+", default=list(VAD_ENGINES),
+                        help=f"Các engine cần so sánh (mặc định: {' '.join(VAD_ENGINES)})")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Tạo bộ dữ liệu giả lập vào data_dir trước khi chạy")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        create_synthetic_dataset(args.data_dir)
+    run_benchmark(args.data_dir, args.engines)
+
+if __name__ == "__main__":
+    main()